@@ -1,9 +1,20 @@
 import frappe
+import mimetypes
+from contextlib import closing
 from werkzeug.wrappers import Response
-from werkzeug.wsgi import wrap_file
 from pathlib import Path
 from dms.utils.files import FileManager, get_home_folder
-from io import BytesIO
+from dms.utils.delivery import send_file_content, send_stream
+from dms.utils.cache import BoundedCache
+
+# Embeds are pasted into documents and shown on every view, so small ones are kept in Redis -
+# within a budget, least recently used first out
+embed_cache = BoundedCache(
+    "dms-embeds",
+    max_bytes=256 * 1024 * 1024,
+    max_item_size=2 * 1024 * 1024,
+    expires_in_sec=24 * 60 * 60,
+)
 
 
 @frappe.whitelist(allow_guest=True)
@@ -19,7 +30,7 @@ def get_file_content(embed_name, parent_entity_name):
     :raises FileLockedError: If the file has been writer-locked
     """
     # Used for <v0.1 support, also a security flaw
-    old_parent_name = frappe.get_list(
+    old_parent_name = frappe.get_all(
         "DMS File",
         {"old_name": parent_entity_name},
         ["name"],
@@ -34,44 +45,63 @@ def get_file_content(embed_name, parent_entity_name):
         user=frappe.session.user,
     ):
         raise frappe.PermissionError("You do not have permission to view this file")
-    cache_key = "embed-" + embed_name
-    embed_data = None
-    if frappe.cache().exists(cache_key):
-        embed_data = frappe.cache().get_value(cache_key)
-    if not embed_data:
-        dms_entity = frappe.get_value(
+    manager = FileManager()
+    mimetype = mimetypes.guess_type(embed_name)[0]
+    # Presigned redirects and range requests never go through the cached copy
+    direct = (manager.s3_enabled and manager.presigned_urls) or "Range" in frappe.request.headers
+    if not direct:
+        embed_data = embed_cache.get(embed_name)
+        if embed_data is not None:
+            return embed_response(embed_data, mimetype, embed_name)
+
+    dms_entity = frappe.get_value(
+        "DMS File",
+        parent_entity_name,
+        ["document", "title", "mime_type", "file_size", "owner", "path", "team"],
+        as_dict=1,
+    )
+    if not dms_entity:
+        dms_entity = frappe.get_all(
             "DMS File",
-            parent_entity_name,
-            ["document", "title", "mime_type", "file_size", "owner", "path", "team"],
-            as_dict=1,
-        )
-        if not dms_entity:
-            dms_entity = frappe.get_list(
-                "DMS File",
-                {"old_name": parent_entity_name},
-                fields=["document", "title", "mime_type", "file_size", "owner", "path", "team"],
-            )[0]
+            {"old_name": parent_entity_name},
+            fields=["document", "title", "mime_type", "file_size", "owner", "path", "team"],
+        )[0]
 
-        if not dms_entity.document:
-            raise ValueError
-        embed_path = frappe.get_value("DMS File", embed_name, "path")
-        # Remove at some point
-        if not embed_path:
-            embed_path = str(
-                Path(
-                    get_home_folder(dms_entity.team)["path"],
-                    "embeds",
-                    embed_name,
-                )
+    if not dms_entity.document:
+        raise ValueError
+    embed_path = frappe.get_value("DMS File", embed_name, "path")
+    # Remove at some point
+    if not embed_path:
+        embed_path = str(
+            Path(
+                get_home_folder(dms_entity.team)["path"],
+                "embeds",
+                embed_name,
             )
-        # Flaw? Doesn't stream for range header
-        manager = FileManager()
-        embed_data = BytesIO(manager.get_file(embed_path).read())
-        frappe.cache().set_value(cache_key, (embed_data))
+        )
+    if direct:
+        return send_file_content(manager, embed_path, mimetype, download_name=embed_name)
 
-    response = Response(
-        wrap_file(frappe.request.environ, embed_data),
-        direct_passthrough=True,
-    )
+    # Large embeds are streamed from storage rather than held in Redis
+    stream = manager.stream_file(embed_path)
+    if stream.size > embed_cache.max_item_size:
+        return send_stream(stream, mimetype, embed_name)
+    with closing(stream):
+        embed_data = b"".join(stream.iter_range(0, stream.size))
+    embed_cache.set(embed_name, embed_data)
+    return embed_response(embed_data, mimetype, embed_name)
+
+
+def embed_response(data, mimetype, embed_name):
+    response = Response(data, mimetype=mimetype or "application/octet-stream")
     response.headers.set("Content-Disposition", "inline", filename=embed_name)
     return response
+
+
+@frappe.whitelist()
+def get_embed_cache_stats():
+    """
+    Hit rate and memory use of the embed cache
+    """
+    frappe.only_for("System Manager")
+    return embed_cache.stats()
@@ -1,11 +1,13 @@
-import os, re, json, mimetypes
+import os, json, re, posixpath
+from base64 import b64encode
+from urllib.parse import urlencode
 
 import frappe
 from pypika import Order
-from .permissions import get_teams, user_has_permission
+from .permissions import get_teams, user_has_permission, get_bulk_access
 from pathlib import Path
 from werkzeug.wrappers import Response
-from werkzeug.utils import secure_filename, send_file
+from werkzeug.utils import secure_filename
 from io import BytesIO
 import mimemapper
 import jwt
@@ -15,8 +17,11 @@ from dms.utils.files import (
     get_file_type,
     get_new_title,
     update_file_size,
+    get_file_size,
     if_folder_exists,
+    get_lineage_names,
     FileManager,
+    THUMBNAIL_SIZES,
 )
 from datetime import date, timedelta
 import magic
@@ -28,6 +33,24 @@ from io import BytesIO
 from werkzeug.wrappers import Response
 from werkzeug.wsgi import wrap_file
 from dms.locks.distributed_lock import DistributedLock
+from dms.utils.delivery import send_file_content, presigned_redirect
+from dms.utils.uploads import UploadSession, preallocate, write_chunk
+from dms.utils.thumbnails import queue_thumbnail, get_sprite_map
+from dms.utils.video import is_video, queue_video, get_video_manifest, VIDEO_CONTENT_TYPES
+from dms.utils.pages import (
+    can_render_pages,
+    queue_pages,
+    get_pages_manifest,
+    read_page_image,
+    read_page_text,
+    PAGE_WIDTHS,
+)
+from dms.utils.cache import get_bytes, set_bytes
+
+# Thumbnails are held in Redis as raw bytes, for an hour, up to this size
+THUMBNAIL_CACHE_EXPIRY = 60 * 60
+THUMBNAIL_CACHE_MAX_SIZE = 256 * 1024
+THUMBNAIL_BATCH_LIMIT = 500
 
 
 @frappe.whitelist()
@@ -44,76 +67,203 @@ def upload_file(team, personal=None, fullpath=None, parent=None, last_modified=N
     :return: DMSEntity doc once the entire file has been uploaded
     """
     home_folder = get_home_folder(team)
-    parent = parent or home_folder["name"]
-    is_private = personal or frappe.get_value("DMS File", parent, "is_private")
     embed = int(embed)
-
-    if fullpath:
-        dirname = os.path.dirname(fullpath).split("/")
-        for i in dirname:
-            parent = if_folder_exists(team, i, parent, is_private)
-
-    # Validate: team members can upload to team folders, and permissions
-    is_team_member = team in get_teams() and not is_private
-    if not is_team_member and not frappe.has_permission(
-        doctype="DMS File", doc=parent, ptype="write", user=frappe.session.user
-    ):
-        frappe.throw("Ask the folder owner for upload access.", frappe.PermissionError)
-
-    storage_data = storage_bar_data(team)
-    if (storage_data["limit"] - storage_data["total_size"]) < int(
-        frappe.form_dict.total_file_size
-    ):
-        frappe.throw("You're out of storage!", ValueError)
-
     file = frappe.request.files["file"]
-    upload_session = frappe.form_dict.uuid
-    title = get_new_title(frappe.form_dict.filename if embed else file.filename, parent)
     current_chunk = int(frappe.form_dict.chunk_index)
     total_chunks = int(frappe.form_dict.total_chunk_count)
+    total_size = int(frappe.form_dict.total_file_size)
+    offset = int(frappe.form_dict.chunk_byte_offset)
+
+    manager = FileManager()
+    session = UploadSession(frappe.form_dict.uuid)
+    result = session.result
+    if result and result.owner != frappe.session.user:
+        frappe.throw("This upload belongs to someone else.", frappe.PermissionError)
+    if result and result.entity_name:
+        # A chunk retried after the upload finished
+        return frappe.get_doc("DMS File", result.entity_name)
+    meta = session.meta
+    if not meta:
+        # Chunks can be sent in parallel - the first one to get the lock sets the upload up
+        with session.lock():
+            meta = session.meta or start_upload_session(
+                session,
+                manager,
+                team,
+                home_folder,
+                personal,
+                fullpath,
+                parent,
+                frappe.form_dict.filename if embed else file.filename,
+                total_size,
+                embed,
+            )
+    if meta.owner != frappe.session.user:
+        frappe.throw("This upload belongs to someone else.", frappe.PermissionError)
+
+    # S3 gets each chunk as a part of a multipart upload, disk writes it at its offset
+    data = file.stream.read()
+    etag = None
+    if manager.s3_enabled:
+        etag = manager.upload_part(meta.key, meta.upload_id, current_chunk + 1, data)
+    else:
+        write_chunk(meta.temp_path, offset, data)
+    received = session.record(current_chunk, offset, len(data), etag)
+    if received < total_chunks or not session.claim(meta.owner):
+        return
+    try:
+        dms_file = finish_upload(session, manager, meta, team, total_size, last_modified, embed)
+    except Exception:
+        # Let a retried chunk finish the upload
+        session.release()
+        raise
+    session.finish(meta.owner, dms_file.name)
+    return dms_file
+
 
-    temp_path = get_upload_path(home_folder["name"], f"{upload_session}_{secure_filename(title)}")
-    with temp_path.open("ab") as f:
-        f.seek(int(frappe.form_dict.chunk_byte_offset))
-        f.write(file.stream.read())
-        if (
-            not f.tell() >= int(frappe.form_dict.total_file_size)
-            or current_chunk != total_chunks - 1
-        ):
-            return
-
-    # Validate that file size is matching
-    file_size = temp_path.stat().st_size
-    if file_size != int(frappe.form_dict.total_file_size):
-        temp_path.unlink()
+def finish_upload(session, manager, meta, team, total_size, last_modified, embed):
+    """
+    Assemble the stored chunks of a claimed upload into the file and create its entity, along
+    with the folders of its path.
+
+    :raises ValueError: If the chunks don't cover exactly `total_size` bytes
+    :return: DMSEntity doc
+    """
+    # Validate that every byte has been received, and nothing more
+    chunks = session.chunks
+    file_size = sum(length for _, length, _ in chunks.values())
+    if file_size != total_size or session.missing_ranges(total_size):
+        session.delete()
+        if manager.s3_enabled:
+            manager.abort_multipart_upload(meta.key, meta.upload_id)
+        else:
+            Path(meta.temp_path).unlink(missing_ok=True)
         frappe.throw("Size on disk does not match specified filesize.", ValueError)
 
-    mime_type = mimemapper.get_mime_type(str(temp_path), native_first=False)
-    if mime_type is None:
-        mime_type = magic.from_buffer(open(temp_path, "rb").read(2048), mime=True)
+    if manager.s3_enabled:
+        manager.complete_multipart_upload(
+            meta.key, meta.upload_id, [(i + 1, tag) for i, (_, _, tag) in chunks.items()]
+        )
+        head = b"".join(manager.stream_file(meta.key).iter_range(0, 2048))
+    else:
+        with open(meta.temp_path, "rb") as f:
+            head = f.read(2048)
+    mime_type = meta.mime_type or magic.from_buffer(head, mime=True)
+
+    # The folders of its path are only created now, so rejected uploads leave none behind
+    parent = meta.parent
+    for folder in meta.folders or []:
+        parent = if_folder_exists(team, folder, parent, meta.is_private)
 
     # Create DB record
     dms_file = create_dms_file(
         team,
-        is_private,
-        title,
+        meta.is_private,
+        get_new_title(meta.title, parent),
         parent,
         file_size,
         mime_type,
         last_modified,
-        lambda n: Path(home_folder["name"])
-        / f"{'embeds' if embed else ''}"
-        / f"{n}{temp_path.suffix}",
+        lambda _: meta.key,
+        name=meta.name,
     )
 
     # Upload and update parent folder size
-    manager = FileManager()
-    manager.upload_file(str(temp_path), dms_file.path, dms_file if not embed else None)
+    if not manager.s3_enabled:
+        manager.upload_file(meta.temp_path, dms_file.path)
+    if not embed and manager.can_create_thumbnail(dms_file):
+        queue_thumbnail(dms_file)
+    if not embed and is_video(mime_type):
+        queue_video(dms_file)
+    elif not embed and can_render_pages(mime_type):
+        queue_pages(dms_file)
     update_file_size(parent, file_size)
-
     return dms_file
 
 
+def start_upload_session(
+    session, manager, team, home_folder, personal, fullpath, parent, filename, total_size, embed
+):
+    """
+    Validate an upload and fix everything about it that must not change between its chunks:
+    the parent folder, the folders of its path to create in it, entity name and storage key.
+    The file is preallocated on disk, or a multipart upload is started on S3.
+
+    :return: Session meta
+    """
+    parent = parent or home_folder["name"]
+    is_private = personal or frappe.get_value("DMS File", parent, "is_private")
+
+    # Validate: team members can upload to team folders, and permissions
+    is_team_member = team in get_teams() and not is_private
+    if not is_team_member and not frappe.has_permission(
+        doctype="DMS File", doc=parent, ptype="write", user=frappe.session.user
+    ):
+        frappe.throw("Ask the folder owner for upload access.", frappe.PermissionError)
+
+    storage_data = storage_bar_data(team)
+    if (storage_data["limit"] - storage_data["total_size"]) < total_size:
+        frappe.throw("You're out of storage!", ValueError)
+
+    name = frappe.generate_hash(length=10)
+    meta = {
+        "owner": frappe.session.user,
+        "parent": parent,
+        # Created under the parent, by the chunk that finishes the upload
+        "folders": os.path.dirname(fullpath).split("/") if fullpath else [],
+        "is_private": is_private,
+        "name": name,
+        "title": filename,
+        "total_size": total_size,
+        "mime_type": mimemapper.get_mime_type(filename, native_first=False),
+        "key": str(
+            Path(home_folder["name"])
+            / f"{'embeds' if embed else ''}"
+            / f"{name}{Path(secure_filename(filename)).suffix}"
+        ),
+    }
+    if manager.s3_enabled:
+        meta["upload_id"] = manager.start_multipart_upload(meta["key"], meta["mime_type"])
+    else:
+        meta["temp_path"] = str(
+            get_upload_path(home_folder["name"], f"{session.uuid}_{secure_filename(filename)}")
+        )
+        preallocate(meta["temp_path"], total_size)
+
+    if not session.create(meta):
+        if manager.s3_enabled:
+            manager.abort_multipart_upload(meta["key"], meta["upload_id"])
+        return session.meta
+    return frappe._dict(meta)
+
+
+@frappe.whitelist()
+def get_upload_status(uuid):
+    """
+    Return what the server has of a chunked upload, so an interrupted upload can be resumed by
+    sending only the missing chunks.
+
+    :param uuid: Upload session ID sent with every chunk
+    :return: Received chunk indexes, received and missing [start, stop) byte ranges, and the
+        created entity once the upload has finished
+    """
+    session = UploadSession(uuid)
+    result = session.result
+    if result and result.owner == frappe.session.user and result.entity_name:
+        return {"entity_name": result.entity_name}
+
+    meta = session.meta
+    if not meta or meta.owner != frappe.session.user:
+        frappe.throw("No such upload - it may have expired.", frappe.NotFound)
+    return {
+        "title": meta.title,
+        "total_size": meta.total_size,
+        "chunks": sorted(session.chunks),
+        "received": session.received_ranges(),
+        "missing": session.missing_ranges(meta.total_size),
+    }
+
+
 @frappe.whitelist(allow_guest=True)
 def upload_chunked_file(personal=0, parent=None, last_modified=None):
     """
@@ -151,86 +301,458 @@ def upload_chunked_file(personal=0, parent=None, last_modified=None):
     mime_type = frappe.form_dict.mime_type
     current_chunk = int(frappe.form_dict.chunk_index)
     total_chunks = int(frappe.form_dict.total_chunk_count)
-    file_size = int(frappe.form_dict.total_file_size)
+    total_size = int(frappe.form_dict.total_file_size)
+    offset = int(frappe.form_dict.chunk_byte_offset)
     save_path = Path(embed_directory) / f"{secure_filename(name+file_ext)}"
-    if current_chunk == 0 and save_path.exists():
-        frappe.throw(f"File '{title}' already exists", FileExistsError)
-
-    if not mime_type:
-        mime_type = magic.from_buffer(open(save_path, "rb").read(2048), mime=True)
 
-    with save_path.open("ab") as f:
-        f.seek(int(frappe.form_dict.chunk_byte_offset))
-        f.write(file.stream.read())
+    session = UploadSession(name)
+    result = session.result
+    if result and result.owner != frappe.session.user:
+        frappe.throw("This upload belongs to someone else.", frappe.PermissionError)
+    if result and result.entity_name:
+        return result.entity_name + save_path.suffix
+    meta = session.meta
+    if not meta:
+        with session.lock():
+            meta = session.meta
+            if not meta:
+                if save_path.exists():
+                    frappe.throw(f"File '{title}' already exists", FileExistsError)
+                save_path.parent.mkdir(exist_ok=True)
+                preallocate(save_path, total_size)
+                meta = frappe._dict(owner=frappe.session.user, total_size=total_size)
+                session.create(meta)
+    if meta.owner != frappe.session.user:
+        frappe.throw("This upload belongs to someone else.", frappe.PermissionError)
+
+    data = file.stream.read()
+    write_chunk(save_path, offset, data)
+    received = session.record(current_chunk, offset, len(data))
+    if received < total_chunks or not session.claim(meta.owner):
+        return
 
-    if current_chunk + 1 == total_chunks:
-        file_size = save_path.stat().st_size
-
-    if file_size != int(frappe.form_dict.total_file_size):
-        save_path.unlink()
-        frappe.throw("Size on disk does not match specified filesize", ValueError)
-    dms_file = create_dms_file(
-        dms_entity.team,
-        personal,
-        title,
-        parent,
-        file_size,
-        mime_type,
-        last_modified,
-        lambda n: Path(home_directory["name"]) / "embeds" / f"{n}{save_path.suffix}",
-    )
-    os.rename(save_path, Path(frappe.get_site_path("private/files")) / dms_file.path)
+    try:
+        file_size = sum(length for _, length, _ in session.chunks.values())
+        if file_size != total_size or session.missing_ranges(total_size):
+            session.delete()
+            save_path.unlink()
+            frappe.throw("Size on disk does not match specified filesize", ValueError)
+
+        if not mime_type:
+            with save_path.open("rb") as f:
+                mime_type = magic.from_buffer(f.read(2048), mime=True)
+        dms_file = create_dms_file(
+            dms_entity.team,
+            personal,
+            title,
+            parent,
+            file_size,
+            mime_type,
+            last_modified,
+            lambda n: Path(home_directory["name"]) / "embeds" / f"{n}{save_path.suffix}",
+        )
+        os.rename(save_path, Path(frappe.get_site_path("private/files")) / dms_file.path)
+    except Exception:
+        # Let a retried chunk finish the upload
+        session.release()
+        raise
+    session.finish(meta.owner, dms_file.name)
 
     return dms_file.name + save_path.suffix
 
 
 @frappe.whitelist()
-def get_thumbnail(entity_name):
+def get_thumbnail(entity_name, size=None):
+    """
+    Return the thumbnail of a file, or an HTML preview for text files and documents.
+
+    :param size: Longest side, in pixels, the thumbnail is shown at. Rounded up to the nearest
+        rendition, defaults to the full thumbnail
+    """
     dms_file = frappe.get_value(
         "DMS File",
         entity_name,
-        ["is_group", "path", "title", "mime_type", "file_size", "owner", "team", "document"],
+        [
+            "name",
+            "is_group",
+            "is_link",
+            "path",
+            "title",
+            "mime_type",
+            "file_size",
+            "owner",
+            "team",
+            "document",
+            "modified",
+        ],
         as_dict=1,
     )
     if not dms_file or dms_file.is_group or dms_file.is_link:
         frappe.throw("No thumbnail for this type.", ValueError)
     if not frappe.has_permission(
-        doctype="DMS File", doc=dms_file.name, ptype="write", user=frappe.session.user
+        doctype="DMS File", doc=dms_file.name, ptype="read", user=frappe.session.user
     ):
-        frappe.throw("Cannot upload due to insufficient permissions", frappe.PermissionError)
+        frappe.throw("You don't have access to this file.", frappe.PermissionError)
+
+    size = get_rendition_size(size)
+    version = f"{dms_file.modified:%Y%m%d%H%M%S%f}"
+    etag = get_thumbnail_etag(dms_file, size)
+    if etag in frappe.request.if_none_match:
+        return thumbnail_response(b"", etag, dms_file, status=304)
+
+    manager = FileManager()
+    if manager.s3_enabled and manager.presigned_urls and manager.can_create_thumbnail(dms_file):
+        # Renditions that have not been resized yet are created below, on this request
+        path = str(manager.get_thumbnail_path(dms_file.team, entity_name, size))
+        url = manager.file_exists(path) and manager.get_presigned_url(
+            path, "image/webp", entity_name
+        )
+        if url:
+            return presigned_redirect(url, manager.presigned_url_expiry)
+
+    # Keyed by `modified`, so a changed file never gets a stale thumbnail
+    cache_key = f"dms-thumbnail:{etag}"
+    thumbnail = get_bytes(cache_key)
+    if thumbnail is not None:
+        return thumbnail_response(thumbnail, etag, dms_file)
+
+    html_key = f"dms-thumbnail-html:{entity_name}-{version}"
+    html = get_bytes(html_key)
+    if html is not None:
+        return html.decode()
 
     with DistributedLock(dms_file.path, exclusive=False):
-        thumbnail_data = None
-        if frappe.cache().exists(entity_name):
-            thumbnail_data = frappe.cache().get_value(entity_name)
-
-        if not thumbnail_data:
-            thumbnail_data = None
-            try:
-                manager = FileManager()
-                thumbnail = manager.get_thumbnail(dms_file.team, entity_name)
-                thumbnail_data = BytesIO(thumbnail.read())
-                frappe.cache().set_value(entity_name, thumbnail_data, expires_in_sec=60 * 60)
-            except FileNotFoundError:
-                if dms_file.mime_type.startswith("text"):
-                    with manager.get_file(dms_file.path) as f:
-                        thumbnail_data = f.read()[:1000].decode("utf-8").replace("\n", "<br/>")
-                elif dms_file.mime_type == "frappe_doc":
-                    html = frappe.get_value("DMS Document", dms_file.document, "raw_content")
-                    thumbnail_data = html[:1000]
-                if thumbnail_data:
-                    frappe.cache().set_value(entity_name, thumbnail_data, expires_in_sec=60 * 60)
-
-    if isinstance(thumbnail_data, BytesIO):
-        response = Response(
-            wrap_file(frappe.request.environ, thumbnail_data),
-            direct_passthrough=True,
+        try:
+            thumbnail = manager.get_thumbnail(dms_file.team, entity_name, size).read()
+        except FileNotFoundError:
+            thumbnail = None
+            if dms_file.mime_type.startswith("text"):
+                with manager.get_file(dms_file.path) as f:
+                    html = f.read()[:1000].decode("utf-8").replace("\n", "<br/>")
+            elif dms_file.mime_type == "frappe_doc":
+                html = frappe.get_value("DMS Document", dms_file.document, "raw_content")[:1000]
+
+    if thumbnail is not None:
+        set_bytes(cache_key, thumbnail, THUMBNAIL_CACHE_EXPIRY, THUMBNAIL_CACHE_MAX_SIZE)
+        return thumbnail_response(thumbnail, etag, dms_file)
+    if html:
+        set_bytes(html_key, html.encode(), THUMBNAIL_CACHE_EXPIRY, THUMBNAIL_CACHE_MAX_SIZE)
+    return html
+
+
+@frappe.whitelist()
+def get_thumbnails(entity_names, size=None):
+    """
+    Thumbnail manifest for many entities at once, e.g. a folder's grid view.
+
+    Permissions are resolved in bulk, and thumbnails already held in Redis are inlined as data
+    URIs. Every other entry gets a versioned `get_thumbnail` URL that the browser may cache
+    as immutable.
+
+    :param entity_names: JSON list of entity names, at most `THUMBNAIL_BATCH_LIMIT`
+    :param size: As for `get_thumbnail`
+    :return: Dict of entity name to `url`, `etag` and, if cached, `data`. Entities that can't
+        be read or have no thumbnail are left out.
+    """
+    if isinstance(entity_names, str):
+        entity_names = json.loads(entity_names)
+    if len(entity_names) > THUMBNAIL_BATCH_LIMIT:
+        frappe.throw(f"At most {THUMBNAIL_BATCH_LIMIT} thumbnails per request.", ValueError)
+
+    size = get_rendition_size(size)
+    entities = frappe.get_all(
+        "DMS File",
+        filters={"name": ["in", entity_names], "is_group": 0, "is_link": 0, "is_active": 1},
+        fields=[
+            "name",
+            "owner",
+            "team",
+            "is_private",
+            "is_group",
+            "lineage",
+            "mime_type",
+            "modified",
+        ],
+    )
+    access = get_bulk_access(entities)
+    manager = FileManager()
+    entities = [
+        e
+        for e in entities
+        if access[e.name]["read"] and e.mime_type and manager.can_create_thumbnail(e)
+    ]
+
+    etags = {e.name: get_thumbnail_etag(e, size) for e in entities}
+    with frappe.cache().pipeline() as pipe:
+        for etag in etags.values():
+            pipe.get(frappe.cache().make_key(f"dms-thumbnail:{etag}"))
+        cached = dict(zip(etags, pipe.execute()))
+
+    manifest = {}
+    for entity in entities:
+        url = "/api/method/dms.api.files.get_thumbnail?" + urlencode(
+            {"entity_name": entity.name, "size": size or "", "v": str(entity.modified)}
         )
-        response.headers.set("Content-Type", "image/jpeg")
-        response.headers.set("Content-Disposition", "inline", filename=entity_name)
-        return response
+        item = {"url": url, "etag": etags[entity.name]}
+        if cached[entity.name]:
+            item["data"] = "data:image/webp;base64," + b64encode(cached[entity.name]).decode()
+        manifest[entity.name] = item
+    return manifest
+
+
+@frappe.whitelist()
+def get_folder_sprite(entity_name):
+    """
+    Offset map of the folder's sprite sheet - the small thumbnails of its files in a single
+    image - for painting a grid view with one image request.
+
+    :return: Dict with `url` of the sheet, its `width` and `height`, the `tile` size, and
+        `tiles`: entity name to `x`, `y`, `w`, `h` and the file's `modified` (`v`). None while
+        the sheet is being built.
+    """
+    folder = frappe.get_value(
+        "DMS File", entity_name, ["name", "team", "is_group", "is_private", "owner"], as_dict=1
+    )
+    if not folder or not folder.is_group:
+        frappe.throw("Not a folder.", NotADirectoryError)
+    if not frappe.has_permission(
+        doctype="DMS File", doc=entity_name, ptype="read", user=frappe.session.user
+    ):
+        frappe.throw("You don't have access to this folder.", frappe.PermissionError)
+
+    offsets = get_sprite_map(folder)
+    if not offsets:
+        return None
+    url = "/api/method/dms.api.files.get_folder_sprite_image?" + urlencode(
+        {"entity_name": entity_name, "v": offsets["version"]}
+    )
+    return {**offsets, "url": url}
+
+
+@frappe.whitelist()
+def get_folder_sprite_image(entity_name, v):
+    """
+    Serve a version of a folder's sprite sheet. Versions are never rewritten, so the response
+    is cached as immutable.
+
+    :param v: Sheet version from `get_folder_sprite`
+    """
+    folder = frappe.get_value("DMS File", entity_name, ["name", "team", "is_group"], as_dict=1)
+    if not folder or not folder.is_group or not v.isalnum():
+        frappe.throw("No such sprite sheet.", frappe.DoesNotExistError)
+    if not frappe.has_permission(
+        doctype="DMS File", doc=entity_name, ptype="read", user=frappe.session.user
+    ):
+        frappe.throw("You don't have access to this folder.", frappe.PermissionError)
+
+    etag = f"sprite-{entity_name}-{v}"
+    if etag in frappe.request.if_none_match:
+        response = Response(status=304)
     else:
-        return thumbnail_data
+        manager = FileManager()
+        sprite_path, _ = manager.get_sprite_path(folder.team, entity_name, v)
+        try:
+            response = Response(manager.get_file(str(sprite_path)).read(), mimetype="image/webp")
+        except FileNotFoundError:
+            frappe.throw("No such sprite sheet.", frappe.DoesNotExistError)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = 365 * 24 * 60 * 60
+    response.cache_control.immutable = True
+    return response
+
+
+@frappe.whitelist()
+def get_video(entity_name):
+    """
+    Streaming assets of a video: a poster, a storyboard for seek previews and an HLS playlist.
+    Videos are transcoded in the background after upload - until then, None is returned.
+
+    :return: The video's manifest with URLs for `poster`, `storyboard` and `playlist`
+    """
+    dms_file = get_readable_file(entity_name, is_video)
+    manifest = get_video_manifest(dms_file)
+    if not manifest or manifest.get("failed"):
+        return None
+    url = "/api/method/dms.api.files.get_video_asset?"
+    return {
+        **manifest,
+        "poster": url + urlencode({"entity_name": entity_name, "asset": "poster.jpg"}),
+        "storyboard": {
+            **manifest["storyboard"],
+            "url": url + urlencode({"entity_name": entity_name, "asset": "storyboard.jpg"}),
+        },
+        "playlist": "/api/method/dms.api.files.get_video_playlist?"
+        + urlencode({"entity_name": entity_name}),
+    }
+
+
+@frappe.whitelist()
+def get_video_playlist(entity_name, playlist="master.m3u8"):
+    """
+    Serve an HLS playlist of a video. The stored playlists use relative paths, so every URI in
+    them is rewritten: variant playlists go through this endpoint and segments to a presigned
+    URL where the bucket allows it, or to `get_video_asset`.
+
+    :param playlist: `master.m3u8`, or the `index.m3u8` of a rendition
+    """
+    if not re.fullmatch(r"master\.m3u8|\d+p/index\.m3u8", playlist):
+        frappe.throw("No such playlist.", frappe.DoesNotExistError)
+    dms_file = get_readable_file(entity_name, is_video)
+    manager = FileManager()
+    path = manager.get_video_path(dms_file.team, entity_name, f"hls/{playlist}")
+    try:
+        lines = manager.get_file(str(path)).read().decode().splitlines()
+    except FileNotFoundError:
+        frappe.throw("No such playlist.", frappe.DoesNotExistError)
+
+    presigned = manager.s3_enabled and manager.presigned_urls
+    directory = posixpath.dirname(playlist)
+    for i, line in enumerate(lines):
+        if not line or line.startswith("#"):
+            continue
+        uri = posixpath.normpath(posixpath.join(directory, line))
+        if uri.endswith(".m3u8"):
+            lines[i] = "/api/method/dms.api.files.get_video_playlist?" + urlencode(
+                {"entity_name": entity_name, "playlist": uri}
+            )
+        elif presigned:
+            segment = manager.get_video_path(dms_file.team, entity_name, f"hls/{uri}")
+            lines[i] = manager.get_presigned_url(str(segment), VIDEO_CONTENT_TYPES[".ts"])
+        else:
+            lines[i] = "/api/method/dms.api.files.get_video_asset?" + urlencode(
+                {"entity_name": entity_name, "asset": f"hls/{uri}"}
+            )
+
+    # Presigned URLs expire, so the rewritten playlist is never cached
+    response = Response("\n".join(lines) + "\n", mimetype=VIDEO_CONTENT_TYPES[".m3u8"])
+    response.cache_control.private = True
+    response.cache_control.no_store = True
+    return response
+
+
+@frappe.whitelist()
+def get_video_asset(entity_name, asset):
+    """
+    Serve a video's poster, storyboard or an HLS segment.
+
+    :param asset: `poster.jpg`, `storyboard.jpg` or `hls/<rendition>/segment_<n>.ts`
+    """
+    if not re.fullmatch(r"poster\.jpg|storyboard\.jpg|hls/\d+p/segment_\d+\.ts", asset):
+        frappe.throw("No such asset.", frappe.DoesNotExistError)
+    dms_file = get_readable_file(entity_name, is_video)
+    manager = FileManager()
+    path = manager.get_video_path(dms_file.team, entity_name, asset)
+    return send_file_content(
+        manager,
+        str(path),
+        mimetype=VIDEO_CONTENT_TYPES[Path(asset).suffix],
+        download_name=Path(asset).name,
+    )
+
+
+@frappe.whitelist()
+def get_pages(entity_name):
+    """
+    Page count and page sizes of a PDF or office document, for previews that load one page at
+    a time. Pages are rendered in the background after upload, a batch at a time - `rendered`
+    is the number available so far. Until rendering starts, None is returned.
+
+    :return: The document's manifest with a `url` for page images. Fill in `page` and `width`
+    """
+    dms_file = get_readable_file(entity_name, can_render_pages)
+    manifest = get_pages_manifest(dms_file)
+    if not manifest or manifest.get("failed"):
+        return None
+    url = "/api/method/dms.api.files.get_page?" + urlencode(
+        {"entity_name": entity_name, "v": str(dms_file.modified)}
+    )
+    return {**manifest, "widths": PAGE_WIDTHS, "url": url}
+
+
+@frappe.whitelist()
+def get_page(entity_name, page, width=None):
+    """
+    Serve the image of one page of a document.
+
+    :param page: Page number, starting at 1
+    :param width: Width, in pixels, the page is shown at. Rounded up to the nearest rendered
+        width, defaults to the widest
+    """
+    dms_file = get_readable_file(entity_name, can_render_pages)
+    page = int(page)
+    width = next((w for w in PAGE_WIDTHS if w >= int(width)), None) if width else None
+    width = width or PAGE_WIDTHS[-1]
+    etag = f"{dms_file.name}-page-{page}-{width}-{dms_file.modified:%Y%m%d%H%M%S%f}"
+    if etag in frappe.request.if_none_match:
+        return thumbnail_response(b"", etag, dms_file, status=304)
+    try:
+        return thumbnail_response(read_page_image(dms_file, page, width), etag, dms_file)
+    except FileNotFoundError:
+        frappe.throw("This page hasn't been rendered yet.", frappe.DoesNotExistError)
+
+
+@frappe.whitelist()
+def get_page_text(entity_name, page):
+    """
+    Text layer of one page of a document, for search and selection over page images.
+
+    :param page: Page number, starting at 1
+    """
+    dms_file = get_readable_file(entity_name, can_render_pages)
+    try:
+        return read_page_text(dms_file, int(page))
+    except FileNotFoundError:
+        frappe.throw("This page hasn't been rendered yet.", frappe.DoesNotExistError)
+
+
+def get_readable_file(entity_name, can_preview):
+    """
+    :param can_preview: Called with the file's MIME type, returns whether the preview applies
+    :raises NotFound: If the file doesn't exist or is of another type
+    :raises PermissionError: If the current user cannot read the file
+    """
+    dms_file = frappe.get_value(
+        "DMS File",
+        {"name": entity_name, "is_active": 1},
+        ["name", "team", "mime_type", "modified"],
+        as_dict=1,
+    )
+    if not dms_file or not can_preview(dms_file.mime_type):
+        frappe.throw("Not found", frappe.NotFound)
+    if not frappe.has_permission(
+        doctype="DMS File", doc=entity_name, ptype="read", user=frappe.session.user
+    ):
+        frappe.throw("You do not have permission to view this file", frappe.PermissionError)
+    return dms_file
+
+
+def get_rendition_size(size):
+    """
+    Round a requested size up to the nearest rendition, None for the full thumbnail
+    """
+    return next((s for s in THUMBNAIL_SIZES if s >= int(size)), None) if size else None
+
+
+def get_thumbnail_etag(dms_file, size):
+    return f"{dms_file.name}-{size or 'full'}-{dms_file.modified:%Y%m%d%H%M%S%f}"
+
+
+def thumbnail_response(data, etag, dms_file, status=200):
+    """
+    Thumbnails only change along with their file, so a URL that carries the file's `modified`
+    (`v`) is cached as immutable. Other URLs are revalidated against the ETag.
+    """
+    response = Response(data, status=status, mimetype="image/webp")
+    response.headers.set("Content-Disposition", "inline", filename=dms_file.name)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    if frappe.form_dict.v == str(dms_file.modified):
+        response.cache_control.max_age = 365 * 24 * 60 * 60
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
 
 
 @frappe.whitelist()
@@ -277,7 +799,16 @@ def get_upload_path(team_name, file_name):
 
 
 def create_dms_file(
-    team, personal, title, parent, file_size, mime_type, last_modified, entity_path, document=None
+    team,
+    personal,
+    title,
+    parent,
+    file_size,
+    mime_type,
+    last_modified,
+    entity_path,
+    document=None,
+    name=None,
 ):
     dms_file = frappe.get_doc(
         {
@@ -292,7 +823,7 @@ def create_dms_file(
         }
     )
     dms_file.flags.file_created = True
-    dms_file.insert()
+    dms_file.insert(set_name=name)
     dms_file.path = str(entity_path(dms_file.name))
     dms_file.save()
     if last_modified:
@@ -574,56 +1105,15 @@ def get_file_content(entity_name, trigger_download=0, jwt_token=None):
         html = frappe.get_value("DMS Document", dms_file.document, "raw_content")
         return html
     else:
-        manager = FileManager()
-        return send_file(
-            manager.get_file(dms_file.path),
+        return send_file_content(
+            FileManager(),
+            dms_file.path,
             mimetype=dms_file.mime_type,
-            as_attachment=trigger_download,
-            conditional=True,
-            max_age=3600,
             download_name=dms_file.title,
-            environ=frappe.request.environ,
+            as_attachment=trigger_download,
         )
 
 
-def stream_file_content(dms_file, range_header):
-    """
-    Stream file content and optionally trigger download
-
-    :param entity_name: Document-name of the file whose content is to be streamed
-    :param dms_file: DMS File record object
-    """
-    path = Path(frappe.get_site_path("private/files")) / dms_file.path
-    size = os.path.getsize(path)
-    byte1, byte2 = 0, None
-
-    m = re.search("(\d+)-(\d*)", range_header)
-    g = m.groups()
-
-    if g[0]:
-        byte1 = int(g[0])
-    if g[1]:
-        byte2 = int(g[1])
-
-    length = size - byte1
-
-    max_length = 20 * 1024 * 1024  # 20 MB in bytes
-    if length > max_length:
-        length = max_length
-
-    if byte2 is not None:
-        length = byte2 - byte1
-
-    data = None
-    with open(path, "rb") as f:
-        f.seek(byte1)
-        data = f.read(length)
-
-    res = Response(data, 206, mimetype=mimetypes.guess_type(path)[0], direct_passthrough=True)
-    res.headers.add("Content-Range", "bytes {0}-{1}/{2}".format(byte1, byte1 + length - 1, size))
-    return res
-
-
 @frappe.whitelist(allow_guest=True)
 def list_entity_comments(entity_name):
     Comment = frappe.qb.DocType("Comment")
@@ -741,31 +1231,23 @@ def remove_or_restore(entity_names, team):
         frappe.throw(f"Expected list but got {type(entity_names)}", ValueError)
 
     def depth_zero_toggle_is_active(doc):
+        file_size = get_file_size(doc)
         if doc.is_active:
             flag = 0
         else:
-            if (storage_data["limit"] - storage_data["total_size"]) < doc.file_size:
+            if (storage_data["limit"] - storage_data["total_size"]) < file_size:
                 frappe.throw("You're out of storage!", ValueError)
             flag = 1
 
         doc.is_active = flag
-        folder_size = frappe.db.get_value("DMS File", doc.parent_entity, "file_size")
-        frappe.db.set_value(
-            "DMS File",
-            doc.parent_entity,
-            "file_size",
-            folder_size + doc.file_size * (1 if flag else -1),
-        )
-
+        update_file_size(doc.parent_entity, file_size * (1 if flag else -1))
         doc.save()
 
+    access = get_bulk_access(entity_names)
     for entity in entity_names:
-        doc = frappe.get_doc("DMS File", entity)
-        if not frappe.has_permission(
-            doctype="DMS File", user=frappe.session.user, doc=doc, ptype="write"
-        ):
+        if not access.get(entity, {}).get("write"):
             raise frappe.PermissionError("You do not have permission to remove this file")
-        depth_zero_toggle_is_active(doc)
+        depth_zero_toggle_is_active(frappe.get_doc("DMS File", entity))
 
 
 @frappe.whitelist(allow_guest=True)
@@ -882,6 +1364,11 @@ def move(entity_names, new_parent=None, is_private=None):
     if not entity_names or not isinstance(entity_names, list):
         frappe.throw(f"Expected a non-empty list but got {type(entity_names)}", ValueError)
 
+    # Check every entity before moving any
+    access = get_bulk_access(entity_names)
+    if not all(access.get(entity, {}).get("write") for entity in entity_names):
+        frappe.throw("Not permitted", frappe.PermissionError)
+
     for entity in entity_names:
         doc = frappe.get_doc("DMS File", entity)
         res = doc.move(new_parent, is_private)
@@ -937,32 +1424,8 @@ def get_ancestors_of(entity_name):
     """
     Return all parent nodes till the root node
     """
-    # CONCAT_WS('/', t.title, gp.path),
-    entity_name = frappe.db.escape(entity_name)
-    result = frappe.db.sql(
-        f"""
-        WITH RECURSIVE generated_path as (
-        SELECT
-            `tabDMS File`.name,
-            `tabDMS File`.parent_entity
-        FROM `tabDMS File`
-        WHERE `tabDMS File`.name = {entity_name}
-
-        UNION ALL
-
-        SELECT
-            t.name,
-            t.parent_entity
-        FROM generated_path as gp
-        JOIN `tabDMS File` as t ON t.name = gp.parent_entity)
-        SELECT name FROM generated_path;
-    """,
-        as_dict=0,
-    )
     # Match the output of frappe/nested.py get_ancestors_of
-    flattened_list = [item for sublist in result for item in sublist]
-    flattened_list.pop(0)
-    return flattened_list
+    return get_lineage_names(entity_name)[-2::-1]
 
 
 @frappe.whitelist()
@@ -1,8 +1,9 @@
 import frappe
 import json
-from dms.utils.files import get_home_folder, MIME_LIST_MAP, get_file_type
-from .permissions import ENTITY_FIELDS, get_user_access, get_teams
-from pypika import Order, Criterion, functions as fn, CustomFunction
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from dms.utils.files import get_home_folder, MIME_LIST_MAP, get_file_type, add_pending_sizes
+from .permissions import ENTITY_FIELDS, get_bulk_access, get_user_access, get_teams
+from pypika import Order, Criterion, functions as fn
 
 
 DMSUser = frappe.qb.DocType("User")
@@ -14,8 +15,112 @@ TeamMember = frappe.qb.DocType("DMS Team Member")
 DMSFavourite = frappe.qb.DocType("DMS Favourite")
 Recents = frappe.qb.DocType("DMS Entity Log")
 DMSEntityTag = frappe.qb.DocType("DMS Entity Tag")
+SizeDelta = frappe.qb.DocType("DMS Size Delta")
+
+# Size changes of folders not compacted into `file_size` yet, per folder
+PendingSizes = (
+    frappe.qb.from_(SizeDelta)
+    .select(SizeDelta.entity, fn.Sum(SizeDelta.delta).as_("delta"))
+    .groupby(SizeDelta.entity)
+    .as_("pending")
+)
+
+# Columns listings can be sorted on, and the row key their value is returned under
+SORT_FIELDS = {
+    "title": (DMSFile.title, "title"),
+    "owner": (DMSFile.owner, "owner"),
+    "modified": (DMSFile.modified, "modified"),
+    "creation": (DMSFile.creation, "creation"),
+    # Sizes as listed, with their pending changes (see `join_sort_field`)
+    "file_size": (DMSFile.file_size + fn.Coalesce(PendingSizes.delta, 0), "file_size"),
+    # Folders have no MIME type, and NULLs can't be compared against a cursor
+    "mime_type": (fn.Coalesce(DMSFile.mime_type, ""), "mime_type"),
+}
+
+# Rows in a page of a listing when none is asked for, and the most that are served at once
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Kept up to date by the DMS File and DMS Permission hooks
+COUNT_FIELDS = [DMSFile.child_count, DMSFile.share_count, DMSFile.share_kind]
+
+
+def add_counts(r):
+    """
+    Fill in `children`, `file_type` and `share_count` for a listed entity. A share count of -2
+    means public, -1 the whole team.
+    """
+    r["children"] = r.pop("child_count")
+    r["file_type"] = get_file_type(r)
+    share_kind = r.pop("share_kind")
+    if share_kind == "Public":
+        r["share_count"] = -2
+    elif share_kind == "Team":
+        r["share_count"] = -1
+
+
+def get_sort_field(field):
+    if field not in SORT_FIELDS:
+        frappe.throw(f"Cannot sort by {field}", ValueError)
+    return SORT_FIELDS[field]
+
+
+def get_page_size(limit):
+    return max(1, min(int(limit or PAGE_SIZE), MAX_PAGE_SIZE))
+
+
+def join_sort_field(query, field):
+    """
+    Join what a sort field needs: folders are listed with the size changes not compacted yet
+    (see `add_pending_sizes`), so they are sorted and paged on the same sizes.
+    """
+    if field == "file_size":
+        query = query.left_join(PendingSizes).on(PendingSizes.entity == DMSFile.name)
+    return query
+
+
+def encode_cursor(*values):
+    return urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    :return: Sort value and tiebreak of the row the cursor points at
+    """
+    try:
+        value, tiebreak = json.loads(urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        frappe.throw("Invalid cursor", ValueError)
+    return value, tiebreak
 
-Binary = CustomFunction("BINARY", ["expression"])
+
+def paginate(query, key, tiebreak, ascending, cursor, limit):
+    """
+    Keyset pagination: order by (`key`, `tiebreak`) and return the `limit` rows after the
+    cursor's position. The tiebreak is unique per row, so rows whose sort values are equal
+    are neither repeated nor skipped across pages, and each page is an index range scan no
+    matter how deep it is.
+
+    :param cursor: `cursor` of the last row of the previous page, if any
+    """
+    order = Order.asc if ascending else Order.desc
+    query = query.orderby(key, order=order).orderby(tiebreak, order=order).limit(limit)
+    if cursor:
+        value, last = decode_cursor(cursor)
+        if ascending:
+            query = query.where((key > value) | ((key == value) & (tiebreak > last)))
+        else:
+            query = query.where((key < value) | ((key == value) & (tiebreak < last)))
+    return query
+
+
+def add_cursors(rows, key, tiebreak):
+    """
+    Give each row an opaque `cursor`: pass the last one back to get the next page.
+    """
+    for r in rows:
+        value = r[key] if r[key] is not None else ""
+        r["cursor"] = encode_cursor(value, r[tiebreak])
 
 
 @frappe.whitelist(allow_guest=True)
@@ -24,7 +129,7 @@ def files(
     entity_name=None,
     order_by="modified 1",
     is_active=1,
-    limit=20,
+    limit=PAGE_SIZE,
     cursor=None,
     favourites_only=0,
     recents_only=0,
@@ -41,6 +146,8 @@ def files(
     folders = int(folders)
     personal = int(personal)
     ascending = int(ascending)
+    limit = get_page_size(limit)
+    sort_key, sort_row_key = get_sort_field(field)
 
     if not entity_name:
         # If not specified, get home folder
@@ -70,6 +177,7 @@ def files(
         # Give defaults as a team member
         .select(
             *ENTITY_FIELDS,
+            *COUNT_FIELDS,
             fn.Coalesce(DMSPermission.read, user_access["read"]).as_("read"),
             fn.Coalesce(DMSPermission.comment, user_access["comment"]).as_("comment"),
             fn.Coalesce(DMSPermission.share, user_access["share"]).as_("share"),
@@ -77,12 +185,6 @@ def files(
         )
         .where(fn.Coalesce(DMSPermission.read, user_access["read"]).as_("read") == 1)
     )
-    # Cursor pagination
-    if cursor:
-        query = query.where(
-            (Binary(DMSFile[field]) > cursor if ascending else field < cursor)
-        ).limit(limit)
-
     if only_parent and (not recents_only and not favourites_only):
         query = query.where(DMSFile.parent_entity == entity_name)
     else:
@@ -98,17 +200,12 @@ def files(
     ).select(DMSFavourite.name.as_("is_favourite"))
 
     if recents_only:
-        query = (
-            query.right_join(Recents)
-            .on((Recents.entity_name == DMSFile.name) & (Recents.user == frappe.session.user))
-            .orderby(Recents.last_interaction, order=Order.desc)
-        )
+        query = query.right_join(Recents)
+        # Most recently accessed first, whatever the sort order
+        sort_key, sort_row_key, ascending = Recents.last_interaction, "accessed", 0
     else:
-        query = (
-            query.left_join(Recents)
-            .on((Recents.entity_name == DMSFile.name) & (Recents.user == frappe.session.user))
-            .orderby(DMSFile[field], order=Order.asc if ascending else Order.desc)
-        )
+        query = query.left_join(Recents)
+    query = query.on((Recents.entity_name == DMSFile.name) & (Recents.user == frappe.session.user))
 
     if favourites_only or recents_only:
         query = query.where((DMSFile.is_private == 0) | (DMSFile.owner == frappe.session.user))
@@ -148,45 +245,13 @@ def files(
     if folders:
         query = query.where(DMSFile.is_group == 1)
 
-    child_count_query = (
-        frappe.qb.from_(DMSFile)
-        .where((DMSFile.team == team) & (DMSFile.is_active == 1))
-        .select(DMSFile.parent_entity, fn.Count("*").as_("child_count"))
-        .groupby(DMSFile.parent_entity)
-    )
-    share_query = (
-        frappe.qb.from_(DMSFile)
-        .right_join(DMSPermission)
-        .on(DMSPermission.entity == DMSFile.name)
-        .where((DMSPermission.user != "") & (DMSPermission.user != "$TEAM"))
-        .select(DMSFile.name, fn.Count("*").as_("share_count"))
-        .groupby(DMSFile.name)
-    )
-    public_files_query = (
-        frappe.qb.from_(DMSPermission)
-        .where(DMSPermission.user == "")
-        .select(DMSPermission.entity)
-    )
-    team_files_query = (
-        frappe.qb.from_(DMSPermission)
-        .where(DMSPermission.user == "$TEAM")
-        .select(DMSPermission.entity)
-    )
-    public_files = set(k[0] for k in public_files_query.run())
-    team_files = set(k[0] for k in team_files_query.run())
-
-    children_count = dict(child_count_query.run())
-    share_count = dict(share_query.run())
+    query = join_sort_field(query, field)
+    query = paginate(query, sort_key, DMSFile.name, ascending, cursor, limit)
     res = query.run(as_dict=True)
     for r in res:
-        r["children"] = children_count.get(r["name"], 0)
-        r["file_type"] = get_file_type(r)
-        if r["name"] in public_files:
-            r["share_count"] = -2
-        elif r["name"] in team_files:
-            r["share_count"] = -1
-        else:
-            r["share_count"] = share_count.get(r["name"], 0)
+        add_counts(r)
+    add_pending_sizes(res)
+    add_cursors(res, sort_row_key, "name")
 
     return res
 
@@ -195,7 +260,8 @@ def files(
 def shared(
     by=0,
     order_by="modified",
-    limit=1000,
+    limit=PAGE_SIZE,
+    cursor=None,
     tag_list=[],
     mime_type_list=[],
 ):
@@ -203,6 +269,7 @@ def shared(
     Returns the highest level of shared items shared with/by the current user, group or org
 
     :param entity_name: Document-name of the folder whose contents are to be listed.
+    :param cursor: `cursor` of the last item of the previous page, to get the next one
     :raises NotADirectoryError: If this DMSFile doc is not a folder
     :return: List of DMSEntities with permissions
     :rtype: list[frappe._dict]
@@ -215,10 +282,10 @@ def shared(
             (DMSPermission.entity == DMSFile.name)
             & ((DMSPermission.owner if by else DMSPermission.user) == frappe.session.user)
         )
-        .limit(limit)
         .where((DMSPermission.read == 1) & (DMSFile.is_active == 1))
         .select(
             *ENTITY_FIELDS,
+            *COUNT_FIELDS,
             DMSFile.team,
             DMSPermission.user,
             DMSPermission.owner.as_("sharer"),
@@ -226,14 +293,10 @@ def shared(
             DMSPermission.share,
             DMSPermission.comment,
             DMSPermission.write,
+            DMSPermission.name.as_("permission"),
         )
     )
 
-    query = query.orderby(
-        order_by.split()[0],
-        order=Order.desc if order_by.endswith("desc") else Order.asc,
-    )
-
     if tag_list:
         tag_list = json.loads(tag_list)
         query = query.left_join(DMSEntityTag).on(DMSEntityTag.parent == DMSFile.name)
@@ -246,50 +309,91 @@ def shared(
             Criterion.any(DMSFile.mime_type == mime_type for mime_type in mime_type_list)
         )
 
-    # Extremely inefficient
-    child_count_query = (
-        frappe.qb.from_(DMSFile)
-        .where((DMSFile.is_active == 1))
-        .select(DMSFile.parent_entity, fn.Count("*").as_("child_count"))
-        .groupby(DMSFile.parent_entity)
-    )
-    share_query = (
-        frappe.qb.from_(DMSFile)
-        .right_join(DMSPermission)
-        .on(DMSPermission.entity == DMSFile.name)
-        .where((DMSPermission.user != "") & (DMSPermission.user != "$TEAM"))
-        .select(DMSFile.name, fn.Count("*").as_("share_count"))
-        .groupby(DMSFile.name)
-    )
-    public_files_query = (
-        frappe.qb.from_(DMSPermission)
-        .where(DMSPermission.user == "")
-        .select(DMSPermission.entity)
-    )
-    team_files_query = (
-        frappe.qb.from_(DMSPermission)
-        .where(DMSPermission.user == "$TEAM")
-        .select(DMSPermission.entity)
-    )
-    public_files = set(k[0] for k in public_files_query.run())
-    team_files = set(k[0] for k in team_files_query.run())
+    # Shared by the current user, a file appears once per permission - which breaks ties
+    field = order_by.split()[0]
+    sort_key, sort_row_key = get_sort_field(field)
+    query = join_sort_field(query, field)
+    ascending = not order_by.endswith("desc")
+    limit = get_page_size(limit)
+
+    # Items whose parent is listed too are left out, so a page can come back short or even
+    # empty while more rows follow. Fetch until the page is full or the rows run out.
+    res, listed = [], []
+    while len(listed) < limit:
+        wanted = limit - len(listed)
+        rows = paginate(query, sort_key, DMSPermission.name, ascending, cursor, wanted).run(
+            as_dict=True
+        )
+        add_pending_sizes(rows)
+        add_cursors(rows, sort_row_key, "permission")
+        res += rows
+        parents = {r["name"] for r in res}
+        listed = [r for r in res if r["parent_entity"] not in parents]
+        if len(rows) < wanted:
+            break
+        cursor = rows[-1]["cursor"]
+
+    for r in listed:
+        add_counts(r)
+    # The page ends at its last row, even when that one isn't listed
+    if res and listed:
+        listed[-1]["cursor"] = res[-1]["cursor"]
+    return listed
 
-    children_count = dict(child_count_query.run())
-    share_count = dict(share_query.run())
-    res = query.run(as_dict=True)
-    parents = {r["name"] for r in res}
 
-    for r in res:
-        r["children"] = children_count.get(r["name"], 0)
-        r["file_type"] = get_file_type(r)
-        if r["name"] in public_files:
-            r["share_count"] = -2
-        elif r["name"] in team_files:
-            r["share_count"] = -1
-        else:
-            r["share_count"] = share_count.get(r["name"], 0)
+@frappe.whitelist(allow_guest=True)
+def folder_tree(entity_name):
+    """
+    Everything inside a folder at any depth that the current user can read, unpaged, for
+    callers that need the whole tree at once, like folder downloads. It is read in a single
+    range scan on the folder's lineage, and items inside ones the user can't read are left out.
 
-    return [r for r in res if r["parent_entity"] not in parents]
+    :param entity_name: Document-name of the folder
+    :return: List of active entities with their `parent_entity`, shallowest first
+    """
+    entity = frappe.get_doc("DMS File", entity_name)
+    if not entity.is_group:
+        raise NotADirectoryError()
+    if not get_user_access(entity)["read"]:
+        frappe.throw("You don't have access.", frappe.PermissionError)
+
+    rows = (
+        frappe.qb.from_(DMSFile)
+        .select(
+            DMSFile.name,
+            DMSFile.title,
+            DMSFile.is_group,
+            DMSFile.document,
+            DMSFile.mime_type,
+            DMSFile.parent_entity,
+            DMSFile.owner,
+            DMSFile.team,
+            DMSFile.is_private,
+            DMSFile.lineage,
+        )
+        .where(DMSFile.lineage.like(entity.lineage + "/%") & (DMSFile.is_active == 1))
+        .orderby(fn.Length(DMSFile.lineage))
+        .run(as_dict=True)
+    )
+    access = get_bulk_access(rows)
+    readable, tree = {entity.name}, []
+    for r in rows:
+        if r.parent_entity in readable and access[r.name]["read"]:
+            readable.add(r.name)
+            tree.append(
+                {
+                    k: r[k]
+                    for k in (
+                        "name",
+                        "title",
+                        "is_group",
+                        "document",
+                        "mime_type",
+                        "parent_entity",
+                    )
+                }
+            )
+    return tree
 
 
 # @frappe.whitelist()
@@ -2,8 +2,8 @@ import frappe
 from frappe.utils import getdate
 
 from dms.utils.users import mark_as_viewed
-from dms.utils.files import get_valid_breadcrumbs, generate_upward_path, get_file_type
-
+from dms.utils.files import get_valid_breadcrumbs, get_file_type, add_pending_sizes
+from dms.utils.acl import ACCESS_TYPES, get_team_memberships, get_effective_grants
 
 ENTITY_FIELDS = [
     "name",
@@ -24,7 +24,7 @@ ENTITY_FIELDS = [
 
 
 @frappe.whitelist(allow_guest=True)
-def get_user_access(entity, user=frappe.session.user):
+def get_user_access(entity, user=None):
     """
     Return the user specific access permissions for an entity if it exists or general access permissions
 
@@ -32,49 +32,9 @@ def get_user_access(entity, user=frappe.session.user):
     :return: Dict of general access permissions (read, write)
     :rtype: frappe._dict or None
     """
-    if isinstance(entity, str):
-        entity = frappe.get_doc("DMS File", entity)
-
-    if user == entity.owner:
-        return {"read": 1, "comment": 1, "share": 1, "write": 1, "type": "admin"}
-
-    # Default access based on public or team view
-    teams = get_teams(user)
-    if entity.team in teams and entity.is_private == 0:
-        # Everyone can upload to team folders
-        admin = is_admin(entity.team)
-        access = {
-            "read": 1,
-            "comment": 1,
-            "share": 1,
-            "write": 1 if (entity.is_group or admin) else 0,
-            "type": "team-admin" if not admin else "team",
-        }
-    else:
-        access = {
-            "read": 0,
-            "comment": 0,
-            "share": 0,
-            "write": 0,
-        }
-
-    path = generate_upward_path(entity.name, user)
-    user_access = {k: v for k, v in path[-1].items() if k in access.keys()}
-    if not user or user == "Guest":
-        return user_access
-    public_path = generate_upward_path(entity.name, "Guest")
-    public_access = {k: v for k, v in public_path[-1].items() if k in access.keys()}
-
-    valid_accesses = [user_access, public_access]
-    if entity.team in teams:
-        team_path = generate_upward_path(entity.name, "$TEAM")
-        team_access = {k: v for k, v in team_path[-1].items() if k in access.keys()}
-        valid_accesses.append(team_access)
-    for access_type in valid_accesses:
-        for type, v in access_type.items():
-            if v:
-                access[type] = 1
-
+    access = get_bulk_access([entity], user or frappe.session.user).get(get_name(entity))
+    if access is None:
+        frappe.throw("We couldn't find what you're looking for.", frappe.DoesNotExistError)
     return access
 
 
@@ -124,6 +84,7 @@ def get_entity_with_permissions(entity_name):
     user_access = get_user_access(entity, frappe.session.user)
     if user_access.get("read") == 0:
         frappe.throw("You don't have access to this file.", {"error": frappe.PermissionError})
+    add_pending_sizes([entity])
 
     owner_info = (
         frappe.db.get_value("User", entity.owner, ["user_image", "full_name"], as_dict=True) or {}
@@ -220,3 +181,142 @@ def user_has_permission(doc, ptype, user):
     access = get_user_access(doc, user)
     if ptype in access:
         return access[ptype]
+
+
+def get_permission_query_conditions(user=None):
+    """
+    SQL condition on `tabDMS File` for the rows a user can read, with the same rules as
+    `get_bulk_access`, so `frappe.get_list` filters in the database: rows the user owns,
+    non-private rows of their teams, and rows with a live read grant to the user, everyone or
+    their team on the row or any of its ancestors (found through its lineage).
+    """
+    user = user or frappe.session.user
+    if user == "Administrator":
+        return ""
+    if user == "Guest":
+        user = ""
+    teams = ", ".join(frappe.db.escape(t) for t in get_team_memberships(user)) if user else ""
+
+    principals = ", ".join(frappe.db.escape(p) for p in dict.fromkeys([user, ""]))
+    grantee = f"`tabDMS Permission`.`user` IN ({principals})"
+    conditions = []
+    if user:
+        conditions.append(f"`tabDMS File`.`owner` = {frappe.db.escape(user)}")
+    if teams:
+        in_teams = f"`tabDMS File`.`team` IN ({teams})"
+        conditions.append(f"({in_teams} AND `tabDMS File`.`is_private` = 0)")
+        grantee = f"({grantee} OR (`tabDMS Permission`.`user` = '$TEAM' AND {in_teams}))"
+    granted = f"""
+        EXISTS (
+            SELECT 1 FROM `tabDMS Permission`
+            WHERE {grantee}
+                AND `tabDMS Permission`.`read` = 1
+                AND IFNULL(`tabDMS Permission`.`valid_until`, NOW()) >= NOW()
+                AND FIND_IN_SET(
+                    `tabDMS Permission`.`entity`, REPLACE(`tabDMS File`.`lineage`, '/', ',')
+                )
+        )
+    """
+    conditions.append(granted)
+    return "(" + " OR ".join(conditions) + ")"
+
+
+def get_bulk_access(entities, user=None):
+    """
+    Resolve a user's access to many entities at once.
+
+    Access is granted to the user, to everyone ("") and to team members ("$TEAM"), on the entity
+    or any of its ancestors. What each principal is granted along an entity's lineage is cached
+    in Redis (see `dms.utils.acl`), and the entities that miss are computed together in a single
+    query. Results are also memoized for the rest of the request, so the `has_permission`
+    checks of a save or upload resolve once.
+
+    :param entities: Document-names, or docs or dicts with `name`, `owner`, `team`,
+        `is_private`, `is_group` and `lineage`
+    :param user: Defaults to the current user. Guest or "" resolve public access only.
+    :return: Dict of entity name to access dict (read, comment, share, write, and `type` for
+        owners and team members)
+    """
+    if user is None:
+        user = frappe.session.user
+    if user == "Guest":
+        user = ""
+    memo = frappe.local.request_cache["dms_access"]
+    pending = [e for e in entities if (user, get_name(e)) not in memo]
+    if pending:
+        for name, access in resolve_access(pending, user).items():
+            memo[(user, name)] = access
+    return {
+        get_name(e): dict(memo[(user, get_name(e))])
+        for e in entities
+        if (user, get_name(e)) in memo
+    }
+
+
+def clear_access_cache():
+    """
+    Forget the access resolved during this request, after files move or permissions change.
+    """
+    frappe.local.request_cache.pop("dms_access", None)
+
+
+def get_name(entity):
+    return entity if isinstance(entity, str) else entity.name
+
+
+def resolve_access(entities, user):
+    entities = {get_name(e): e for e in entities}
+    unknown = [name for name, e in entities.items() if isinstance(e, str) or not e.get("lineage")]
+    if unknown:
+        entities.update(
+            {
+                e.name: e
+                for e in frappe.get_all(
+                    "DMS File",
+                    filters={"name": ["in", unknown]},
+                    fields=["name", "owner", "team", "is_private", "is_group", "lineage"],
+                )
+            }
+        )
+    entities = {name: e for name, e in entities.items() if not isinstance(e, str)}
+
+    admin_of = get_team_memberships(user) if user else {}
+    principals = [""]
+    if user:
+        principals.insert(0, user)
+    if admin_of:
+        principals.append("$TEAM")
+
+    result = {}
+    for name, entity in entities.items():
+        if user == "Administrator" or (user and entity.owner == user):
+            result[name] = {t: 1 for t in ACCESS_TYPES} | {"type": "admin"}
+    chains = {
+        name: (e.lineage or name).split("/") for name, e in entities.items() if name not in result
+    }
+    grants = get_effective_grants(chains, principals) if chains else {}
+
+    for name in chains:
+        entity = entities[name]
+        in_team = entity.team in admin_of
+        if in_team and not entity.is_private:
+            # Everyone can upload to team folders
+            admin = admin_of[entity.team]
+            access = {
+                "read": 1,
+                "comment": 1,
+                "share": 1,
+                "write": 1 if (entity.is_group or admin) else 0,
+                "type": "team-admin" if not admin else "team",
+            }
+        else:
+            access = {t: 0 for t in ACCESS_TYPES}
+
+        for principal, grant in grants[name].items():
+            if principal == "$TEAM" and not in_team:
+                continue
+            for t in ACCESS_TYPES:
+                if grant[t]:
+                    access[t] = 1
+        result[name] = access
+    return result
@@ -3,7 +3,12 @@
 
 # import frappe
 from frappe.model.document import Document
+from dms.utils.indexes import add_indexes
 
 
 class DMSEntityActivityLog(Document):
     pass
+
+
+def on_doctype_update():
+    add_indexes("DMS Entity Activity Log")
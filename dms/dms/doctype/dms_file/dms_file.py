@@ -7,14 +7,30 @@ from dms.utils.files import (
     get_new_title,
     get_team_thumbnails_directory,
     update_file_size,
+    get_file_size,
+    update_child_count,
+    get_lineage,
+    get_descendant_names,
+    update_descendants,
+    move_lineage,
     FileManager,
 )
 from dms.api.files import get_ancestors_of
+from dms.api.permissions import clear_access_cache
+from dms.utils.acl import invalidate_acl
 from dms.utils.files import generate_upward_path
 from dms.api.activity import create_new_activity_log
+from dms.utils.thumbnails import invalidate_sprite, delete_sprite
+from dms.utils.video import is_video
+from dms.utils.pages import can_render_pages
+from dms.utils.indexes import add_indexes
 
 
 class DMSFile(Document):
+    def before_save(self):
+        if not self.lineage or self.has_value_changed("parent_entity"):
+            self.lineage = get_lineage(self.parent_entity, self.name)
+
     def after_insert(self):
         full_name = frappe.db.get_value("User", {"name": frappe.session.user}, ["full_name"])
         message = f"{full_name} created {self.title}"
@@ -25,6 +41,35 @@ class DMSFile(Document):
             document_field="title",
             field_new_value=self.title,
         )
+        if self.is_active == 1:
+            update_child_count(self.parent_entity, 1)
+        if not self.is_group:
+            invalidate_sprite(self.parent_entity)
+
+    def on_update(self):
+        previous = self.get_doc_before_save()
+        if not previous:
+            return
+        if previous.lineage != self.lineage or previous.is_private != self.is_private:
+            clear_access_cache()
+        if previous.lineage and previous.lineage != self.lineage:
+            move_lineage(previous.lineage, self.lineage)
+            # What the subtree inherits changed with its ancestors
+            invalidate_acl(self.name)
+
+        # Only active entities count towards their folder's `child_count`
+        was_counted, counted = int(previous.is_active == 1), int(self.is_active == 1)
+        if previous.parent_entity != self.parent_entity or was_counted != counted:
+            update_child_count(previous.parent_entity, -was_counted)
+            update_child_count(self.parent_entity, counted)
+
+        if self.is_group:
+            return
+        if previous.parent_entity != self.parent_entity:
+            invalidate_sprite(previous.parent_entity)
+            invalidate_sprite(self.parent_entity)
+        elif previous.is_active != self.is_active or previous.title != self.title:
+            invalidate_sprite(self.parent_entity)
 
     def on_trash(self):
         frappe.db.delete("DMS Favourite", {"entity": self.name})
@@ -32,15 +77,20 @@ class DMSFile(Document):
         frappe.db.delete("DMS Permission", {"entity": self.name})
         frappe.db.delete("DMS Notification", {"notif_doctype_name": self.name})
         frappe.db.delete("DMS Entity Activity Log", {"entity": self.name})
+        frappe.db.delete("DMS Size Delta", {"entity": self.name})
+        if self.is_active == 1:
+            update_child_count(self.parent_entity, -1)
+        if not self.is_group:
+            invalidate_sprite(self.parent_entity)
 
         if self.is_group or self.document:
-            for child in self.get_children():
-                has_write_access = frappe.has_permission(
-                    doctype="DMS File",
-                    doc=self,
-                    ptype="write",
-                    user=frappe.session.user,
-                )
+            has_write_access = frappe.has_permission(
+                doctype="DMS File",
+                doc=self,
+                ptype="write",
+                user=frappe.session.user,
+            )
+            for child in self.get_descendants():
                 child.delete(ignore_permissions=has_write_access)
 
     def after_delete(self):
@@ -51,6 +101,12 @@ class DMSFile(Document):
         if self.path:
             manager = FileManager()
             manager.delete_file(self.team, self.name, self.path)
+            if is_video(self.mime_type):
+                manager.delete_directory(manager.get_video_path(self.team, self.name))
+            elif can_render_pages(self.mime_type):
+                manager.delete_directory(manager.get_pages_path(self.team, self.name))
+        if self.is_group:
+            delete_sprite(self)
 
     def on_rollback(self):
         if self.flags.file_created:
@@ -58,12 +114,17 @@ class DMSFile(Document):
 
     def get_children(self):
         """Return a generator that yields child Documents."""
-        child_names = frappe.get_list(
+        child_names = frappe.get_all(
             self.doctype, filters={"parent_entity": self.name}, pluck="name"
         )
         for name in child_names:
             yield frappe.get_doc(self.doctype, name)
 
+    def get_descendants(self):
+        """Return a generator that yields descendant Documents, deepest first."""
+        for name in get_descendant_names(self.lineage):
+            yield frappe.get_doc(self.doctype, name)
+
     def move(self, new_parent=None, is_private=None):
         """
         Move file or folder to the new parent folder
@@ -96,21 +157,15 @@ class DMSFile(Document):
         if not is_group:
             raise NotADirectoryError()
 
-        for child in self.get_children():
-            if child.name == self.name or child.name == new_parent:
-                frappe.throw(
-                    "Cannot move into itself",
-                    frappe.PermissionError,
-                )
-                return frappe.get_value(
-                    "DMS File",
-                    self.parent_entity,
-                    ["title", "team", "name", "is_private"],
-                    as_dict=True,
-                )
+        if self.name in get_ancestors_of(new_parent):
+            frappe.throw(
+                "Cannot move into itself",
+                frappe.PermissionError,
+            )
 
-        update_file_size(self.parent_entity, -self.file_size)
-        update_file_size(new_parent, +self.file_size)
+        file_size = get_file_size(self)
+        update_file_size(self.parent_entity, -file_size)
+        update_file_size(new_parent, +file_size)
 
         self.parent_entity = new_parent
         self.is_private = frappe.db.get_value("DMS File", new_parent, "is_private")
@@ -307,8 +362,7 @@ class DMSFile(Document):
         if not new_value and move_root:
             self.move()
         if self.is_group:
-            for child in self.get_children():
-                child.toggle_personal(new_value, False)
+            update_descendants(self.lineage, "is_private", new_value)
         self.save()
         return self.name
 
@@ -325,8 +379,7 @@ class DMSFile(Document):
 
         self.is_active = -1
         if self.is_group:
-            for child in self.get_children():
-                child.permanent_delete()
+            update_descendants(self.lineage, "is_active", -1)
         self.save()
 
     @frappe.whitelist()
@@ -405,4 +458,4 @@ class DMSFile(Document):
 
 
 def on_doctype_update():
-    frappe.db.add_index("DMS File", ["title"])
+    add_indexes("DMS File")
@@ -1,9 +1,18 @@
 # Copyright (c) 2025, Frappe Technologies Pvt. Ltd. and Contributors
 # See license.txt
 
-# import frappe
-from frappe.tests import IntegrationTestCase, UnitTestCase
+from types import SimpleNamespace
+from unittest.mock import patch
 
+import frappe
+from frappe.tests import IntegrationTestCase, UnitTestCase
+from dms.utils.files import (
+    get_descendant_names,
+    get_home_folder,
+    get_lineage,
+    get_lineage_names,
+)
+from dms.tests.utils import make_entity, make_team
 
 # On IntegrationTestCase, the doctype test records and all
 # link-field test record dependencies are recursively loaded
@@ -18,7 +27,20 @@ class UnitTestDMSFile(UnitTestCase):
     Use this class for testing individual functions and methods.
     """
 
-    pass
+    def test_lineage_falls_back_to_parents(self):
+        rows = {
+            "root": frappe._dict(lineage="root", parent_entity=None),
+            # Written without hooks
+            "folder": frappe._dict(lineage=None, parent_entity="root"),
+            "sub": frappe._dict(lineage=None, parent_entity="folder"),
+        }
+        db = SimpleNamespace(get_value=lambda doctype, name, *args, **kwargs: rows.get(name))
+        with patch("frappe.db", db):
+            self.assertEqual(get_lineage("sub", "file"), "root/folder/sub/file")
+            self.assertEqual(get_lineage_names("sub"), ["root", "folder", "sub"])
+            self.assertEqual(get_lineage_names("missing"), ["missing"])
+            with self.assertRaises(frappe.DoesNotExistError):
+                get_lineage("missing", "file")
 
 
 class IntegrationTestDMSFile(IntegrationTestCase):
@@ -27,4 +49,78 @@ class IntegrationTestDMSFile(IntegrationTestCase):
     Use this class for testing interactions between multiple components.
     """
 
-    pass
+    def setUp(self):
+        self.team = make_team("DMS File Test")
+        self.home = get_home_folder(self.team.name)["name"]
+
+    def test_lineage_follows_moves(self):
+        folder = make_entity(self.team.name, "Folder")
+        sub = make_entity(self.team.name, "Sub", folder.name)
+        leaf = make_entity(self.team.name, "Leaf", sub.name, is_group=0)
+        self.assertEqual(leaf.lineage, "/".join([self.home, folder.name, sub.name, leaf.name]))
+        self.assertEqual(
+            get_lineage_names(leaf.name), [self.home, folder.name, sub.name, leaf.name]
+        )
+        self.assertEqual(get_lineage_names(self.home), [self.home])
+        # Deepest first
+        self.assertEqual(get_descendant_names(folder.lineage), [leaf.name, sub.name])
+
+        other = make_entity(self.team.name, "Other")
+        sub.move(other.name)
+        self.assertEqual(
+            frappe.db.get_value("DMS File", leaf.name, "lineage"),
+            "/".join([self.home, other.name, sub.name, leaf.name]),
+        )
+        self.assertEqual(get_descendant_names(folder.lineage), [])
+        self.assertEqual(get_descendant_names(other.lineage), [leaf.name, sub.name])
+
+    def get_counts(self, entity):
+        return frappe.db.get_value(
+            "DMS File", entity.name, ["child_count", "share_count", "share_kind"], as_dict=True
+        )
+
+    def test_child_counts_follow_children(self):
+        first, second = make_entity(self.team.name, "First"), make_entity(self.team.name, "Second")
+        child = make_entity(self.team.name, "Child", first.name, is_group=0)
+        make_entity(self.team.name, "Sub", first.name)
+        self.assertEqual(self.get_counts(first).child_count, 2)
+
+        # Trashed items don't count
+        child.is_active = 0
+        child.save()
+        self.assertEqual(self.get_counts(first).child_count, 1)
+        child.is_active = 1
+        child.save()
+
+        child.parent_entity = second.name
+        child.save()
+        self.assertEqual(self.get_counts(first).child_count, 1)
+        self.assertEqual(self.get_counts(second).child_count, 1)
+
+        child.delete()
+        self.assertEqual(self.get_counts(second).child_count, 0)
+
+    def test_share_counts_follow_permissions(self):
+        folder = make_entity(self.team.name, "Shared")
+
+        def share(user):
+            return frappe.get_doc(
+                {"doctype": "DMS Permission", "entity": folder.name, "user": user, "read": 1}
+            ).insert()
+
+        share("a@example.com")
+        share("b@example.com")
+        self.assertEqual(
+            self.get_counts(folder), {"child_count": 0, "share_count": 2, "share_kind": ""}
+        )
+        team = share("$TEAM")
+        self.assertEqual(self.get_counts(folder).share_kind, "Team")
+        public = share("")
+        self.assertEqual(self.get_counts(folder).share_kind, "Public")
+
+        public.delete()
+        self.assertEqual(self.get_counts(folder).share_kind, "Team")
+        team.delete()
+        self.assertEqual(
+            self.get_counts(folder), {"child_count": 0, "share_count": 2, "share_kind": ""}
+        )
@@ -3,7 +3,11 @@
 
 import frappe
 from frappe.model.document import Document
+from dms.utils.indexes import add_indexes
 from dms.api.notifications import notify_share
+from dms.utils.files import update_share_count
+from dms.api.permissions import clear_access_cache
+from dms.utils.acl import invalidate_acl
 
 
 class DMSPermission(Document):
@@ -20,3 +24,18 @@ class DMSPermission(Document):
                 entity_name=self.entity,
                 docperm_name=self.name,
             )
+
+    def on_update(self):
+        clear_access_cache()
+        invalidate_acl(self.entity)
+        update_share_count(self.entity)
+
+    def after_delete(self):
+        clear_access_cache()
+        invalidate_acl(self.entity)
+        if frappe.db.exists("DMS File", self.entity):
+            update_share_count(self.entity)
+
+
+def on_doctype_update():
+    add_indexes("DMS Permission")
@@ -1,14 +1,20 @@
 # Copyright (c) 2025, Frappe Technologies Pvt. Ltd. and Contributors
 # See license.txt
 
-# import frappe
-from frappe.tests import IntegrationTestCase, UnitTestCase
+from datetime import timedelta
 
+import frappe
+from frappe.tests import IntegrationTestCase, UnitTestCase
+from frappe.utils import now_datetime
+from dms.api.permissions import get_bulk_access, get_permission_query_conditions
+from dms.utils.acl import get_effective_grants
+from dms.utils.files import get_lineage_names
+from dms.tests.utils import make_entity, make_team
 
 # On IntegrationTestCase, the doctype test records and all
 # link-field test record dependencies are recursively loaded
 # Use these module variables to add/remove to/from that list
-EXTRA_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
+EXTRA_TEST_RECORD_DEPENDENCIES = ["User"]
 IGNORE_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
 
 
@@ -27,4 +33,80 @@ class IntegrationTestDMSPermission(IntegrationTestCase):
     Use this class for testing interactions between multiple components.
     """
 
-    pass
+    def setUp(self):
+        self.team = make_team("DMS Permission Test")
+
+    def share(self, entity, user, **access):
+        return frappe.get_doc(
+            {"doctype": "DMS Permission", "entity": entity.name, "user": user, **access}
+        ).insert()
+
+    def can_read(self, entity, user):
+        grants = get_effective_grants({entity.name: get_lineage_names(entity.name)}, [user])
+        return grants[entity.name][user]["read"]
+
+    def test_cached_grants_follow_shares_and_moves(self):
+        folder, other = make_entity(self.team.name, "Folder"), make_entity(self.team.name, "Other")
+        leaf = make_entity(self.team.name, "Leaf", folder.name, is_group=0)
+        self.assertEqual(self.can_read(leaf, "share@example.com"), 0)
+
+        # Sharing the folder drops what its descendants had cached
+        grant = self.share(folder, "share@example.com", read=1)
+        self.assertEqual(self.can_read(leaf, "share@example.com"), 1)
+
+        leaf.move(other.name)
+        self.assertEqual(self.can_read(leaf, "share@example.com"), 0)
+        leaf.move(folder.name)
+        self.assertEqual(self.can_read(leaf, "share@example.com"), 1)
+
+        grant.delete()
+        self.assertEqual(self.can_read(leaf, "share@example.com"), 0)
+
+    def test_list_conditions_match_resolved_access(self):
+        public = make_entity(self.team.name, "Public")
+        private = make_entity(self.team.name, "Private", is_private=1)
+        inside = make_entity(self.team.name, "Inside", private.name, is_private=1)
+        shared = make_entity(self.team.name, "Shared", is_private=1)
+        leaf = make_entity(self.team.name, "Leaf", shared.name, is_private=1, is_group=0)
+        expired = make_entity(self.team.name, "Expired", is_private=1)
+        owned = make_entity(self.team.name, "Owned", is_private=1)
+        frappe.db.set_value("DMS File", owned.name, "owner", "test1@example.com")
+        entities = [public, private, inside, shared, leaf, expired, owned]
+
+        self.share(public, "", read=1)
+        self.share(private, "$TEAM", read=1)
+        self.share(shared, "test1@example.com", read=1)
+        self.share(shared, "test@example.com", write=1)
+        self.share(
+            expired,
+            "test1@example.com",
+            read=1,
+            valid_until=now_datetime() - timedelta(days=1),
+        )
+        self.team.append("users", {"user": "test@example.com", "is_admin": 0})
+        self.team.save()
+
+        def listed(user):
+            conditions = get_permission_query_conditions(user)
+            names = frappe.db.sql_list(
+                f"SELECT name FROM `tabDMS File` WHERE team = %s AND {conditions}",
+                self.team.name,
+            )
+            return {e.name for e in entities} & set(names)
+
+        def readable(user):
+            access = get_bulk_access([e.name for e in entities], user)
+            return {name for name, a in access.items() if a["read"]}
+
+        expected = {
+            # Their own item, and a grant on a folder reaches its contents
+            "test1@example.com": {public.name, owned.name, shared.name, leaf.name},
+            # Non-private team items, and what is granted to the team
+            "test@example.com": {public.name, private.name, inside.name},
+            "Guest": {public.name},
+        }
+        for user, names in expected.items():
+            with self.subTest(user=user):
+                self.assertEqual(listed(user), names)
+                self.assertEqual(readable(user), names)
+        self.assertEqual(get_permission_query_conditions("Administrator"), "")
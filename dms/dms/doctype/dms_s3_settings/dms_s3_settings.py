@@ -3,7 +3,9 @@
 
 # import frappe
 from frappe.model.document import Document
+from dms.utils.files import clear_s3_client
 
 
 class DMSS3Settings(Document):
-    pass
+    def on_update(self):
+        clear_s3_client()
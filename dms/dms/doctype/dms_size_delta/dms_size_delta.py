@@ -0,0 +1,14 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+# import frappe
+from frappe.model.document import Document
+from dms.utils.indexes import add_indexes
+
+
+class DMSSizeDelta(Document):
+    pass
+
+
+def on_doctype_update():
+    add_indexes("DMS Size Delta")
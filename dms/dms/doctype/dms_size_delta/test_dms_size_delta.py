@@ -0,0 +1,175 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests import IntegrationTestCase, UnitTestCase
+from dms.api.list import files
+from dms.utils.files import (
+    add_pending_sizes,
+    compact_size_deltas,
+    get_file_size,
+    get_home_folder,
+    get_pending_sizes,
+    update_file_size,
+)
+from dms.tests.utils import make_entity, make_team
+
+# On IntegrationTestCase, the doctype test records and all
+# link-field test record dependencies are recursively loaded
+# Use these module variables to add/remove to/from that list
+EXTRA_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
+IGNORE_TEST_RECORD_DEPENDENCIES = []  # eg. ["User"]
+
+
+class UnitTestDMSSizeDelta(UnitTestCase):
+    """
+    Unit tests for DMSSizeDelta.
+    Use this class for testing individual functions and methods.
+    """
+
+    def test_pending_sizes_are_added_to_folders_only(self):
+        rows = [
+            frappe._dict(name="folder", is_group=1, file_size=100),
+            frappe._dict(name="empty", is_group=1, file_size=None),
+            frappe._dict(name="file", is_group=0, file_size=5),
+        ]
+        with patch(
+            "dms.utils.files.get_pending_sizes", return_value={"folder": -30, "empty": 7}
+        ) as pending:
+            add_pending_sizes(rows)
+        pending.assert_called_once_with({"folder", "empty"})
+        self.assertEqual([r.file_size for r in rows], [70, 7, 5])
+
+    def test_lineage_is_journaled_in_one_insert(self):
+        with (
+            patch("dms.utils.files.get_lineage_names", return_value=["root", "child", "leaf"]),
+            patch("frappe.db.sql") as sql,
+        ):
+            update_file_size("leaf", 40)
+            update_file_size("leaf", 0)
+        sql.assert_called_once()
+        query, values = sql.call_args.args
+        self.assertEqual(query.count("NEXTVAL("), 3)
+        self.assertEqual(values[::6], ("root", "child", "leaf"))
+        self.assertEqual(set(values[1::6]), {40})
+
+
+class IntegrationTestDMSSizeDelta(IntegrationTestCase):
+    """
+    Integration tests for DMSSizeDelta.
+    Use this class for testing interactions between multiple components.
+    """
+
+    def setUp(self):
+        frappe.db.delete("DMS Size Delta")
+        team = make_team("Size Delta Test")
+        self.root = frappe.get_doc("DMS File", get_home_folder(team.name)["name"])
+        self.child = make_entity(team.name, "Child")
+        self.leaf = make_entity(team.name, "Leaf", self.child.name)
+        self.folders = [self.root, self.child, self.leaf]
+
+    def get_journal(self):
+        return frappe.get_all(
+            "DMS Size Delta", fields=["name", "entity", "delta"], order_by="name asc"
+        )
+
+    def get_stored_size(self, folder):
+        return frappe.db.get_value("DMS File", folder.name, "file_size") or 0
+
+    def test_change_is_journaled_for_each_ancestor(self):
+        update_file_size(self.leaf.name, 100)
+        update_file_size(self.child.name, -30)
+
+        journal = self.get_journal()
+        self.assertEqual(len({d.name for d in journal}), 5)
+        self.assertEqual(
+            [(d.entity, d.delta) for d in journal],
+            [
+                (self.root.name, 100),
+                (self.child.name, 100),
+                (self.leaf.name, 100),
+                (self.root.name, -30),
+                (self.child.name, -30),
+            ],
+        )
+        # The folders themselves are left alone until compaction
+        for folder in self.folders:
+            self.assertEqual(self.get_stored_size(folder), 0)
+
+    def test_pending_sizes_sum_the_journal(self):
+        update_file_size(self.leaf.name, 100)
+        update_file_size(self.child.name, -30)
+        update_file_size(self.child.name, 0)
+
+        self.assertEqual(
+            get_pending_sizes([f.name for f in self.folders]),
+            {self.root.name: 70, self.child.name: 70, self.leaf.name: 100},
+        )
+        self.assertEqual(get_pending_sizes([]), {})
+        self.assertEqual(get_file_size(frappe._dict(name=self.leaf.name, file_size=20)), 120)
+
+    def test_moves_carry_sizes_between_lineages(self):
+        other = make_entity(self.root.team, "Other")
+        file = make_entity(self.root.team, "a.bin", self.leaf.name, is_group=0, file_size=40)
+        update_file_size(self.leaf.name, 40)
+
+        file.move(other.name)
+        self.assertEqual(
+            get_pending_sizes([f.name for f in self.folders] + [other.name]),
+            {self.root.name: 40, self.child.name: 0, self.leaf.name: 0, other.name: 40},
+        )
+
+    def test_listings_sort_on_pending_sizes(self):
+        folders = [make_entity(self.root.team, t, self.child.name) for t in "ABC"]
+        for folder, size in zip(folders, (10, 30, 20)):
+            update_file_size(folder.name, size)
+
+        first = files(self.root.team, self.child.name, order_by="file_size 0", limit=2)
+        rest = files(
+            self.root.team, self.child.name, order_by="file_size 0", cursor=first[-1].cursor
+        )
+        self.assertEqual(
+            [(r.title, r.file_size) for r in first + rest],
+            [("B", 30), ("C", 20), ("A", 10), ("Leaf", 0)],
+        )
+
+    def test_compaction_folds_and_deletes_in_locked_batches(self):
+        update_file_size(self.leaf.name, 100)
+        update_file_size(self.child.name, -30)
+        modified = {
+            f.name: frappe.db.get_value("DMS File", f.name, "modified") for f in self.folders
+        }
+
+        with (
+            patch.object(frappe.db, "sql", wraps=frappe.db.sql) as sql,
+            patch.object(frappe.db, "commit") as commit,
+        ):
+            compact_size_deltas(batch_size=2)
+
+        # Five rows in batches of two, each claimed with a locking read
+        self.assertEqual(commit.call_count, 3)
+        batches = [c for c in sql.call_args_list if "FOR UPDATE" in str(c.args[0]).upper()]
+        self.assertEqual(len(batches), 4)
+
+        self.assertEqual(self.get_journal(), [])
+        self.assertEqual(
+            [self.get_stored_size(f) for f in self.folders],
+            [70, 70, 100],
+        )
+        # Compacting is no change to the folders
+        for folder in self.folders:
+            self.assertEqual(
+                frappe.db.get_value("DMS File", folder.name, "modified"), modified[folder.name]
+            )
+
+    def test_compaction_keeps_later_changes(self):
+        update_file_size(self.leaf.name, 100)
+        with patch.object(frappe.db, "commit"):
+            compact_size_deltas()
+        update_file_size(self.leaf.name, 50)
+
+        self.assertEqual(self.get_stored_size(self.leaf), 100)
+        self.leaf.reload()
+        self.assertEqual(get_file_size(self.leaf), 150)
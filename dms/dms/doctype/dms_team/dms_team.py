@@ -6,11 +6,20 @@ from frappe.model.document import Document
 from pathlib import Path
 import shutil
 from dms.utils.files import get_home_folder
+from dms.utils.acl import clear_team_memberships
+from dms.api.permissions import clear_access_cache
 
 
 class DMSTeam(Document):
     def on_update(self):
         """Creates the file on disk"""
+        previous = self.get_doc_before_save()
+        members = {m.user: m.is_admin for m in self.users}
+        before = {m.user: m.is_admin for m in previous.users} if previous else {}
+        if members != before:
+            clear_team_memberships(members.keys() | before.keys())
+            clear_access_cache()
+
         DMSFile = frappe.qb.DocType("DMS File")
         if (
             frappe.qb.from_(DMSFile)
@@ -3,7 +3,16 @@
 
 # import frappe
 from frappe.model.document import Document
+from dms.utils.acl import clear_team_memberships
+from dms.api.permissions import clear_access_cache
 
 
 class DMSTeamMember(Document):
-    pass
+    # Members are also added and removed on their own, without saving the team
+    def on_update(self):
+        clear_team_memberships([self.user])
+        clear_access_cache()
+
+    def on_trash(self):
+        clear_team_memberships([self.user])
+        clear_access_cache()
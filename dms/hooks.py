@@ -98,10 +98,9 @@ after_install = "dms.install.after_install"
 # -----------
 # Permissions evaluated in scripted ways
 
-# permission_query_conditions = {
-# 	"Event": "frappe.desk.doctype.event.event.get_permission_query_conditions",
-# }
-#
+permission_query_conditions = {
+    "DMS File": "dms.api.permissions.get_permission_query_conditions",
+}
 
 has_permission = {
     "DMS File": "dms.api.permissions.user_has_permission",
@@ -134,8 +133,12 @@ has_permission = {
 # ---------------
 
 scheduler_events = {
+    "all": ["dms.utils.thumbnails.resume_thumbnail_queue", "dms.utils.files.compact_size_deltas"],
     "daily": ["dms.api.files.auto_delete_from_trash", "dms.api.files.clear_deleted_files"],
-    "hourly": ["dms.api.permissions.auto_delete_expired_perms"],
+    "hourly": [
+        "dms.api.permissions.auto_delete_expired_perms",
+        "dms.utils.uploads.clear_stale_uploads",
+    ],
 }
 
 # Testing
@@ -0,0 +1,6 @@
+import frappe
+
+
+def execute():
+    # Embeds used to be cached under `embed-<name>` with no expiry
+    frappe.cache().delete_keys("embed-")
@@ -0,0 +1,23 @@
+import frappe
+from pypika import functions as fn
+from dms.utils.files import update_share_count
+
+
+def execute():
+    # `child_count`, `share_count` and `share_kind` used to be computed on every listing
+    DMSFile = frappe.qb.DocType("DMS File")
+    frappe.qb.update(DMSFile).set(DMSFile.child_count, 0).run()
+    child_counts = (
+        frappe.qb.from_(DMSFile)
+        .where(DMSFile.is_active == 1)
+        .select(DMSFile.parent_entity, fn.Count("*"))
+        .groupby(DMSFile.parent_entity)
+        .run()
+    )
+    for parent, count in child_counts:
+        if parent:
+            frappe.db.set_value("DMS File", parent, "child_count", count, update_modified=False)
+
+    for entity in frappe.get_all("DMS Permission", pluck="entity", distinct=True):
+        if frappe.db.exists("DMS File", entity):
+            update_share_count(entity)
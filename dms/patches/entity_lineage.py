@@ -0,0 +1,16 @@
+import frappe
+
+
+def execute():
+    # Roots first, then one level of the tree per update
+    frappe.db.sql("UPDATE `tabDMS File` SET lineage = name WHERE IFNULL(parent_entity, '') = ''")
+    while frappe.db.sql("""
+        SELECT 1 FROM `tabDMS File` f JOIN `tabDMS File` p ON p.name = f.parent_entity
+        WHERE IFNULL(f.lineage, '') = '' AND IFNULL(p.lineage, '') != ''
+        LIMIT 1
+        """):
+        frappe.db.sql("""
+            UPDATE `tabDMS File` f JOIN `tabDMS File` p ON p.name = f.parent_entity
+            SET f.lineage = CONCAT(p.lineage, '/', f.name)
+            WHERE IFNULL(f.lineage, '') = '' AND IFNULL(p.lineage, '') != ''
+            """)
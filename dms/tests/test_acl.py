@@ -0,0 +1,68 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+import frappe
+from frappe.tests import UnitTestCase
+from frappe.utils import now_datetime
+from dms.utils.acl import compute_effective_grants, get_acl_key, get_effective_grants
+
+
+class UnitTestACL(UnitTestCase):
+    def make_chain(self):
+        chain = [frappe.generate_hash(length=10) for _ in range(2)]
+        for name in chain:
+            self.addCleanup(frappe.cache().delete, get_acl_key(name))
+        return chain
+
+    def make_grant(self, entity, user, valid_until=None, **access):
+        return frappe._dict(
+            {
+                "entity": entity,
+                "user": user,
+                "valid_until": valid_until,
+                **{t: access.get(t, 0) for t in ("read", "comment", "share", "write")},
+            }
+        )
+
+    def test_grants_are_inherited_and_encoded(self):
+        root, child = self.make_chain()
+        soon, later = now_datetime() + timedelta(hours=1), now_datetime() + timedelta(days=1)
+        grants = [
+            self.make_grant(root, "user@example.com", read=1),
+            self.make_grant(child, "user@example.com", later, comment=1, write=1),
+            self.make_grant(root, "", soon, read=1),
+            self.make_grant(child, "", now_datetime() - timedelta(hours=1), write=1),
+        ]
+        with patch("frappe.get_all", return_value=grants):
+            computed = compute_effective_grants(
+                {root: [root], child: [root, child]}, ["user@example.com", "", "$TEAM"]
+            )
+
+        self.assertEqual(computed[root]["user@example.com"][0], "1000")
+        self.assertEqual(computed[child]["user@example.com"][0], f"1101|{later.timestamp()}")
+        # The earliest expiry along the chain, and expired grants are left out
+        self.assertEqual(computed[child][""][0], f"1000|{soon.timestamp()}")
+        self.assertEqual(
+            computed[child]["$TEAM"], ("0000", {"read": 0, "comment": 0, "share": 0, "write": 0})
+        )
+
+    def test_grants_are_cached_until_they_expire(self):
+        root, child = self.make_chain()
+        chains = {child: [root, child]}
+        expiry = now_datetime() + timedelta(hours=1)
+        grants = [self.make_grant(root, "user@example.com", expiry, read=1)]
+
+        with patch("frappe.get_all", return_value=grants) as get_all:
+            cached = get_effective_grants(chains, ["user@example.com"])
+            self.assertEqual(get_effective_grants(chains, ["user@example.com"]), cached)
+            self.assertEqual(get_all.call_count, 1)
+            self.assertEqual(cached[child]["user@example.com"]["read"], 1)
+
+            # A principal that was never cached misses
+            get_effective_grants(chains, ["user@example.com", ""])
+            self.assertEqual(get_all.call_count, 2)
+
+            with patch("dms.utils.acl.now_datetime", return_value=expiry + timedelta(seconds=1)):
+                expired = get_effective_grants(chains, ["user@example.com"])
+            self.assertEqual(get_all.call_count, 3)
+            self.assertEqual(expired[child]["user@example.com"]["read"], 0)
@@ -0,0 +1,66 @@
+from itertools import count
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import frappe
+from frappe.tests import UnitTestCase
+from dms.utils.cache import BoundedCache, get_bytes, set_bytes
+
+
+class UnitTestBytes(UnitTestCase):
+    def test_thumbnails_are_cached_as_raw_bytes(self):
+        key = f"dms-test-bytes-{frappe.generate_hash(length=8)}"
+        self.addCleanup(frappe.cache().delete_value, key)
+        self.assertIsNone(get_bytes(key))
+        self.assertFalse(set_bytes(key, b"x" * 11, 60, max_size=10))
+        self.assertIsNone(get_bytes(key))
+        self.assertTrue(set_bytes(key, b"\x00webp", 60, max_size=10))
+        self.assertEqual(get_bytes(key), b"\x00webp")
+
+
+class UnitTestBoundedCache(UnitTestCase):
+    def setUp(self):
+        namespace = f"dms-test-cache-{frappe.generate_hash(length=8)}"
+        self.addCleanup(frappe.cache().delete_keys, namespace)
+        self.cache = BoundedCache(namespace, max_bytes=100, max_item_size=60, expires_in_sec=60)
+        # Distinct access times, however fast the test runs
+        clock = count(1)
+        patcher = patch("dms.utils.cache.time", SimpleNamespace(time=lambda: next(clock)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_least_recently_used_values_are_evicted(self):
+        for key in ("a", "b"):
+            self.assertTrue(self.cache.set(key, key.encode() * 40))
+        self.cache.get("a")
+        self.cache.set("c", b"c" * 40)
+
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), b"a" * 40)
+        self.assertEqual(self.cache.get("c"), b"c" * 40)
+        stats = self.cache.stats()
+        self.assertEqual((stats["items"], stats["bytes"], stats["evictions"]), (2, 80, 1))
+
+    def test_replacing_a_value_counts_its_new_size(self):
+        self.cache.set("a", b"a" * 50)
+        self.cache.set("a", b"a" * 10)
+        self.cache.set("b", b"b" * 60)
+
+        self.assertEqual(self.cache.get("a"), b"a" * 10)
+        self.assertEqual(self.cache.stats()["bytes"], 70)
+
+    def test_values_over_the_item_size_are_not_stored(self):
+        self.assertFalse(self.cache.set("big", b"x" * 61))
+        self.assertIsNone(self.cache.get("big"))
+        stats = self.cache.stats()
+        self.assertEqual((stats["skipped"], stats["items"], stats["bytes"]), (1, 0, 0))
+
+    def test_stats_count_hits_and_misses(self):
+        self.cache.set("a", b"a")
+        self.cache.get("a")
+        self.cache.get("a")
+        self.cache.get("missing")
+
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["stores"]), (2, 1, 1))
+        self.assertAlmostEqual(stats["hit_rate"], 2 / 3)
@@ -0,0 +1,195 @@
+import unittest
+from datetime import datetime, timezone
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from frappe.tests import UnitTestCase
+from dms.utils.delivery import MAX_RANGES, get_ranges, offload_response, send_stream
+from dms.utils.files import STREAM_CHUNK_SIZE, DiskStream
+from dms.tests.utils import mock_aws, start_mock_s3
+
+
+class UnitTestOffload(UnitTestCase):
+    disk_root = Path("/home/frappe/bench/sites/dms.localhost/private/files")
+
+    def test_accel_redirect_maps_to_protected_location(self):
+        response = offload_response(
+            "X-Accel-Redirect", "team123/abc987.pdf", self.disk_root, "application/pdf", "Q3.pdf"
+        )
+        self.assertEqual(
+            response.headers["X-Accel-Redirect"], "/protected/private/files/team123/abc987.pdf"
+        )
+        self.assertNotIn("X-Sendfile", response.headers)
+        self.assertEqual(response.mimetype, "application/pdf")
+        self.assertEqual(response.get_data(), b"")
+
+    def test_accel_redirect_custom_prefix_and_quoting(self):
+        response = offload_response(
+            "X-Accel-Redirect",
+            "/team123/embeds/a b.png",
+            self.disk_root,
+            "image/png",
+            "a b.png",
+            accel_prefix="/dms-internal",
+        )
+        self.assertEqual(
+            response.headers["X-Accel-Redirect"],
+            "/dms-internal/private/files/team123/embeds/a%20b.png",
+        )
+
+    def test_sendfile_uses_absolute_disk_path(self):
+        response = offload_response(
+            "X-Sendfile", "team123/abc987.pdf", self.disk_root, "application/pdf", "Q3.pdf"
+        )
+        self.assertEqual(
+            response.headers["X-Sendfile"], str(self.disk_root / "team123" / "abc987.pdf")
+        )
+        self.assertNotIn("X-Accel-Redirect", response.headers)
+
+    def test_download_name_is_preserved(self):
+        response = offload_response(
+            "X-Accel-Redirect",
+            "team123/abc987.pdf",
+            self.disk_root,
+            "application/pdf",
+            "Résumé.pdf",
+            as_attachment=True,
+        )
+        disposition = response.headers["Content-Disposition"]
+        self.assertTrue(disposition.startswith("attachment"))
+        self.assertIn("filename*=UTF-8''R%C3%A9sum%C3%A9.pdf", disposition)
+
+    def test_unknown_mode_is_rejected(self):
+        with self.assertRaises(ValueError):
+            offload_response("Apache", "team123/abc987.pdf", self.disk_root, None, "Q3.pdf")
+
+
+class UnitTestStreaming(UnitTestCase):
+    def setUp(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "big.bin"
+        # A little over two blocks
+        self.data = bytes(range(256)) * (STREAM_CHUNK_SIZE // 128 + 1)
+        self.path.write_bytes(self.data)
+        self.stream = DiskStream(self.path)
+        self.addCleanup(self.stream.close)
+
+    def send(self, **headers):
+        environ = {f"HTTP_{name.upper()}": value for name, value in headers.items()}
+        with patch("frappe.request", SimpleNamespace(environ=environ)):
+            return send_stream(self.stream, "application/octet-stream", "big.bin")
+
+    def test_disk_stream_reads_in_blocks(self):
+        self.assertEqual(self.stream.size, len(self.data))
+        blocks = list(self.stream.iter_range())
+        self.assertEqual(len(blocks), 3)
+        self.assertTrue(all(len(block) <= STREAM_CHUNK_SIZE for block in blocks))
+        self.assertEqual(b"".join(blocks), self.data)
+
+    def test_full_body_is_streamed(self):
+        response = self.send()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.direct_passthrough)
+        self.assertNotIsInstance(response.response, (bytes, list))
+        self.assertEqual(response.content_length, len(self.data))
+        self.assertEqual(response.headers["Accept-Ranges"], "bytes")
+        self.assertEqual(b"".join(response.response), self.data)
+
+    def test_unchanged_file_is_not_sent_again(self):
+        etag, _ = self.send().get_etag()
+        self.assertEqual(self.send(if_none_match=f'"{etag}"').status_code, 304)
+        self.assertEqual(self.send(if_none_match='"other"').status_code, 200)
+
+    def test_single_range_is_read_from_its_offset(self):
+        response = self.send(range="bytes=70000-70099")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.headers["Content-Range"], f"bytes 70000-70099/{len(self.data)}")
+        self.assertEqual(response.content_length, 100)
+        self.assertEqual(b"".join(response.response), self.data[70000:70100])
+
+    def test_multiple_ranges_are_sent_as_multipart(self):
+        response = self.send(range="bytes=0-4,70000-70004")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.mimetype, "multipart/byteranges")
+        boundary = response.mimetype_params["boundary"]
+        body = b"".join(response.response)
+        self.assertEqual(response.content_length, len(body))
+
+        parts = body.split(f"--{boundary}".encode())
+        self.assertEqual(len(parts), 4)
+        self.assertEqual(parts[-1], b"--\r\n")
+        for part, (start, stop) in zip(parts[1:3], [(0, 5), (70000, 70005)]):
+            head, content = part.split(b"\r\n\r\n", 1)
+            self.assertIn(f"Content-Range: bytes {start}-{stop - 1}/".encode(), head)
+            self.assertEqual(content, self.data[start:stop] + b"\r\n")
+
+    def test_unsatisfiable_range(self):
+        response = self.send(range=f"bytes={len(self.data)}-")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.headers["Content-Range"], f"bytes */{len(self.data)}")
+
+
+class UnitTestRanges(UnitTestCase):
+    stream = SimpleNamespace(
+        size=1000,
+        etag="abc-1000",
+        last_modified=datetime(2026, 10, 18, 10, 0, 0, 500000, tzinfo=timezone.utc),
+    )
+
+    def get_ranges(self, header, if_range=None):
+        environ = {"HTTP_RANGE": header}
+        if if_range:
+            environ["HTTP_IF_RANGE"] = if_range
+        return get_ranges(environ, self.stream)
+
+    def test_single_ranges(self):
+        self.assertIsNone(get_ranges({}, self.stream))
+        self.assertEqual(self.get_ranges("bytes=0-99"), [(0, 100)])
+        self.assertEqual(self.get_ranges("bytes=900-"), [(900, 1000)])
+        self.assertEqual(self.get_ranges("bytes=-100"), [(900, 1000)])
+        self.assertEqual(self.get_ranges("bytes=-5000"), [(0, 1000)])
+        self.assertEqual(self.get_ranges("bytes=990-2000"), [(990, 1000)])
+
+    def test_adjacent_ranges_are_merged(self):
+        self.assertEqual(
+            self.get_ranges("bytes=0-99,100-199,500-599,600-"), [(0, 200), (500, 1000)]
+        )
+        # Out of order or overlapping ranges are answered with the full body
+        self.assertIsNone(self.get_ranges("bytes=500-599,0-99"))
+        self.assertIsNone(self.get_ranges("bytes=0-99,50-149"))
+
+    def test_invalid_and_unsatisfiable_ranges(self):
+        self.assertIsNone(self.get_ranges("bytes=abc"))
+        self.assertIsNone(self.get_ranges("lines=0-10"))
+        with self.assertRaises(ValueError):
+            self.get_ranges("bytes=1000-1100")
+
+    def test_too_many_ranges_get_the_full_body(self):
+        header = "bytes=" + ",".join(f"{i * 10}-{i * 10 + 4}" for i in range(MAX_RANGES + 1))
+        self.assertIsNone(self.get_ranges(header))
+
+    def test_if_range_must_match_exactly(self):
+        self.assertEqual(self.get_ranges("bytes=0-9", '"abc-1000"'), [(0, 10)])
+        self.assertIsNone(self.get_ranges("bytes=0-9", '"abc-999"'))
+
+        self.assertEqual(self.get_ranges("bytes=0-9", "Sun, 18 Oct 2026 10:00:00 GMT"), [(0, 10)])
+        self.assertIsNone(self.get_ranges("bytes=0-9", "Sun, 18 Oct 2026 09:59:59 GMT"))
+        # A later date is not a match either
+        self.assertIsNone(self.get_ranges("bytes=0-9", "Sun, 18 Oct 2026 10:00:01 GMT"))
+
+
+@unittest.skipIf(mock_aws is None, "moto is required as a local S3 stand-in")
+class UnitTestS3Stream(UnitTestCase):
+    def setUp(self):
+        self.manager, _ = start_mock_s3(self)
+        self.manager.conn.put_object(Bucket="dms-test", Key="team/abc.pdf", Body=b"%PDF-1.7")
+
+    def test_stream_reads_byte_ranges_from_the_bucket(self):
+        stream = self.manager.stream_file("team/abc.pdf")
+        self.assertEqual(stream.size, 8)
+        self.assertEqual(b"".join(stream.iter_range()), b"%PDF-1.7")
+        self.assertEqual(b"".join(stream.iter_range(1, 4)), b"PDF")
+        self.assertEqual(b"".join(stream.iter_range(4, 4)), b"")
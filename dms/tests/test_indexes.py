@@ -0,0 +1,27 @@
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from frappe.tests import UnitTestCase
+from dms.utils.indexes import INDEXES, add_indexes, index_columns
+
+
+class UnitTestIndexes(UnitTestCase):
+    def test_index_columns_are_quoted(self):
+        self.assertEqual(
+            index_columns(["user", "read", "entity"]), ["`user`", "`read`", "`entity`"]
+        )
+        self.assertEqual(index_columns(["lineage(255)"]), ["`lineage`(255)"])
+
+    def test_indexes_are_added_per_doctype(self):
+        add_index = []
+        db = SimpleNamespace(
+            get_index_name=lambda fields: "_".join(fields) + "_index",
+            add_index=lambda doctype, fields, name: add_index.append((doctype, fields, name)),
+        )
+        with patch("frappe.db", db):
+            add_indexes("DMS Permission")
+        self.assertEqual(len(add_index), len(INDEXES["DMS Permission"]))
+        self.assertIn(
+            ("DMS Permission", ["`user`", "`read`", "`entity`"], "user_read_entity_index"),
+            add_index,
+        )
@@ -0,0 +1,136 @@
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import frappe
+from frappe.tests import IntegrationTestCase, UnitTestCase
+from dms.api.list import (
+    MAX_PAGE_SIZE,
+    PAGE_SIZE,
+    add_counts,
+    decode_cursor,
+    encode_cursor,
+    files,
+    folder_tree,
+    get_page_size,
+    shared,
+)
+from dms.tests.utils import make_entity, make_team
+
+
+class UnitTestList(UnitTestCase):
+    def test_listed_counts(self):
+        rows = [
+            {"child_count": 3, "share_kind": "Public", "share_count": 2},
+            {"child_count": 0, "share_kind": "Team", "share_count": 0},
+            {"child_count": 0, "share_kind": "", "share_count": 4},
+        ]
+        for r in rows:
+            r.update(is_group=0, is_link=0, mime_type="image/png")
+            add_counts(r)
+        self.assertEqual(
+            [(r["children"], r["share_count"]) for r in rows], [(3, -2), (0, -1), (0, 4)]
+        )
+        self.assertTrue(all("child_count" not in r and "share_kind" not in r for r in rows))
+
+    def test_cursor_round_trip(self):
+        cursor = encode_cursor(datetime(2026, 10, 18, 10, 0, 0, 123456), "abc123")
+        self.assertEqual(decode_cursor(cursor), ("2026-10-18 10:00:00.123456", "abc123"))
+        self.assertEqual(decode_cursor(encode_cursor(None, "abc123")), (None, "abc123"))
+
+        for invalid in ("not a cursor", encode_cursor(1, 2, 3), encode_cursor()):
+            with self.assertRaises(ValueError):
+                decode_cursor(invalid)
+
+    def test_page_sizes_are_bounded(self):
+        self.assertEqual(get_page_size(None), PAGE_SIZE)
+        self.assertEqual(get_page_size("20"), 20)
+        self.assertEqual(get_page_size(MAX_PAGE_SIZE * 10), MAX_PAGE_SIZE)
+        self.assertEqual(get_page_size(-5), 1)
+
+    def test_shared_fills_pages_past_hidden_items(self):
+        rows = [
+            {"name": "folder", "parent_entity": "home"},
+            *({"name": f"child{i}", "parent_entity": "folder"} for i in range(3)),
+            {"name": "file", "parent_entity": "home"},
+        ]
+        for i, r in enumerate(rows):
+            r.update(
+                permission=f"perm{i}",
+                modified=f"2026-10-18 10:00:0{i}",
+                is_group=0,
+                is_link=0,
+                mime_type=None,
+                file_size=0,
+                child_count=0,
+                share_kind=None,
+            )
+
+        def paginate(query, key, tiebreak, ascending, cursor, limit):
+            start = int(decode_cursor(cursor)[1][4:]) + 1 if cursor else 0
+            page = [frappe._dict(r) for r in rows[start : start + limit]]
+            return SimpleNamespace(run=lambda as_dict: page)
+
+        with (
+            patch("dms.api.list.paginate", side_effect=paginate) as fetch,
+            patch("dms.api.list.add_pending_sizes"),
+        ):
+            first = shared(by=1, limit=2)
+            # The children are left out, as their folder is listed
+            self.assertEqual([r.name for r in first], ["folder", "file"])
+            self.assertEqual(fetch.call_count, 4)
+            self.assertEqual(decode_cursor(first[-1].cursor)[1], "perm4")
+            self.assertEqual(shared(by=1, limit=2, cursor=first[-1].cursor), [])
+
+
+class IntegrationTestList(IntegrationTestCase):
+    def setUp(self):
+        self.team = make_team("List Test")
+
+    def test_listing_pages_break_ties_by_name(self):
+        folder = make_entity(self.team.name, "Folder")
+        names = [
+            make_entity(self.team.name, f"File {i}", folder.name, is_group=0).name
+            for i in range(5)
+        ]
+        # All equally recent, so only the name orders them
+        frappe.db.sql(
+            "UPDATE `tabDMS File` SET modified = '2026-10-18 10:00:00' WHERE parent_entity = %s",
+            folder.name,
+        )
+
+        for ascending, expected in ((1, sorted(names)), (0, sorted(names, reverse=True))):
+            listed, cursor = [], None
+            while True:
+                page = files(
+                    self.team.name,
+                    folder.name,
+                    order_by=f"modified {ascending}",
+                    limit=2,
+                    cursor=cursor,
+                )
+                listed += [r.name for r in page]
+                if len(page) < 2:
+                    break
+                cursor = page[-1].cursor
+            self.assertEqual(listed, expected)
+
+        # First pages are bounded too
+        with patch("dms.api.list.PAGE_SIZE", 3):
+            self.assertEqual(len(files(self.team.name, folder.name, limit=None)), 3)
+
+    def test_folder_tree_lists_everything_inside(self):
+        folder = make_entity(self.team.name, "Folder")
+        sub = make_entity(self.team.name, "Sub", folder.name)
+        leaf = make_entity(self.team.name, "Leaf", sub.name, is_group=0)
+        trashed = make_entity(self.team.name, "Trashed", folder.name, is_group=0)
+        trashed.is_active = 0
+        trashed.save()
+
+        tree = folder_tree(folder.name)
+        self.assertEqual(
+            [(r["name"], r["parent_entity"]) for r in tree],
+            [(sub.name, folder.name), (leaf.name, sub.name)],
+        )
+        with self.assertRaises(NotADirectoryError):
+            folder_tree(leaf.name)
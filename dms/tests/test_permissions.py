@@ -0,0 +1,126 @@
+from unittest.mock import patch
+
+import frappe
+from frappe.tests import UnitTestCase
+from dms.api.files import remove_or_restore
+from dms.api.permissions import clear_access_cache, get_bulk_access, resolve_access
+
+
+class UnitTestPermissions(UnitTestCase):
+    def setUp(self):
+        clear_access_cache()
+        self.addCleanup(clear_access_cache)
+
+    def make_row(self, name, **kwargs):
+        return frappe._dict(
+            {
+                "name": name,
+                "owner": "owner@example.com",
+                "team": "team",
+                "is_private": 0,
+                "is_group": 0,
+                "lineage": f"root/{name}",
+                **kwargs,
+            }
+        )
+
+    def resolve(self, entities, user, memberships=None, grants=None):
+        with (
+            patch("dms.api.permissions.get_team_memberships", return_value=memberships or {}),
+            patch(
+                "dms.api.permissions.get_effective_grants",
+                side_effect=lambda chains, principals: {
+                    name: (grants or {}).get(name, {}) for name in chains
+                },
+            ) as get_grants,
+        ):
+            return resolve_access(entities, user), get_grants
+
+    def test_owners_have_full_access(self):
+        access, get_grants = self.resolve([self.make_row("a")], "owner@example.com")
+        self.assertEqual(
+            access["a"], {"read": 1, "comment": 1, "share": 1, "write": 1, "type": "admin"}
+        )
+        get_grants.assert_not_called()
+
+    def test_team_members_see_non_private_entities(self):
+        entities = [
+            self.make_row("file"),
+            self.make_row("folder", is_group=1),
+            self.make_row("private", is_private=1),
+            self.make_row("elsewhere", team="other"),
+        ]
+        access, get_grants = self.resolve(entities, "user@example.com", {"team": 0})
+        self.assertEqual(get_grants.call_args.args[1], ["user@example.com", "", "$TEAM"])
+        self.assertEqual(
+            access["file"], {"read": 1, "comment": 1, "share": 1, "write": 0, "type": "team-admin"}
+        )
+        # Everyone can upload to team folders
+        self.assertEqual(access["folder"]["write"], 1)
+        for name in ("private", "elsewhere"):
+            self.assertEqual(access[name], {"read": 0, "comment": 0, "share": 0, "write": 0})
+
+        access, _ = self.resolve(entities, "user@example.com", {"team": 1})
+        self.assertEqual(access["file"]["write"], 1)
+
+    def test_grants_add_up_across_principals(self):
+        none = {"read": 0, "comment": 0, "share": 0, "write": 0}
+        grants = {
+            "shared": {
+                "user@example.com": none | {"comment": 1},
+                "": none | {"read": 1},
+                "$TEAM": none | {"write": 1},
+            },
+        }
+        entities = [self.make_row("shared", team="other")]
+        access, _ = self.resolve(entities, "user@example.com", {"team": 0}, grants)
+        # Team grants only reach members of the entity's team
+        self.assertEqual(access["shared"], none | {"read": 1, "comment": 1})
+
+        access, get_grants = self.resolve(entities, "", grants=grants)
+        self.assertEqual(get_grants.call_args.args[1], [""])
+
+    def test_access_is_memoized_per_request(self):
+        def resolve(entities, user):
+            return {e: {"read": 1} for e in entities if e != "missing"}
+
+        with patch("dms.api.permissions.resolve_access", side_effect=resolve) as resolved:
+            self.assertEqual(
+                get_bulk_access(["a", "b", "missing"], "Guest"),
+                {"a": {"read": 1}, "b": {"read": 1}},
+            )
+            get_bulk_access(["a"], "")
+            get_bulk_access(["b"], "user@example.com")
+            self.assertEqual(
+                [c.args for c in resolved.call_args_list],
+                [(["a", "b", "missing"], ""), (["b"], "user@example.com")],
+            )
+            # Callers get copies, not the memoized dicts
+            get_bulk_access(["a"], "")["a"]["read"] = 0
+            self.assertEqual(get_bulk_access(["a"], ""), {"a": {"read": 1}})
+
+            clear_access_cache()
+            get_bulk_access(["a"], "")
+            self.assertEqual(resolved.call_count, 3)
+
+    def test_trashing_checks_write_access_in_bulk(self):
+        docs = {
+            name: frappe._dict(name=name, is_active=1, parent_entity="home", save=lambda: None)
+            for name in ("mine", "theirs")
+        }
+        with (
+            patch("dms.api.files.storage_bar_data", return_value={"limit": 0, "total_size": 0}),
+            patch(
+                "dms.api.files.get_bulk_access",
+                return_value={"mine": {"write": 1}, "theirs": {"write": 0}},
+            ) as get_bulk_access,
+            patch("frappe.has_permission") as has_permission,
+            patch("frappe.get_doc", side_effect=lambda doctype, name: docs[name]),
+            patch("dms.api.files.get_file_size", return_value=10),
+            patch("dms.api.files.update_file_size"),
+        ):
+            with self.assertRaises(frappe.PermissionError):
+                remove_or_restore('["mine", "theirs"]', "team")
+        get_bulk_access.assert_called_once_with(["mine", "theirs"])
+        has_permission.assert_not_called()
+        self.assertEqual((docs["mine"].is_active, docs["theirs"].is_active), (0, 1))
@@ -0,0 +1,61 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+from urllib.parse import urlparse, parse_qs
+
+import frappe
+import requests
+from frappe.tests import UnitTestCase
+from dms.utils.files import FileManager, clear_s3_client
+from dms.tests.utils import mock_aws, start_mock_s3
+
+
+@unittest.skipIf(mock_aws is None, "moto is required as a local S3 stand-in")
+class UnitTestS3(UnitTestCase):
+    def setUp(self):
+        self.manager, self.settings = start_mock_s3(self)
+        self.manager.conn.put_object(Bucket="dms-test", Key="team/abc.pdf", Body=b"%PDF-1.7")
+
+    def test_client_is_reused_until_settings_change(self):
+        with patch("frappe.get_cached_doc", return_value=self.settings):
+            self.assertIs(FileManager().conn, self.manager.conn)
+
+        changed = frappe._dict(self.settings, modified="2026-10-18 11:00:00.000000")
+        changed.get_password = self.settings.get_password
+        with patch("frappe.get_cached_doc", return_value=changed):
+            conn = FileManager().conn
+            self.assertIsNot(conn, self.manager.conn)
+
+            clear_s3_client()
+            self.assertIsNot(FileManager().conn, conn)
+
+    def test_presigned_url_expiry_and_headers(self):
+        url = self.manager.get_presigned_url(
+            "team/abc.pdf", "application/pdf", "Q3 report.pdf", as_attachment=True
+        )
+        query = parse_qs(urlparse(url).query)
+        self.assertEqual(query["X-Amz-Expires"], ["120"])
+        self.assertEqual(query["response-content-type"], ["application/pdf"])
+        self.assertEqual(
+            query["response-content-disposition"], ['attachment; filename="Q3 report.pdf"']
+        )
+
+    def test_presigned_url_serves_object_with_filename(self):
+        url = self.manager.get_presigned_url("team/abc.pdf", "application/pdf", "Résumé.pdf")
+        response = requests.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"%PDF-1.7")
+        self.assertEqual(response.headers["Content-Type"], "application/pdf")
+        self.assertIn(
+            "filename*=UTF-8''R%C3%A9sum%C3%A9.pdf", response.headers["Content-Disposition"]
+        )
+
+    def test_abort_stale_multipart_uploads_only_under_prefixes(self):
+        ours = self.manager.start_multipart_upload("team/big.bin")
+        theirs = self.manager.start_multipart_upload("other-app/big.bin")
+
+        cutoff = datetime.now(timezone.utc) + timedelta(hours=1)
+        self.assertEqual(self.manager.abort_stale_multipart_uploads(cutoff, ["team"]), 1)
+        uploads = self.manager.conn.list_multipart_uploads(Bucket="dms-test")["Uploads"]
+        self.assertEqual([u["UploadId"] for u in uploads], [theirs])
+        self.assertNotEqual(ours, theirs)
@@ -0,0 +1,152 @@
+import json
+import unittest
+from datetime import datetime
+from io import BytesIO
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import frappe
+from PIL import Image
+from frappe.tests import UnitTestCase
+from werkzeug.datastructures import ETags
+from dms.api.files import get_rendition_size, get_thumbnail, get_thumbnail_etag, thumbnail_response
+from dms.utils import thumbnails
+from dms.utils.thumbnails import SPRITE_TILE_SIZE, build_sprite
+from dms.tests.utils import mock_aws, start_mock_s3
+
+
+class UnitTestThumbnails(UnitTestCase):
+    def test_thumbnail_batch_outlives_a_dead_job(self):
+        keys = {
+            k: f"{getattr(thumbnails, k)}-{frappe.generate_hash(length=8)}"
+            for k in ("IMAGE_QUEUE_KEY", "DOCUMENT_QUEUE_KEY", "PROCESSING_KEY")
+        }
+        for key in keys.values():
+            self.addCleanup(frappe.cache().delete_value, key)
+        with patch.multiple(thumbnails, **keys):
+            for name in ("a", "b", "c"):
+                frappe.cache().rpush(keys["IMAGE_QUEUE_KEY"], name)
+            frappe.cache().rpush(keys["DOCUMENT_QUEUE_KEY"], "d")
+
+            self.assertEqual(thumbnails.pop_thumbnail_batch(size=3), ["a", "b", "c"])
+            # The job dies before finishing the batch
+            thumbnails.requeue_unfinished_thumbnails()
+            self.assertEqual(thumbnails.pop_thumbnail_batch(size=5), ["a", "b", "c", "d"])
+
+            thumbnails.finish_thumbnail_batch()
+            thumbnails.requeue_unfinished_thumbnails()
+            self.assertEqual(thumbnails.pop_thumbnail_batch(), [])
+
+    def test_rendition_sizes_round_up(self):
+        self.assertEqual(
+            [get_rendition_size(s) for s in (None, "", 1, 64, 65, "300", 1024)],
+            [None, None, 64, 64, 128, 512, 1024],
+        )
+        # Larger than any rendition: the full thumbnail
+        self.assertIsNone(get_rendition_size(4000))
+
+    def test_thumbnail_is_revalidated_by_etag(self):
+        dms_file = frappe._dict(
+            name="abc123",
+            is_group=0,
+            is_link=0,
+            team="team",
+            mime_type="image/png",
+            modified=datetime(2026, 10, 18, 10, 0, 0, 123456),
+        )
+        etag = get_thumbnail_etag(dms_file, 128)
+        self.assertEqual(etag, "abc123-128-20261018100000123456")
+        self.assertNotEqual(get_thumbnail_etag(dms_file, None), etag)
+
+        with (
+            patch("frappe.get_value", return_value=dms_file),
+            patch("frappe.has_permission", return_value=True),
+            patch("frappe.request", SimpleNamespace(if_none_match=ETags([etag]))),
+            patch("dms.api.files.FileManager") as manager,
+        ):
+            response = get_thumbnail("abc123", size=100)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b"")
+        manager.assert_not_called()
+
+    def test_versioned_thumbnail_urls_are_immutable(self):
+        dms_file = frappe._dict(name="abc123", modified=datetime(2026, 10, 18, 10, 0, 0))
+        with patch.dict(frappe.form_dict, {"v": str(dms_file.modified)}):
+            response = thumbnail_response(b"webp", "abc123-128-1", dms_file)
+        self.assertTrue(response.cache_control.immutable)
+        self.assertEqual(response.cache_control.max_age, 365 * 24 * 60 * 60)
+        self.assertEqual(response.get_etag(), ("abc123-128-1", False))
+
+        with patch.dict(frappe.form_dict, {"v": None}):
+            response = thumbnail_response(b"webp", "abc123-128-1", dms_file)
+        self.assertTrue(response.cache_control.no_cache)
+        self.assertFalse(response.cache_control.immutable)
+
+
+@unittest.skipIf(mock_aws is None, "moto is required as a local S3 stand-in")
+class UnitTestS3Thumbnails(UnitTestCase):
+    def setUp(self):
+        self.manager, _ = start_mock_s3(self)
+
+    def test_thumbnail_renditions_are_resized_on_demand(self):
+        buf = BytesIO()
+        Image.new("RGB", (800, 400), "red").save(buf, format="webp")
+        full = buf.getvalue()
+        with patch("dms.utils.files.get_home_folder", return_value={"name": "team"}):
+            self.manager.save_thumbnail(self.manager.get_thumbnail_path("team", "abc"), full)
+
+            with Image.open(self.manager.get_thumbnail("team", "abc", 256)) as image:
+                self.assertEqual(image.size, (256, 128))
+            self.assertTrue(self.manager.file_exists("team/thumbnails/abc.256.thumbnail"))
+            # The full thumbnail is smaller than this rendition, so it is served as is
+            self.assertEqual(self.manager.get_thumbnail("team", "abc", 1024).read(), full)
+            self.assertFalse(self.manager.file_exists("team/thumbnails/abc.1024.thumbnail"))
+
+    def test_sprite_reuses_tiles_of_unchanged_files(self):
+        folder = frappe._dict(name="folder", team="team", is_private=0, owner="Administrator")
+        children = []
+        for name, colour in (("a", "red"), ("b", "blue")):
+            buf = BytesIO()
+            Image.new("RGB", (512, 512), colour).save(buf, format="webp")
+            self.manager.save_thumbnail(f"team/thumbnails/{name}.thumbnail", buf.getvalue())
+            children.append(
+                frappe._dict(name=name, team="team", mime_type="image/png", modified="1")
+            )
+
+        def build():
+            with (
+                patch("dms.utils.files.get_home_folder", return_value={"name": "team"}),
+                patch("dms.utils.thumbnails.FileManager", return_value=self.manager),
+                patch("dms.utils.thumbnails.get_sprite_children", return_value=children),
+                patch("frappe.db", SimpleNamespace(get_value=lambda *args, **kwargs: folder)),
+                patch("frappe.publish_realtime"),
+                patch.object(
+                    self.manager, "get_thumbnail", wraps=self.manager.get_thumbnail
+                ) as read,
+            ):
+                build_sprite(folder.name)
+            offsets = json.loads(
+                self.manager.get_file("team/thumbnails/sprites/folder.json").read()
+            )
+            sprite_path = f"team/thumbnails/sprites/folder.{offsets['version']}.webp"
+            sprite = Image.open(self.manager.get_file(sprite_path)).convert("RGB")
+            # Renditions are resized from the full thumbnail, which reads it again
+            return offsets, sprite, list(dict.fromkeys(c.args[1] for c in read.call_args_list))
+
+        first, _, read = build()
+        self.assertEqual(read, ["a", "b"])
+        self.assertEqual(set(first["tiles"]), {"a", "b"})
+
+        children[1].modified = "2"
+        second, sprite, read = build()
+        # Only the changed file is read again
+        self.assertEqual(read, ["b"])
+        self.assertNotEqual(second["version"], first["version"])
+        self.assertFalse(
+            self.manager.file_exists(f"team/thumbnails/sprites/folder.{first['version']}.webp")
+        )
+        for name, colour in (("a", (254, 0, 0)), ("b", (0, 0, 254))):
+            tile = second["tiles"][name]
+            self.assertEqual(tile["w"], SPRITE_TILE_SIZE)
+            pixel = sprite.getpixel((tile["x"] + tile["w"] // 2, tile["y"] + tile["h"] // 2))
+            self.assertTrue(all(abs(p - c) < 16 for p, c in zip(pixel, colour)))
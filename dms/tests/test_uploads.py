@@ -0,0 +1,132 @@
+import os
+import random
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import frappe
+from frappe.tests import UnitTestCase
+from dms.api.files import finish_upload, get_upload_status, start_upload_session
+from dms.utils.uploads import UploadSession, preallocate, write_chunk
+
+
+class UnitTestUploads(UnitTestCase):
+    def make_session(self, owner="Administrator"):
+        session = UploadSession(frappe.generate_hash(length=12))
+        self.addCleanup(session.delete)
+        session.create({"owner": owner, "title": "a.bin", "total_size": 100})
+        return session
+
+    def test_upload_ledger_counts_distinct_chunks(self):
+        session = self.make_session()
+        self.assertEqual(session.record(2, 60, 40), 1)
+        self.assertEqual(session.record(0, 0, 30, "etag-0"), 2)
+        # A retried chunk replaces its entry
+        self.assertEqual(session.record(0, 0, 30, "etag-0b"), 2)
+        self.assertEqual(session.chunks, {0: [0, 30, "etag-0b"], 2: [60, 40, None]})
+
+    def test_upload_ranges_merge_and_report_gaps(self):
+        session = self.make_session()
+        self.assertEqual(session.missing_ranges(100), [[0, 100]])
+
+        session.record(3, 80, 20)
+        session.record(0, 0, 20)
+        session.record(1, 20, 20)
+        # Overlaps, as a chunk resent with a different size would
+        session.record(4, 30, 15)
+        self.assertEqual(session.received_ranges(), [[0, 45], [80, 100]])
+        self.assertEqual(session.missing_ranges(100), [[45, 80]])
+        self.assertEqual(session.missing_ranges(120), [[45, 80], [100, 120]])
+
+        session.record(2, 40, 40)
+        self.assertEqual(session.received_ranges(), [[0, 100]])
+        self.assertEqual(session.missing_ranges(100), [])
+
+    def test_upload_claim_is_exclusive_until_released(self):
+        session = self.make_session()
+        self.assertIsNone(session.result)
+        self.assertTrue(session.claim("Administrator"))
+        self.assertFalse(UploadSession(session.uuid).claim("Administrator"))
+        self.assertEqual(session.result, {"owner": "Administrator"})
+
+        session.release()
+        self.assertIsNone(session.result)
+        self.assertTrue(session.claim("Administrator"))
+
+    def test_finished_upload_is_only_reported_to_its_owner(self):
+        session = self.make_session()
+        session.record(0, 0, 100)
+        session.claim("Administrator")
+        session.finish("Administrator", "abc123")
+
+        self.assertIsNone(session.meta)
+        self.assertEqual(session.chunks, {})
+        self.assertEqual(get_upload_status(session.uuid), {"entity_name": "abc123"})
+        with patch.dict(frappe.session, {"user": "Guest"}):
+            with self.assertRaises(frappe.NotFound):
+                get_upload_status(session.uuid)
+
+    def test_rejected_uploads_create_no_folders(self):
+        session = self.make_session()
+        with (
+            patch("dms.api.files.get_teams", return_value=[]),
+            patch("frappe.get_value", return_value=1),
+            patch("frappe.has_permission", return_value=False),
+            patch("dms.api.files.if_folder_exists") as if_folder_exists,
+            patch.object(frappe.db, "commit") as commit,
+        ):
+            with self.assertRaises(frappe.PermissionError):
+                start_upload_session(
+                    session, None, "team", {"name": "home"}, 1, "a/b/c.txt", None, "c.txt", 10, 0
+                )
+        if_folder_exists.assert_not_called()
+        commit.assert_not_called()
+
+    def test_path_folders_are_created_when_the_upload_finishes(self):
+        session = self.make_session()
+        session.record(0, 0, 100)
+        manager = SimpleNamespace(
+            s3_enabled=False, upload_file=lambda *args: None, can_create_thumbnail=lambda f: False
+        )
+        with TemporaryDirectory() as tmp:
+            temp_path = Path(tmp, "upload")
+            temp_path.write_bytes(b"x" * 100)
+            meta = frappe._dict(
+                parent="home",
+                folders=["a", "b"],
+                is_private=0,
+                name="abc",
+                title="c.txt",
+                key="home/abc.txt",
+                temp_path=str(temp_path),
+                mime_type="text/plain",
+            )
+            with (
+                patch(
+                    "dms.api.files.if_folder_exists",
+                    side_effect=lambda team, title, parent, personal: f"{parent}/{title}",
+                ),
+                patch("dms.api.files.get_new_title", side_effect=lambda title, parent: title),
+                patch("dms.api.files.create_dms_file", return_value=frappe._dict()) as create,
+                patch("dms.api.files.can_render_pages", return_value=False),
+                patch("dms.api.files.update_file_size") as update_file_size,
+            ):
+                finish_upload(session, manager, meta, "team", 100, None, 0)
+        self.assertEqual(create.call_args.args[2:4], ("c.txt", "home/a/b"))
+        update_file_size.assert_called_once_with("home/a/b", 100)
+
+    def test_chunks_written_in_parallel_out_of_order(self):
+        directory = TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / "upload.bin"
+        data = os.urandom(64 * 1000 + 123)
+        chunks = [(offset, data[offset : offset + 1000]) for offset in range(0, len(data), 1000)]
+        random.Random(7).shuffle(chunks)
+
+        preallocate(path, len(data))
+        self.assertEqual(path.stat().st_size, len(data))
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda chunk: write_chunk(path, *chunk), chunks))
+        self.assertEqual(path.read_bytes(), data)
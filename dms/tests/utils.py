@@ -0,0 +1,63 @@
+import os
+from unittest.mock import patch
+
+import frappe
+from dms.utils.files import FileManager, clear_s3_client, get_home_folder
+
+try:
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+
+def make_team(title):
+    return frappe.get_doc({"doctype": "DMS Team", "title": title}).insert()
+
+
+def make_entity(team, title, parent=None, is_group=1, **kwargs):
+    """
+    Insert a DMS File for tests. Without a parent, it goes in the team's home folder.
+    """
+    return frappe.get_doc(
+        {
+            "doctype": "DMS File",
+            "title": title,
+            "team": team,
+            "is_group": is_group,
+            "parent_entity": parent or get_home_folder(team)["name"],
+            **kwargs,
+        }
+    ).insert()
+
+
+def start_mock_s3(test_case, bucket="dms-test"):
+    """
+    Serve S3 from moto until `test_case` finishes.
+
+    :return: A FileManager for `bucket`, and the settings it was built from
+    """
+    env = patch.dict(os.environ, {"AWS_DEFAULT_REGION": "us-east-1"})
+    env.start()
+    test_case.addCleanup(env.stop)
+    aws = mock_aws()
+    aws.start()
+    test_case.addCleanup(aws.stop)
+
+    clear_s3_client()
+    test_case.addCleanup(clear_s3_client)
+    settings = frappe._dict(
+        modified="2026-10-18 10:00:00.000000",
+        enabled=1,
+        aws_key="testing",
+        aws_secret="testing",
+        bucket=bucket,
+        endpoint_url=None,
+        signature_version="s3v4",
+        presigned_urls=1,
+        presigned_url_expiry=120,
+    )
+    settings.get_password = lambda fieldname: settings[fieldname]
+    with patch("frappe.get_cached_doc", return_value=settings):
+        manager = FileManager()
+    manager.conn.create_bucket(Bucket=bucket)
+    return manager, settings
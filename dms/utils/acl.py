@@ -0,0 +1,143 @@
+import frappe
+from functools import partial
+from frappe.utils import now_datetime
+from dms.utils.files import get_descendant_names
+
+ACCESS_TYPES = ("read", "comment", "share", "write")
+
+# Effective grants of an entity, in a Redis hash per entity with a field per principal (a user,
+# "" for everyone or "$TEAM"). Each value is what the principal is granted on the entity or
+# any of its ancestors, as one digit per access type - "1100" is read and comment. Grants with a
+# `valid_until` add the earliest expiry as a timestamp: "1100|1767225600".
+ACL_CACHE_TTL = 24 * 60 * 60
+
+# Teams of a user, and whether they administer each
+TEAMS_CACHE_TTL = 60 * 60
+
+
+def get_acl_key(entity_name):
+    return frappe.cache().make_key(f"dms-acl:{entity_name}")
+
+
+def get_team_memberships(user):
+    """
+    :return: Dict of team name to whether the user is an admin of it, cached in Redis
+    """
+    key = f"dms-teams:{user}"
+    memberships = frappe.cache().get_value(key)
+    if memberships is None:
+        memberships = {
+            m.parent: m.is_admin
+            for m in frappe.get_all(
+                "DMS Team Member",
+                filters={"parenttype": "DMS Team", "user": user},
+                fields=["parent", "is_admin"],
+            )
+        }
+        frappe.cache().set_value(key, memberships, expires_in_sec=TEAMS_CACHE_TTL)
+    return memberships
+
+
+def clear_team_memberships(users):
+    for user in users:
+        frappe.cache().delete_value(f"dms-teams:{user}")
+
+
+def get_effective_grants(chains, principals):
+    """
+    What each principal is granted on each entity, directly or through an ancestor. Cached
+    grants are read in one round trip, and the entities that miss are computed from a single
+    `DMS Permission` query over their ancestor chains, then cached.
+
+    :param chains: Dict of entity name to the names from the root down to it (its lineage)
+    :param principals: Users, "" for everyone and "$TEAM" for team members
+    :return: Dict of entity name to dict of principal to access dict
+    """
+    now = now_datetime().timestamp()
+    with frappe.cache().pipeline() as pipe:
+        for name in chains:
+            pipe.hmget(get_acl_key(name), principals)
+        cached = dict(zip(chains, pipe.execute()))
+
+    result = {}
+    for name, values in cached.items():
+        grants = {}
+        for principal, value in zip(principals, values):
+            if value is None:
+                break
+            bits, _, expires = value.decode().partition("|")
+            if expires and float(expires) <= now:
+                break
+            grants[principal] = {t: int(b) for t, b in zip(ACCESS_TYPES, bits)}
+        else:
+            result[name] = grants
+
+    missing = {name: chain for name, chain in chains.items() if name not in result}
+    if missing:
+        computed = compute_effective_grants(missing, principals)
+        with frappe.cache().pipeline() as pipe:
+            for name, grants in computed.items():
+                key = get_acl_key(name)
+                pipe.hset(key, mapping={p: value for p, (value, _) in grants.items()})
+                pipe.expire(key, ACL_CACHE_TTL)
+            pipe.execute()
+        result.update(
+            {name: {p: access for p, (_, access) in g.items()} for name, g in computed.items()}
+        )
+    return result
+
+
+def compute_effective_grants(chains, principals):
+    """
+    :return: Dict of entity name to dict of principal to (cache value, access dict)
+    """
+    now = now_datetime()
+    permissions = {}
+    for p in frappe.get_all(
+        "DMS Permission",
+        filters={
+            "entity": ["in", list({n for chain in chains.values() for n in chain})],
+            "user": ["in", principals],
+        },
+        fields=["entity", "user", "valid_until", *ACCESS_TYPES],
+    ):
+        if not p.valid_until or p.valid_until > now:
+            permissions.setdefault((p.entity, p.user), []).append(p)
+
+    result = {}
+    for name, chain in chains.items():
+        result[name] = {}
+        for principal in principals:
+            access = {t: 0 for t in ACCESS_TYPES}
+            expires = None
+            for ancestor in chain:
+                for p in permissions.get((ancestor, principal), []):
+                    for t in ACCESS_TYPES:
+                        if p[t]:
+                            access[t] = 1
+                    if p.valid_until and (expires is None or p.valid_until < expires):
+                        expires = p.valid_until
+            value = "".join(str(access[t]) for t in ACCESS_TYPES)
+            if expires:
+                value += f"|{expires.timestamp()}"
+            result[name][principal] = (value, access)
+    return result
+
+
+def invalidate_acl(entity_name):
+    """
+    Drop the cached grants of an entity and all its descendants, which inherit from it. This is
+    done again once the transaction commits, in case a concurrent request cached grants from
+    before the change.
+    """
+    _invalidate_acl(entity_name)
+    frappe.db.after_commit.add(partial(_invalidate_acl, entity_name))
+
+
+def _invalidate_acl(entity_name):
+    lineage = frappe.db.get_value("DMS File", entity_name, "lineage")
+    names = [entity_name] + (get_descendant_names(lineage) if lineage else [])
+    with frappe.cache().pipeline() as pipe:
+        for name in names:
+            pipe.delete(get_acl_key(name))
+        pipe.execute()
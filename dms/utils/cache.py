@@ -0,0 +1,132 @@
+import time
+import frappe
+
+
+def get_bytes(key):
+    """
+    Read a value stored with `set_bytes`.
+
+    :return: The stored bytes, or None
+    """
+    return frappe.cache().get(frappe.cache().make_key(key))
+
+
+def set_bytes(key, data, expires_in_sec, max_size):
+    """
+    Store raw bytes in Redis as is. Unlike `frappe.cache().set_value`, nothing is pickled, so
+    reads cost a single GET and no copies.
+
+    :param max_size: Values larger than this are not stored
+    :return: True if the value was stored
+    """
+    if len(data) > max_size:
+        return False
+    frappe.cache().set(frappe.cache().make_key(key), data, ex=expires_in_sec)
+    return True
+
+
+class BoundedCache:
+    """
+    Byte cache in Redis with a memory budget.
+
+    Values are stored raw with a TTL, and an access-ordered index of keys and their sizes is
+    kept alongside them. When the bytes held go over `max_bytes`, least recently used values
+    are evicted, so the namespace never grows without bound. Values over `max_item_size` are
+    never stored - callers should stream those from storage instead.
+
+    The budget is enforced after each store rather than atomically, so it can be overshot
+    briefly by concurrent writers.
+    """
+
+    def __init__(self, namespace, max_bytes, max_item_size, expires_in_sec):
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.max_item_size = max_item_size
+        self.expires_in_sec = expires_in_sec
+        self.lru_key = self._key("lru")
+        self.sizes_key = self._key("sizes")
+        self.bytes_key = self._key("bytes")
+        self.stats_key = self._key("stats")
+
+    def _key(self, *parts):
+        return frappe.cache().make_key(":".join((self.namespace,) + parts))
+
+    def get(self, key):
+        """
+        :return: The cached bytes, or None
+        """
+        with frappe.cache().pipeline() as pipe:
+            pipe.get(self._key("value", key))
+            pipe.zadd(self.lru_key, {key: time.time()}, xx=True)
+            value = pipe.execute()[0]
+            pipe.hincrby(self.stats_key, "hits" if value is not None else "misses", 1)
+            pipe.execute()
+        return value
+
+    def set(self, key, data):
+        """
+        Store a value and evict least recently used ones until the budget is met.
+
+        :return: True if the value was stored, False if it is over `max_item_size`
+        """
+        with frappe.cache().pipeline() as pipe:
+            if len(data) > self.max_item_size:
+                pipe.hincrby(self.stats_key, "skipped", 1)
+                pipe.execute()
+                return False
+
+            previous = pipe.hget(self.sizes_key, key).execute()[0]
+            pipe.set(self._key("value", key), data, ex=self.expires_in_sec)
+            pipe.zadd(self.lru_key, {key: time.time()})
+            pipe.hset(self.sizes_key, key, len(data))
+            pipe.incrby(self.bytes_key, len(data) - int(previous or 0))
+            pipe.hincrby(self.stats_key, "stores", 1)
+            held = pipe.execute()[3]
+        if held > self.max_bytes:
+            self.evict(held - self.max_bytes)
+        return True
+
+    def evict(self, excess):
+        """
+        Drop least recently used values until `excess` bytes have been freed. Values whose TTL
+        ran out are the least recently used, so their sizes are reclaimed here as well.
+        """
+        with frappe.cache().pipeline() as pipe:
+            while excess > 0:
+                oldest = pipe.zrange(self.lru_key, 0, 31).execute()[0]
+                if not oldest:
+                    pipe.set(self.bytes_key, 0).execute()
+                    return
+                sizes = pipe.hmget(self.sizes_key, oldest).execute()[0]
+                freed = 0
+                for count, size in enumerate(sizes, 1):
+                    freed += int(size or 0)
+                    if freed >= excess:
+                        break
+                oldest = oldest[:count]
+                pipe.delete(*(self._key("value", k.decode()) for k in oldest))
+                pipe.zrem(self.lru_key, *oldest)
+                pipe.hdel(self.sizes_key, *oldest)
+                pipe.decrby(self.bytes_key, freed)
+                pipe.hincrby(self.stats_key, "evictions", len(oldest))
+                pipe.execute()
+                excess -= freed
+
+    def stats(self):
+        """
+        :return: Hits, misses, hit rate, stores, evictions, values skipped for size, and the
+            number of values and bytes held
+        """
+        with frappe.cache().pipeline() as pipe:
+            pipe.hgetall(self.stats_key)
+            pipe.get(self.bytes_key)
+            pipe.zcard(self.lru_key)
+            counters, held, count = pipe.execute()
+        stats = {k: 0 for k in ("hits", "misses", "stores", "evictions", "skipped")}
+        stats.update({k.decode(): int(v) for k, v in counters.items()})
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0
+        stats["items"] = count
+        stats["bytes"] = int(held or 0)
+        stats["max_bytes"] = self.max_bytes
+        return stats
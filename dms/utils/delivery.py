@@ -0,0 +1,223 @@
+import frappe
+import secrets
+import unicodedata
+from pathlib import Path
+from time import time
+from urllib.parse import quote
+from werkzeug.utils import redirect
+from werkzeug.wrappers import Response
+from werkzeug.http import (
+    dump_options_header,
+    is_resource_modified,
+    parse_if_range_header,
+    parse_range_header,
+)
+
+# More ranges than this in one request are answered with the full body instead
+MAX_RANGES = 16
+
+
+def content_disposition(download_name, as_attachment=False):
+    """
+    Return a Content-Disposition header value, with an RFC 5987 `filename*` for non-ASCII names.
+    """
+    names = {"filename": download_name}
+    try:
+        download_name.encode("ascii")
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize("NFKD", download_name).encode("ascii", "ignore").decode()
+        names = {
+            "filename": simple,
+            "filename*": "UTF-8''" + quote(download_name, safe="!#$&+-.^_`|~"),
+        }
+    return dump_options_header("attachment" if as_attachment else "inline", names)
+
+
+def get_ranges(environ, stream):
+    """
+    Resolve the request's Range header against the stream.
+
+    :return: Sorted, merged list of (start, stop) byte ranges, or None to send the full body
+    :raises ValueError: If none of the requested ranges can be satisfied
+    """
+    header = environ.get("HTTP_RANGE")
+    if not header or not stream.size:
+        return None
+
+    if_range = parse_if_range_header(environ.get("HTTP_IF_RANGE"))
+    # The client's copy must be exactly this version (RFC 9110 13.1.5), else it gets it whole
+    if if_range.date is not None:
+        if if_range.date != stream.last_modified.replace(microsecond=0):
+            return None
+    elif if_range.etag is not None and if_range.etag != stream.etag:
+        return None
+
+    rng = parse_range_header(header)
+    if rng is None or rng.units != "bytes":
+        return None
+
+    ranges = []
+    for start, stop in rng.ranges:
+        if start < 0:
+            start, stop = max(stream.size + start, 0), stream.size
+        else:
+            stop = stream.size if stop is None else min(stop, stream.size)
+        if start < stop:
+            ranges.append([start, stop])
+    if not ranges:
+        raise ValueError("Unsatisfiable range")
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, stop in ranges[1:]:
+        if start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    if len(merged) > MAX_RANGES:
+        return None
+    return [tuple(r) for r in merged]
+
+
+def send_stream(stream, mimetype, download_name, as_attachment=False, max_age=3600):
+    """
+    Build a response for a file opened with `FileManager.stream_file`.
+
+    The body is read in blocks while it is being sent, so memory per download stays constant
+    regardless of file size. Conditional requests are answered from the stream's metadata, and
+    single or multiple byte ranges (`multipart/byteranges`) are read straight from their offsets.
+
+    :param stream: Result of `FileManager.stream_file`
+    :param as_attachment: Set to trigger the "Save As" dialog
+    """
+    environ = frappe.request.environ
+    mimetype = mimetype or "application/octet-stream"
+    response = Response(mimetype=mimetype, direct_passthrough=True)
+    response.call_on_close(stream.close)
+    response.headers["Content-Disposition"] = content_disposition(download_name, as_attachment)
+    response.accept_ranges = "bytes"
+    response.last_modified = stream.last_modified
+    response.set_etag(stream.etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    response.expires = int(time() + max_age)
+
+    if not is_resource_modified(
+        environ, etag=stream.etag, last_modified=stream.last_modified, ignore_if_range=True
+    ):
+        response.status_code = 304
+        return response
+
+    try:
+        ranges = get_ranges(environ, stream)
+    except ValueError:
+        response.status_code = 416
+        response.content_range = f"bytes */{stream.size}"
+        return response
+
+    if ranges is None:
+        response.response = stream.iter_range(0, stream.size)
+        response.content_length = stream.size
+    elif len(ranges) == 1:
+        start, stop = ranges[0]
+        response.status_code = 206
+        response.response = stream.iter_range(start, stop)
+        response.content_range = f"bytes {start}-{stop - 1}/{stream.size}"
+        response.content_length = stop - start
+    else:
+        boundary = secrets.token_hex(16)
+        parts = [
+            (
+                (
+                    f"\r\n--{boundary}\r\n"
+                    f"Content-Type: {mimetype}\r\n"
+                    f"Content-Range: bytes {start}-{stop - 1}/{stream.size}\r\n\r\n"
+                ).encode(),
+                start,
+                stop,
+            )
+            for start, stop in ranges
+        ]
+        closing = f"\r\n--{boundary}--\r\n".encode()
+
+        def multipart_body():
+            for head, start, stop in parts:
+                yield head
+                yield from stream.iter_range(start, stop)
+            yield closing
+
+        response.status_code = 206
+        response.response = multipart_body()
+        response.headers["Content-Type"] = f"multipart/byteranges; boundary={boundary}"
+        response.content_length = sum(len(h) + stop - start for h, start, stop in parts) + len(
+            closing
+        )
+    return response
+
+
+def offload_response(
+    mode, path, disk_root, mimetype, download_name, as_attachment=False, accel_prefix="/protected/"
+):
+    """
+    Build an empty response that tells the web server to send the file itself.
+
+    With `X-Accel-Redirect`, nginx serves the internal `<prefix>private/files/<path>` location
+    (which the bench config maps to the sites directory); with `X-Sendfile`, the absolute path
+    on disk is sent instead. Range and conditional requests are then handled by the web server.
+
+    :param mode: `X-Accel-Redirect` or `X-Sendfile`
+    :param path: File path relative to the site's private files folder
+    :param disk_root: The site's private files folder
+    """
+    response = Response(mimetype=mimetype or "application/octet-stream")
+    response.headers["Content-Disposition"] = content_disposition(download_name, as_attachment)
+    if mode == "X-Accel-Redirect":
+        internal_path = accel_prefix.rstrip("/") + "/private/files/" + str(path).lstrip("/")
+        response.headers["X-Accel-Redirect"] = quote(internal_path)
+    elif mode == "X-Sendfile":
+        response.headers["X-Sendfile"] = str(Path(disk_root, path).resolve())
+    else:
+        raise ValueError(f"Unknown delivery mode {mode}")
+    return response
+
+
+def presigned_redirect(url, expires_in):
+    """
+    Redirect to a presigned URL. The redirect is cached privately for part of the URL's
+    lifetime, so repeat views skip the round trip without ever following an expired URL.
+    """
+    response = redirect(url, code=302)
+    response.cache_control.private = True
+    response.cache_control.max_age = max(int(expires_in) // 2, 0)
+    return response
+
+
+def send_file_content(manager, path, mimetype, download_name, as_attachment=False):
+    """
+    Send a stored file using the site's configured delivery mode.
+
+    With S3 presigned URLs enabled the client is redirected to the bucket. Local disk files are
+    offloaded to the web server when `DMS Site Settings` asks for it. Everything else is
+    streamed through the application.
+
+    :param manager: `FileManager` for the site
+    :param path: Storage path of the file
+    """
+    if manager.s3_enabled and manager.presigned_urls:
+        url = manager.get_presigned_url(path, mimetype, download_name, as_attachment)
+        if url:
+            return presigned_redirect(url, manager.presigned_url_expiry)
+
+    settings = frappe.get_cached_doc("DMS Site Settings")
+    mode = settings.file_delivery or "Application"
+    if not manager.s3_enabled and mode != "Application":
+        return offload_response(
+            mode,
+            path,
+            manager.site_folder,
+            mimetype,
+            download_name,
+            as_attachment,
+            settings.accel_redirect_prefix or "/protected/",
+        )
+    return send_stream(manager.stream_file(path), mimetype, download_name, as_attachment)
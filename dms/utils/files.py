@@ -3,16 +3,39 @@ import os
 from pathlib import Path
 from PIL import Image, ImageOps
 from dms.locks.distributed_lock import DistributedLock
+from dms.utils.delivery import content_disposition
 import cv2
 from pathlib import Path
 import os
 import boto3
 import frappe
+import threading
+import shutil
 from io import BytesIO
+from zlib import adler32
+from contextlib import contextmanager
+from tempfile import NamedTemporaryFile
+from datetime import datetime, timezone
 from botocore.config import Config
+from botocore.exceptions import ClientError
+from pypika import Order, functions as fn
+from frappe.utils import now_datetime
 
 
 DMSFile = frappe.qb.DocType("DMS File")
+SizeDelta = frappe.qb.DocType("DMS Size Delta")
+# The doctype autoincrements, taking each row's name from this sequence
+SIZE_DELTA_SEQUENCE = frappe.scrub("DMS Size Delta_id_seq")
+STREAM_CHUNK_SIZE = 64 * 1024
+S3_MAX_POOL_CONNECTIONS = 50
+
+# Thumbnail renditions, in pixels along the longer side. The largest is rendered from the
+# file itself, the others are resized from it.
+THUMBNAIL_SIZES = (64, 128, 256, 512, 1024)
+
+# Process-wide S3 clients, keyed by (site, settings modified)
+_s3_clients = {}
+_s3_clients_lock = threading.Lock()
 
 MIME_LIST_MAP = {
     "Image": [
@@ -100,6 +123,104 @@ def get_file_type(r):
             return "Unknown"
 
 
+def get_s3_client(settings):
+    """
+    Return the site's S3 client, creating it once per process.
+
+    Clients are keyed on the settings' `modified` timestamp: saving `DMS S3 Settings` clears the
+    cached doc for every process, so each one builds a fresh client on its next request.
+    The client keeps a pool of keep-alive connections and is safe to share between threads.
+    """
+    key = (frappe.local.site, str(settings.modified))
+    conn = _s3_clients.get(key)
+    if conn:
+        return conn
+
+    with _s3_clients_lock:
+        if key not in _s3_clients:
+            clear_s3_client()
+            _s3_clients[key] = boto3.session.Session().client(
+                "s3",
+                aws_access_key_id=settings.aws_key,
+                aws_secret_access_key=settings.get_password("aws_secret"),
+                endpoint_url=(settings.endpoint_url or None),
+                config=Config(
+                    signature_version=settings.signature_version,
+                    max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                    tcp_keepalive=True,
+                    retries={"max_attempts": 3, "mode": "standard"},
+                ),
+            )
+        return _s3_clients[key]
+
+
+def clear_s3_client():
+    """Drop this process's S3 clients for the current site"""
+    for key in [k for k in _s3_clients if k[0] == frappe.local.site]:
+        _s3_clients.pop(key, None)
+
+
+class DiskStream:
+    """
+    A file on disk that can be streamed whole or by byte ranges, using seeks on a single handle.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        stat = os.fstat(self.file.fileno())
+        self.size = stat.st_size
+        self.last_modified = datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+        self.etag = f"{stat.st_mtime}-{stat.st_size}-{adler32(str(path).encode()) & 0xFFFFFFFF}"
+
+    def iter_range(self, start=0, stop=None):
+        """Yield the bytes in [start, stop) in blocks"""
+        stop = self.size if stop is None else stop
+        self.file.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = self.file.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+    def close(self):
+        self.file.close()
+
+
+class S3Stream:
+    """
+    An S3 object that can be streamed whole or by byte ranges - each range is a ranged GET,
+    so only the requested bytes leave the bucket.
+    """
+
+    def __init__(self, conn, bucket, key):
+        self.conn = conn
+        self.bucket = bucket
+        self.key = key
+        head = conn.head_object(Bucket=bucket, Key=key)
+        self.size = head["ContentLength"]
+        self.last_modified = head["LastModified"]
+        self.etag = head["ETag"].strip('"')
+
+    def iter_range(self, start=0, stop=None):
+        """Yield the bytes in [start, stop) in blocks"""
+        stop = self.size if stop is None else stop
+        if stop <= start:
+            return
+        kwargs = {}
+        if start or stop < self.size:
+            kwargs["Range"] = f"bytes={start}-{stop - 1}"
+        body = self.conn.get_object(Bucket=self.bucket, Key=self.key, **kwargs)["Body"]
+        try:
+            yield from body.iter_chunks(STREAM_CHUNK_SIZE)
+        finally:
+            body.close()
+
+    def close(self):
+        pass
+
+
 class FileManager:
     ACCEPTABLE_MIME_TYPES = [
         "application/msword",
@@ -113,18 +234,14 @@ class FileManager:
     ]
 
     def __init__(self):
-        settings = frappe.get_single("DMS S3 Settings")
+        settings = frappe.get_cached_doc("DMS S3 Settings")
         self.s3_enabled = settings.enabled
         self.bucket = settings.bucket
+        self.presigned_urls = settings.presigned_urls
+        self.presigned_url_expiry = settings.presigned_url_expiry or 300
         self.site_folder = Path(frappe.get_site_path("private/files"))
         if self.s3_enabled:
-            self.conn = boto3.client(
-                "s3",
-                aws_access_key_id=settings.aws_key,
-                aws_secret_access_key=settings.get_password("aws_secret"),
-                endpoint_url=(settings.endpoint_url or None),
-                config=Config(signature_version=settings.signature_version),
-            )
+            self.conn = get_s3_client(settings)
 
     def can_create_thumbnail(self, file):
         # Don't create thumbnails for text files
@@ -134,44 +251,87 @@ class FileManager:
             or file.mime_type in FileManager.ACCEPTABLE_MIME_TYPES
         )
 
-    def upload_file(self, current_path: str, new_path: str, dms_file: str = None) -> None:
+    def upload_file(self, current_path: str, new_path: str) -> None:
         """
         Moves the file from the current path to another path
         """
         if self.s3_enabled:
             self.conn.upload_file(current_path, self.bucket, new_path)
-            if dms_file and self.can_create_thumbnail(dms_file):
-                frappe.enqueue(
-                    self.upload_thumbnail,
-                    now=True,
-                    at_front=True,
-                    file=dms_file,
-                    file_path=current_path,
-                )
-            else:
-                os.remove(current_path)
+            os.remove(current_path)
         else:
             os.rename(current_path, self.site_folder / new_path)
-            if dms_file and self.can_create_thumbnail(dms_file):
-                frappe.enqueue(
-                    self.upload_thumbnail,
-                    now=True,
-                    at_front=True,
-                    file=dms_file,
-                    file_path=str(self.site_folder / new_path),
-                )
 
-    def upload_thumbnail(self, file, file_path: str):
+    def start_multipart_upload(self, key, mime_type=None):
+        """
+        Start an S3 multipart upload and return its upload ID
+        """
+        kwargs = {"ContentType": mime_type} if mime_type else {}
+        response = self.conn.create_multipart_upload(Bucket=self.bucket, Key=key, **kwargs)
+        return response["UploadId"]
+
+    def upload_part(self, key, upload_id, part_number, data):
+        """
+        Upload one part of a multipart upload and return its ETag
+        """
+        return self.conn.upload_part(
+            Bucket=self.bucket, Key=key, UploadId=upload_id, PartNumber=part_number, Body=data
+        )["ETag"]
+
+    def complete_multipart_upload(self, key, upload_id, parts):
+        """
+        :param parts: List of (part number, ETag) tuples, in any order
+        """
+        self.conn.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": [{"PartNumber": n, "ETag": e} for n, e in sorted(parts)]},
+        )
+
+    def abort_multipart_upload(self, key, upload_id):
+        self.conn.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+
+    def abort_stale_multipart_uploads(self, older_than, prefixes):
+        """
+        Abort multipart uploads started before `older_than` under any of `prefixes`, so their
+        parts stop being billed.
+
+        :param older_than: Timezone-aware datetime
+        :param prefixes: Key prefixes (home folders) that belong to this site
+        :return: Number of aborted uploads
+        """
+        aborted = 0
+        paginator = self.conn.get_paginator("list_multipart_uploads")
+        for prefix in prefixes:
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{prefix}/"):
+                for upload in page.get("Uploads", []):
+                    if upload["Initiated"] < older_than:
+                        self.abort_multipart_upload(upload["Key"], upload["UploadId"])
+                        aborted += 1
+        return aborted
+
+    def upload_thumbnail(self, file, file_path: str = None):
         """
         Creates a thumbnail for the file on disk and then uploads to the relevant team directory
+
+        :param file_path: Local copy of the file, if there is one. Defaults to the stored file
+        :return: True if a thumbnail was created
         """
         print("CREATE THUMBNAIL")
         team_directory = get_home_folder(file.team)["name"]
         save_path = Path(team_directory) / "thumbnails" / (file.name + ".png")
         disk_path = str((self.site_folder / save_path).resolve())
 
-        if not file_path:
-            file_path = str((file_path).resolve())
+        downloaded = False
+        if not file_path and self.s3_enabled:
+            # Multipart uploads never touch local disk - fetch the object to render it
+            file_path = self.site_folder / team_directory / "uploads" / Path(file.path).name
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            file_path = str(file_path)
+            self.conn.download_file(self.bucket, file.path, file_path)
+            downloaded = True
+        elif not file_path:
+            file_path = str(self.site_folder / file.path)
 
         with DistributedLock(file.path, exclusive=False):
             try:
@@ -179,7 +339,7 @@ class FileManager:
                 if file.mime_type.startswith("image"):
                     with Image.open(file_path).convert("RGB") as image:
                         image = ImageOps.exif_transpose(image)
-                        image.thumbnail((512, 512))
+                        image.thumbnail((THUMBNAIL_SIZES[-1], THUMBNAIL_SIZES[-1]))
                         image.save(str(disk_path), format="webp")
                 elif file.mime_type.startswith("video"):
                     cap = cv2.VideoCapture(file_path)
@@ -204,27 +364,36 @@ class FileManager:
                         disk_path,
                         {
                             "trim": False,
-                            "height": 512,
-                            "width": 512,
+                            "height": THUMBNAIL_SIZES[-1],
+                            "width": THUMBNAIL_SIZES[-1],
                             "quality": 100,
                             "type": "thumbnail",
                         },
                     )
                 final_path = Path(disk_path)
+                with Image.open(final_path) as image:
+                    for size in THUMBNAIL_SIZES:
+                        if size < max(image.size):
+                            self.save_thumbnail(
+                                self.get_thumbnail_path(file.team, file.name, size),
+                                resize_thumbnail(image, size),
+                            )
                 if self.s3_enabled:
-                    os.remove(file_path)
                     self.conn.upload_file(
                         final_path, self.bucket, str(save_path.with_suffix(".thumbnail"))
                     )
                     final_path.unlink()
                 else:
                     final_path.rename(final_path.with_suffix(".thumbnail"))
-
-            except Exception as e:
-                try:
-                    os.remove(file_path)
-                except FileNotFoundError:
-                    pass
+                return True
+            except Exception:
+                frappe.log_error(f"Thumbnail generation failed for {file.name}")
+                Path(disk_path).unlink(missing_ok=True)
+                return False
+            finally:
+                # Only remove our own download - never the stored file itself
+                if downloaded:
+                    Path(file_path).unlink(missing_ok=True)
 
     def get_file(self, path):
         """
@@ -246,21 +415,200 @@ class FileManager:
 
         return buf
 
-    def get_thumbnail_path(self, team, name):
-        return Path(get_home_folder(team)["name"]) / "thumbnails" / (name + ".thumbnail")
+    def stream_file(self, path):
+        """
+        Open a file for streaming without reading it into memory.
+
+        Files are never rewritten in place (uploads are renamed into position), so no read lock
+        is held while the stream is being sent.
+
+        Temporary: if not found in S3, look at disk.
+        """
+        if self.s3_enabled:
+            try:
+                return S3Stream(self.conn, self.bucket, path)
+            except ClientError:
+                pass
+        return DiskStream(self.site_folder / path)
+
+    def file_exists(self, path):
+        if self.s3_enabled:
+            try:
+                self.conn.head_object(Bucket=self.bucket, Key=path)
+                return True
+            except ClientError:
+                pass
+        return (self.site_folder / path).exists()
+
+    def get_presigned_url(self, path, mimetype=None, download_name=None, as_attachment=False):
+        """
+        Return a short-lived URL that fetches the object straight from the bucket.
+
+        The response headers S3 sends are overridden so that the content type and filename
+        match what the application would have sent.
+
+        Temporary: files still on disk are not in the bucket, so None is returned for them.
+        """
+        if (self.site_folder / path).exists():
+            return None
+        params = {"Bucket": self.bucket, "Key": path}
+        if mimetype:
+            params["ResponseContentType"] = mimetype
+        if download_name:
+            params["ResponseContentDisposition"] = content_disposition(
+                download_name, as_attachment
+            )
+        return self.conn.generate_presigned_url(
+            "get_object", Params=params, ExpiresIn=int(self.presigned_url_expiry)
+        )
+
+    def get_thumbnail_path(self, team, name, size=None):
+        """
+        :param size: One of `THUMBNAIL_SIZES` for a rendition, or None for the full thumbnail
+        """
+        filename = f"{name}.{size}.thumbnail" if size else f"{name}.thumbnail"
+        return Path(get_home_folder(team)["name"]) / "thumbnails" / filename
+
+    def get_sprite_path(self, team, folder, version):
+        """
+        :return: Paths of a version of the folder's sprite sheet, and of its offset map
+        """
+        directory = Path(get_home_folder(team)["name"]) / "thumbnails" / "sprites"
+        return directory / f"{folder}.{version}.webp", directory / f"{folder}.json"
+
+    def get_video_path(self, team, name, asset=""):
+        """
+        :param asset: Path of a poster, storyboard or HLS file within the video's folder
+        :return: Path of the video's transcoded assets, or of one of them
+        """
+        return Path(get_home_folder(team)["name"]) / "thumbnails" / "video" / name / asset
+
+    def get_pages_path(self, team, name, asset=""):
+        """
+        :param asset: Name of a page image or text layer within the document's folder
+        :return: Path of the document's rendered pages, or of one of them
+        """
+        return Path(get_home_folder(team)["name"]) / "thumbnails" / "pages" / name / asset
 
-    def get_thumbnail(self, team, name):
-        return self.get_file(str(self.get_thumbnail_path(team, name)))
+    def get_thumbnail(self, team, name, size=None):
+        """
+        Read a thumbnail. Renditions that don't exist yet are resized from the full thumbnail
+        and stored next to it.
+
+        :param size: One of `THUMBNAIL_SIZES`, or None for the full thumbnail
+        :raises FileNotFoundError: If the file has no thumbnail
+        """
+        if not size:
+            return self.get_file(str(self.get_thumbnail_path(team, name)))
+        try:
+            return self.get_file(str(self.get_thumbnail_path(team, name, size)))
+        except FileNotFoundError:
+            pass
+
+        full = BytesIO(self.get_thumbnail(team, name).read())
+        with Image.open(full) as image:
+            if max(image.size) <= size:
+                full.seek(0)
+                return full
+            data = resize_thumbnail(image, size)
+        self.save_thumbnail(self.get_thumbnail_path(team, name, size), data)
+        return BytesIO(data)
+
+    def save_thumbnail(self, path, data, content_type="image/webp"):
+        if self.s3_enabled:
+            self.conn.put_object(
+                Bucket=self.bucket, Key=str(path), Body=data, ContentType=content_type
+            )
+        else:
+            disk_path = self.site_folder / path
+            disk_path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = disk_path.with_name(f"{disk_path.name}.{frappe.generate_hash(length=8)}")
+            temp_path.write_bytes(data)
+            temp_path.rename(disk_path)
+
+    @contextmanager
+    def local_copy(self, path):
+        """
+        Path on local disk of a stored file, for tools that can only read files. S3 objects are
+        downloaded to a temporary file that is removed afterwards.
+        """
+        if not self.s3_enabled or (self.site_folder / path).exists():
+            yield str(self.site_folder / path)
+            return
+        with NamedTemporaryFile(suffix=Path(path).suffix) as f:
+            self.conn.download_fileobj(self.bucket, path, f)
+            f.flush()
+            yield f.name
+
+    def upload_directory(self, directory, prefix, content_types, last=None):
+        """
+        Store every file under a local directory at the same relative path under `prefix`.
+
+        :param content_types: Content type of each file extension, for S3
+        :param last: Relative path of a file to store after all the others, so that readers who
+            look for it never find the directory half-written
+        """
+        directory = Path(directory)
+        files = sorted(p for p in directory.rglob("*") if p.is_file())
+        if last:
+            files.sort(key=lambda p: p == directory / last)
+        for file in files:
+            key = Path(prefix) / file.relative_to(directory)
+            if self.s3_enabled:
+                content_type = content_types.get(file.suffix, "application/octet-stream")
+                self.conn.upload_file(
+                    str(file), self.bucket, str(key), ExtraArgs={"ContentType": content_type}
+                )
+            else:
+                (self.site_folder / key).parent.mkdir(parents=True, exist_ok=True)
+                shutil.move(file, self.site_folder / key)
+
+    def delete_directory(self, prefix):
+        if self.s3_enabled:
+            paginator = self.conn.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{prefix}/"):
+                if page.get("Contents"):
+                    self.conn.delete_objects(
+                        Bucket=self.bucket,
+                        Delete={
+                            "Objects": [{"Key": o["Key"]} for o in page["Contents"]],
+                            "Quiet": True,
+                        },
+                    )
+        else:
+            shutil.rmtree(self.site_folder / prefix, ignore_errors=True)
+
+    def delete_thumbnail(self, path):
+        if self.s3_enabled:
+            self.conn.delete_object(Bucket=self.bucket, Key=str(path))
+        else:
+            (self.site_folder / path).unlink(missing_ok=True)
 
     def delete_file(self, team, name, path):
+        thumbnails = [self.get_thumbnail_path(team, name)] + [
+            self.get_thumbnail_path(team, name, size) for size in THUMBNAIL_SIZES
+        ]
         if self.s3_enabled:
             self.conn.delete_object(Bucket=self.bucket, Key=path)
+            self.conn.delete_objects(
+                Bucket=self.bucket,
+                Delete={"Objects": [{"Key": str(p)} for p in thumbnails], "Quiet": True},
+            )
         else:
-            try:
-                (self.site_folder / path).unlink()
-                self.get_thumbnail_path(team, name).unlink()
-            except FileNotFoundError:
-                pass
+            (self.site_folder / path).unlink(missing_ok=True)
+            for thumbnail in thumbnails:
+                (self.site_folder / thumbnail).unlink(missing_ok=True)
+
+
+def resize_thumbnail(image, size):
+    """
+    Return `image` scaled to fit within `size` pixels, encoded as webp
+    """
+    image = image.copy()
+    image.thumbnail((size, size))
+    buf = BytesIO()
+    image.save(buf, format="webp")
+    return buf.getvalue()
 
 
 def get_home_folder(team):
@@ -306,7 +654,7 @@ def get_new_title(title, parent_name, folder=False):
     if folder:
         filters["is_group"] = 1
 
-    sibling_entity_titles = frappe.db.get_list(
+    sibling_entity_titles = frappe.get_all(
         "DMS File",
         filters=filters,
         pluck="title",
@@ -350,65 +698,112 @@ def dribble_access(path):
 @frappe.whitelist()
 def generate_upward_path(entity_name, user=None):
     """
-    Given an ID traverse upwards till the root node
-    Stops when parent_dms_file IS NULL
+    Given an ID traverse upwards till the root node, using its lineage
     """
-    entity = frappe.db.escape(entity_name)
     if user is None:
         user = frappe.session.user
-    user = frappe.db.escape(user if user != "Guest" else "")
-    result = frappe.db.sql(
-        f"""WITH RECURSIVE
-            generated_path as (
-                SELECT
-                    `tabDMS File`.title,
-                    `tabDMS File`.name,
-                    `tabDMS File`.team,
-                    `tabDMS File`.parent_entity,
-                    `tabDMS File`.is_private,
-                    `tabDMS File`.owner,
-                    0 AS level
-                FROM
-                    `tabDMS File`
-                WHERE
-                    `tabDMS File`.name = {entity}
-                UNION ALL
-                SELECT
-                    t.title,
-                    t.name,
-                    t.team,
-                    t.parent_entity,
-                    t.is_private,
-                    t.owner,
-                    gp.level + 1
-                FROM
-                    generated_path as gp
-                    JOIN `tabDMS File` as t ON t.name = gp.parent_entity
-            )
-        SELECT
-            gp.title,
-            gp.name,
-            gp.owner,
-            gp.parent_entity,
-            gp.is_private,
-            gp.team,
-            p.read,
-            p.write,
-            p.comment,
-            p.share
-        FROM
-            generated_path  as gp
-        LEFT JOIN `tabDMS Permission` as p
-        ON gp.name = p.entity AND p.user = {user}
-        ORDER BY gp.level DESC;
-    """,
-        as_dict=1,
+    user = user if user != "Guest" else ""
+    names = get_lineage_names(entity_name)
+    Permission = frappe.qb.DocType("DMS Permission")
+    result = (
+        frappe.qb.from_(DMSFile)
+        .left_join(Permission)
+        .on((DMSFile.name == Permission.entity) & (Permission.user == user))
+        .select(
+            DMSFile.title,
+            DMSFile.name,
+            DMSFile.owner,
+            DMSFile.parent_entity,
+            DMSFile.is_private,
+            DMSFile.team,
+            Permission.read,
+            Permission.write,
+            Permission.comment,
+            Permission.share,
+        )
+        .where(DMSFile.name.isin(names))
+        .run(as_dict=True)
     )
+    # Root first
+    result.sort(key=lambda r: names.index(r.name))
     for i, p in enumerate(result):
         result[i] = {**p, **dribble_access(result[: i + 1])}
     return result
 
 
+def get_lineage(parent_entity, name):
+    """
+    Materialized path of an entity: the names of its ancestors from the root down and its own,
+    joined by slashes. Ancestors are then read from a single row, and descendants are the rows
+    whose lineage starts with it, a range scan on the `lineage` index.
+
+    Ancestors without a lineage of their own, like rows written before it was introduced or
+    with `db_insert`, are followed up through `parent_entity` instead.
+
+    :raises DoesNotExistError: If the parent or one of its ancestors does not exist
+    """
+    if not parent_entity:
+        return name
+    parent = frappe.db.get_value(
+        "DMS File", parent_entity, ["lineage", "parent_entity"], as_dict=True
+    )
+    if not parent:
+        frappe.throw(f"Folder {parent_entity} does not exist.", frappe.DoesNotExistError)
+    return (parent.lineage or get_lineage(parent.parent_entity, parent_entity)) + "/" + name
+
+
+def get_lineage_names(entity_name):
+    """
+    :return: Names from the root down to the entity, inclusive
+    """
+    entity = frappe.db.get_value(
+        "DMS File", entity_name, ["lineage", "parent_entity"], as_dict=True
+    )
+    if not entity:
+        return [entity_name]
+    return (entity.lineage or get_lineage(entity.parent_entity, entity_name)).split("/")
+
+
+def get_descendant_names(lineage):
+    """
+    :param lineage: Lineage of the entity
+    :return: Names of all its descendants, deepest first
+    """
+    return (
+        frappe.qb.from_(DMSFile)
+        .select(DMSFile.name)
+        .where(DMSFile.lineage.like(lineage + "/%"))
+        .orderby(fn.Length(DMSFile.lineage), order=Order.desc)
+        .run(pluck=True)
+    )
+
+
+def update_descendants(lineage, field, value):
+    """
+    Set a field on all descendants of an entity in a single update, without running their hooks.
+    """
+    (
+        frappe.qb.update(DMSFile)
+        .set(DMSFile[field], value)
+        .where(DMSFile.lineage.like(lineage + "/%"))
+        .run()
+    )
+
+
+def move_lineage(old, new):
+    """
+    Rewrite the lineages of an entity's descendants after it moved, in a single update.
+    """
+    frappe.db.sql(
+        """
+        UPDATE `tabDMS File`
+        SET lineage = CONCAT(%(new)s, SUBSTRING(lineage, %(start)s))
+        WHERE lineage LIKE %(descendants)s
+        """,
+        {"new": new, "start": len(old) + 1, "descendants": old + "/%"},
+    )
+
+
 def get_valid_breadcrumbs(entity, user_access):
     """
     Determine user access and generate upward path (breadcrumbs).
@@ -425,14 +820,125 @@ def get_valid_breadcrumbs(entity, user_access):
 
 
 def update_file_size(entity, delta):
-    doc = frappe.get_doc("DMS File", entity)
-    while doc.parent_entity:
-        doc.file_size += delta
-        doc.save(ignore_permissions=True)
-        doc = frappe.get_doc("DMS File", doc.parent_entity)
-    # Update root
-    doc.file_size += delta
-    doc.save(ignore_permissions=True)
+    """
+    Add `delta` to the size of a folder and each of its ancestors. The change is appended to
+    the `DMS Size Delta` journal, one row per folder in its lineage, in the caller's transaction.
+    Nothing locks the folders' own rows, so parallel uploads into one tree don't wait on each
+    other. `compact_size_deltas` folds the journal into `file_size` in the background, and
+    readers add what is still pending with `get_pending_sizes`.
+    """
+    if entity and delta:
+        names = get_lineage_names(entity)
+        now, user = now_datetime(), frappe.session.user
+        # A single INSERT for the whole lineage, each row naming itself from the sequence
+        row = f"(NEXTVAL(`{SIZE_DELTA_SEQUENCE}`), %s, %s, %s, %s, %s, %s)"
+        frappe.db.sql(
+            f"""
+            INSERT INTO `tabDMS Size Delta`
+                (name, entity, delta, creation, modified, owner, modified_by)
+            VALUES {", ".join([row] * len(names))}
+            """,
+            tuple(v for name in names for v in (name, delta, now, now, user, user)),
+        )
+
+
+def get_pending_sizes(names):
+    """
+    :return: Dict of entity name to the sum of its journaled size deltas not compacted yet
+    """
+    if not names:
+        return {}
+    rows = (
+        frappe.qb.from_(SizeDelta)
+        .select(SizeDelta.entity, fn.Sum(SizeDelta.delta))
+        .where(SizeDelta.entity.isin(list(names)))
+        .groupby(SizeDelta.entity)
+        .run()
+    )
+    return {entity: int(delta) for entity, delta in rows}
+
+
+def add_pending_sizes(rows):
+    """
+    Add pending size deltas to the `file_size` of listed folders.
+    """
+    pending = get_pending_sizes({r["name"] for r in rows if r["is_group"]})
+    for r in rows:
+        r["file_size"] = (r["file_size"] or 0) + pending.get(r["name"], 0)
+
+
+def get_file_size(entity):
+    """
+    Current size of a file or folder, pending deltas included.
+
+    :param entity: DMSEntity doc, or dict with `name` and `file_size`
+    """
+    return (entity.file_size or 0) + get_pending_sizes([entity.name]).get(entity.name, 0)
+
+
+def compact_size_deltas(batch_size=1000):
+    """
+    Fold the size delta journal into `DMS File.file_size`, a batch at a time. Each batch is
+    claimed with a locking read, summed per folder and deleted in the same transaction, so
+    concurrent runs never fold a row twice. Only `file_size` is written: `modified` orders
+    listings and versions thumbnails, and compacting changes neither.
+    """
+    while True:
+        rows = (
+            frappe.qb.from_(SizeDelta)
+            .select(SizeDelta.name, SizeDelta.entity, SizeDelta.delta)
+            .orderby(SizeDelta.name)
+            .limit(batch_size)
+            .for_update()
+            .run(as_dict=True)
+        )
+        if not rows:
+            return
+        totals = {}
+        for r in rows:
+            totals[r.entity] = totals.get(r.entity, 0) + r.delta
+        for entity, delta in totals.items():
+            (
+                frappe.qb.update(DMSFile)
+                .set(DMSFile.file_size, DMSFile.file_size + delta)
+                .where(DMSFile.name == entity)
+                .run()
+            )
+        frappe.qb.from_(SizeDelta).delete().where(
+            SizeDelta.name.isin([r.name for r in rows])
+        ).run()
+        frappe.db.commit()
+
+
+def update_child_count(entity, delta):
+    """
+    Add `delta` to a folder's count of active children. The update is done in SQL, so
+    concurrent uploads to the same folder don't lose counts.
+    """
+    if entity and delta:
+        (
+            frappe.qb.update(DMSFile)
+            .set(DMSFile.child_count, DMSFile.child_count + delta)
+            .where(DMSFile.name == entity)
+            .run()
+        )
+
+
+def update_share_count(entity):
+    """
+    Recount who an entity is shared with from its permissions: `share_kind` is Public or Team
+    when it is shared with everyone or the whole team, and `share_count` is the number of
+    individual users.
+    """
+    users = frappe.get_all("DMS Permission", filters={"entity": entity}, pluck="user")
+    share_kind = "Public" if "" in users else "Team" if "$TEAM" in users else ""
+    share_count = sum(1 for user in users if user not in ("", "$TEAM"))
+    frappe.db.set_value(
+        "DMS File",
+        entity,
+        {"share_count": share_count, "share_kind": share_kind},
+        update_modified=False,
+    )
 
 
 def if_folder_exists(team, folder_name, parent, personal):
@@ -0,0 +1,156 @@
+"""
+Benchmark the indexes of `dms.utils.indexes` against a synthetic dataset:
+
+    bench --site <site> execute dms.utils.index_benchmark.run --kwargs "{'rows': 1000000}"
+
+Scratch copies of the DMS tables are filled with `rows` files (and a permission, favourite and
+recents row for every fifth one) using MariaDB's sequence engine, without touching the site's
+data. Each hot query is explained and timed without the indexes, then again with them, and the
+copies are dropped at the end.
+"""
+
+import time
+import frappe
+from dms.utils.indexes import INDEXES, index_columns
+
+TABLES = {
+    "DMS File": "_bench_dms_file",
+    "DMS Permission": "_bench_dms_permission",
+    "DMS Favourite": "_bench_dms_favourite",
+    "DMS Entity Log": "_bench_dms_entity_log",
+}
+
+# Spread of the synthetic data: files per folder, teams and users
+FOLDER_SIZE = 50
+TEAMS = 10
+USERS = 1000
+
+QUERIES = {
+    "folder listing": """
+        select f.name, p.read from _bench_dms_file f
+        left join _bench_dms_permission p on p.entity = f.name and p.user = 'u7@example.com'
+        where f.parent_entity = 'f200' and f.is_active = 1
+        order by f.modified desc, f.name desc limit 20
+    """,
+    "home folder": """
+        select name from _bench_dms_file where team = 't3' and parent_entity is null
+    """,
+    "trash": """
+        select name from _bench_dms_file where owner = 'u7@example.com' and is_active = 0
+        order by modified desc limit 20
+    """,
+    "access check": """
+        select `read`, `write` from _bench_dms_permission
+        where entity = 'f5000' and user = 'u0@example.com'
+    """,
+    "shared with me": """
+        select f.name from _bench_dms_permission p
+        join _bench_dms_file f on f.name = p.entity
+        where p.user = 'u7@example.com' and p.read = 1 and f.is_active = 1
+        order by f.modified desc limit 20
+    """,
+    "favourites": """
+        select f.name from _bench_dms_favourite v
+        join _bench_dms_file f on f.name = v.entity
+        where v.user = 'u7@example.com' limit 20
+    """,
+    "recents": """
+        select entity_name from _bench_dms_entity_log where user = 'u7@example.com'
+        order by last_interaction desc limit 20
+    """,
+}
+
+
+def run(rows=1_000_000, repeat=20):
+    """
+    :param rows: Number of synthetic files
+    :param repeat: Times each query is run, the median is reported
+    """
+    try:
+        create_tables(int(rows))
+        print("Without indexes\n")
+        before = measure(int(repeat))
+        for doctype, table in TABLES.items():
+            for fields in INDEXES[doctype]:
+                columns = ", ".join(index_columns(fields))
+                frappe.db.sql_ddl(f"alter table {table} add index ({columns})")
+        print("With indexes\n")
+        after = measure(int(repeat))
+        print(f"{'Query':<16}{'Before (ms)':>14}{'After (ms)':>14}")
+        for name in QUERIES:
+            print(f"{name:<16}{before[name]:>14.2f}{after[name]:>14.2f}")
+    finally:
+        for table in TABLES.values():
+            frappe.db.sql_ddl(f"drop table if exists {table}")
+
+
+def create_tables(rows):
+    for doctype, table in TABLES.items():
+        frappe.db.sql_ddl(f"drop table if exists {table}")
+        frappe.db.sql_ddl(f"create table {table} like `tab{doctype}`")
+        # Start from the primary key only
+        indexes = frappe.db.sql(f"show index from {table} where Key_name != 'PRIMARY'", as_dict=1)
+        for index in {i.Key_name for i in indexes}:
+            frappe.db.sql_ddl(f"alter table {table} drop index `{index}`")
+
+    frappe.db.sql(f"""
+        insert into _bench_dms_file
+            (name, title, team, parent_entity, is_group, is_active, is_private, owner,
+             file_size, creation, modified)
+        select
+            concat('f', seq),
+            concat('File ', seq),
+            concat('t', seq % {TEAMS}),
+            if(seq <= {TEAMS}, null, concat('f', seq div {FOLDER_SIZE})),
+            seq % {FOLDER_SIZE} = 0,
+            if(seq % 20 = 0, 0, 1),
+            seq % 3 = 0,
+            concat('u', seq % {USERS}, '@example.com'),
+            seq * 10,
+            now() - interval seq second,
+            now() - interval seq second
+        from seq_1_to_{rows}
+        """)
+    # Every fifth file is shared with, favourited and recently opened by someone
+    user = f"concat('u', seq % {USERS - 3}, '@example.com')"
+    for table, columns, values in (
+        (
+            "_bench_dms_permission",
+            "entity, user, `read`, `write`, owner",
+            f"concat('f', seq), {user}, 1, seq % 2, concat('u', seq % {USERS}, '@example.com')",
+        ),
+        ("_bench_dms_favourite", "entity, user", f"concat('f', seq), {user}"),
+        ("_bench_dms_entity_log", "entity_name, user", f"concat('f', seq), {user}"),
+    ):
+        frappe.db.sql(f"""
+            insert into {table} (name, {columns})
+            select concat('b', seq), {values} from seq_1_to_{rows} where seq % 5 = 0
+            """)
+    frappe.db.sql(
+        "update _bench_dms_entity_log set last_interaction = now() - interval rand() * 1e6 second"
+    )
+    frappe.db.commit()
+    for table in TABLES.values():
+        frappe.db.sql(f"analyze table {table}")
+
+
+def measure(repeat):
+    """
+    Print the plan of each query and return its median latency in milliseconds
+    """
+    latencies = {}
+    for name, query in QUERIES.items():
+        print(name)
+        for step in frappe.db.sql(f"explain {query}", as_dict=1):
+            print(
+                f"  {step.table:<24}{step.type or '':<8}{step.key or '-':<40}"
+                f"{step.rows or '':>10}  {step.Extra or ''}"
+            )
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            frappe.db.sql(query)
+            timings.append((time.perf_counter() - start) * 1000)
+        latencies[name] = sorted(timings)[len(timings) // 2]
+        print()
+    return latencies
@@ -0,0 +1,58 @@
+import frappe
+import re
+
+# Composite indexes for the query shapes the listings, permission checks and cleanups run.
+# Each doctype's `on_doctype_update` creates its own, so they are added on migrate.
+INDEXES = {
+    "DMS File": [
+        ["title"],
+        # Descendants of a folder, a range scan on the materialized path
+        ["lineage(255)"],
+        # Folder contents, child counts and sprite sheets
+        ["parent_entity", "is_active", "is_private"],
+        # Home folder lookups, and team-wide listings (recents, favourites, trash)
+        ["team", "parent_entity"],
+        ["team", "is_active", "modified"],
+        ["owner", "is_active"],
+    ],
+    "DMS Permission": [
+        # Access checks and the permission join of every listing
+        ["entity", "user"],
+        # Shared with and by the current user
+        ["user", "read", "entity"],
+        ["owner", "entity"],
+    ],
+    "DMS Favourite": [
+        ["entity", "user"],
+        ["user", "entity"],
+    ],
+    "DMS Entity Log": [
+        ["entity_name", "user"],
+        # Recents, covering the join back to the file
+        ["user", "last_interaction", "entity_name"],
+    ],
+    "DMS Entity Activity Log": [
+        ["entity", "creation"],
+    ],
+    # Pending size changes of listed folders
+    "DMS Size Delta": [
+        ["entity"],
+    ],
+}
+
+
+def index_columns(fields):
+    """
+    Quote the column names of an index, keeping prefix lengths like `lineage(255)`. Some
+    columns, like `read`, are reserved words.
+    """
+    return [re.sub(r"^(\w+)", r"`\1`", field) for field in fields]
+
+
+def add_indexes(doctype):
+    """
+    Create the indexes of `INDEXES` for a doctype that don't exist yet.
+    """
+    for fields in INDEXES[doctype]:
+        index_name = frappe.db.get_index_name(fields)
+        frappe.db.add_index(doctype, index_columns(fields), index_name)
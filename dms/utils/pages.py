@@ -0,0 +1,219 @@
+import frappe
+import json
+import re
+import shutil
+import subprocess
+from functools import partial
+from io import BytesIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from PIL import Image
+from dms.utils.files import FileManager
+
+PAGES_JOB_TIMEOUT = 2 * 60 * 60
+
+# Page images, by width in pixels. The widest is rendered, the others are resized from it.
+PAGE_WIDTHS = (400, 800, 1600)
+PAGE_BATCH_SIZE = 20
+
+# Per tool run, so one stuck conversion can't hold the worker for the whole job
+PAGE_TOOL_TIMEOUT = 10 * 60
+
+# Rewritten after every batch, so viewers can start on the first pages of a long document
+PAGES_MANIFEST = "pages.json"
+
+
+def can_render_pages(mime_type):
+    return mime_type == "application/pdf" or mime_type in FileManager.ACCEPTABLE_MIME_TYPES
+
+
+def queue_pages(file):
+    """
+    Queue the file's pages to be rendered once the current transaction has been committed.
+
+    :param file: DMSEntity doc, or dict with `name`
+    """
+    frappe.db.after_commit.add(partial(enqueue_pages_job, file.name))
+
+
+def enqueue_pages_job(entity_name):
+    frappe.enqueue(
+        process_pages,
+        queue="long",
+        job_id=f"dms-pages-{entity_name}",
+        deduplicate=True,
+        timeout=PAGES_JOB_TIMEOUT,
+        entity_name=entity_name,
+    )
+
+
+def run_tool(*args):
+    return subprocess.run(
+        [str(a) for a in args], capture_output=True, check=True, timeout=PAGE_TOOL_TIMEOUT
+    ).stdout
+
+
+def render_batch(manager, file, source, work, first, last):
+    """
+    Rasterize pages `first` to `last` and extract their text, storing each page's image and
+    text layer.
+
+    :return: Width and height of each page image
+    """
+    # fmt: off
+    run_tool(
+        "pdftoppm", "-png", "-scale-to-x", PAGE_WIDTHS[-1], "-scale-to-y", -1,
+        "-f", first, "-l", last, source, work / "page",
+    )
+    # fmt: on
+    texts = run_tool("pdftotext", "-layout", "-f", first, "-l", last, source, "-").split(b"\f")
+
+    sizes = []
+    # Page numbers in the names are zero-padded to a width that depends on the page count
+    images = sorted(work.glob("page-*.png"), key=lambda p: int(p.stem.rsplit("-", 1)[1]))
+    for i, path in enumerate(images):
+        page = first + i
+        with Image.open(path) as image:
+            sizes.append(image.size)
+            buf = BytesIO()
+            image.convert("RGB").save(buf, format="webp", quality=80)
+        path.unlink()
+        manager.save_thumbnail(
+            manager.get_pages_path(file.team, file.name, f"{page}.{PAGE_WIDTHS[-1]}.webp"),
+            buf.getvalue(),
+        )
+        text = texts[i] if i < len(texts) else b""
+        manager.save_thumbnail(
+            manager.get_pages_path(file.team, file.name, f"{page}.txt"), text, "text/plain"
+        )
+    return sizes
+
+
+def process_pages(entity_name):
+    """
+    Render every page of a PDF or office document to an image, with its text layer, in batches.
+    After each batch the manifest is updated and viewers of the file are notified, so pages
+    can be shown while the rest of the document is still being rendered.
+
+    Office documents are converted to PDF with unoconv first. Documents that can't be rendered
+    get a failed manifest, so they aren't queued again.
+    """
+    file = frappe.db.get_value(
+        "DMS File",
+        {"name": entity_name, "is_active": 1},
+        ["name", "team", "path", "mime_type"],
+        as_dict=True,
+    )
+    if not file:
+        return
+
+    manager = FileManager()
+    manifest_path = manager.get_pages_path(file.team, file.name, PAGES_MANIFEST)
+    tools = ["pdftoppm"] if file.mime_type == "application/pdf" else ["pdftoppm", "unoconv"]
+    missing = [tool for tool in tools if not shutil.which(tool)]
+    if missing:
+        fail_pages(
+            manager, manifest_path, f"{', '.join(missing)} not installed, pages cannot be rendered"
+        )
+    else:
+        try:
+            render_pages(manager, file, manifest_path)
+        except (
+            subprocess.CalledProcessError,
+            subprocess.TimeoutExpired,
+            OSError,
+            TypeError,
+            ValueError,
+        ):
+            fail_pages(manager, manifest_path, f"Page rendering failed for {file.name}")
+    frappe.cache().delete_value(f"dms-pages:{file.name}")
+
+
+def render_pages(manager, file, manifest_path):
+    with TemporaryDirectory() as work, manager.local_copy(file.path) as source:
+        work = Path(work)
+        if file.mime_type != "application/pdf":
+            run_tool("unoconv", "-f", "pdf", "-o", work / "document.pdf", source)
+            source = work / "document.pdf"
+        info = run_tool("pdfinfo", source).decode(errors="replace")
+        count = int(re.search(r"^Pages:\s+(\d+)", info, re.M)[1])
+        manifest = {"pages": count, "width": PAGE_WIDTHS[-1], "rendered": 0, "sizes": []}
+        for first in range(1, count + 1, PAGE_BATCH_SIZE):
+            last = min(first + PAGE_BATCH_SIZE - 1, count)
+            manifest["sizes"] += render_batch(manager, file, source, work, first, last)
+            manifest["rendered"] = last
+            manager.save_thumbnail(
+                manifest_path, json.dumps(manifest).encode(), "application/json"
+            )
+            frappe.publish_realtime(
+                "dms_pages_ready",
+                {"entity_name": file.name, "rendered": last},
+                doctype="DMS File",
+                docname=file.name,
+            )
+
+
+def fail_pages(manager, manifest_path, message):
+    """Log why pages can't be rendered, and record that in the manifest"""
+    frappe.log_error(message)
+    manager.save_thumbnail(
+        manifest_path, json.dumps({"failed": True}).encode(), "application/json"
+    )
+
+
+def get_pages_manifest(file):
+    """
+    Page count and sizes of a rendered document. Documents that haven't been rendered are
+    queued, and None is returned meanwhile. Only finished manifests are cached in Redis.
+
+    :param file: Dict with `name` and `team`
+    """
+    key = f"dms-pages:{file.name}"
+    manifest = frappe.cache().get_value(key)
+    if manifest is None:
+        manager = FileManager()
+        try:
+            path = manager.get_pages_path(file.team, file.name, PAGES_MANIFEST)
+            manifest = json.loads(manager.get_file(str(path)).read())
+        except FileNotFoundError:
+            enqueue_pages_job(file.name)
+            return None
+        if manifest.get("failed") or manifest["rendered"] == manifest["pages"]:
+            frappe.cache().set_value(key, manifest, expires_in_sec=24 * 60 * 60)
+    return manifest
+
+
+def read_page_image(file, page, width):
+    """
+    Read a page image. Narrower widths that don't exist yet are resized from the widest one
+    and stored next to it.
+
+    :param width: One of `PAGE_WIDTHS`
+    :raises FileNotFoundError: If the page hasn't been rendered
+    """
+    manager = FileManager()
+    path = manager.get_pages_path(file.team, file.name, f"{page}.{width}.webp")
+    try:
+        return manager.get_file(str(path)).read()
+    except FileNotFoundError:
+        if width == PAGE_WIDTHS[-1]:
+            raise
+
+    full = manager.get_file(
+        str(manager.get_pages_path(file.team, file.name, f"{page}.{PAGE_WIDTHS[-1]}.webp"))
+    )
+    with Image.open(full) as image:
+        image = image.resize((width, max(round(image.height * width / image.width), 1)))
+        buf = BytesIO()
+        image.save(buf, format="webp", quality=80)
+    manager.save_thumbnail(path, buf.getvalue())
+    return buf.getvalue()
+
+
+def read_page_text(file, page):
+    """
+    :raises FileNotFoundError: If the page hasn't been rendered
+    """
+    manager = FileManager()
+    path = manager.get_pages_path(file.team, file.name, f"{page}.txt")
+    return manager.get_file(str(path)).read().decode(errors="replace")
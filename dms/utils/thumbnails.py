@@ -0,0 +1,289 @@
+import frappe
+import json
+import math
+from io import BytesIO
+from functools import partial
+from PIL import Image
+from dms.utils.files import FileManager
+
+# Bench worker queue for thumbnails, used when it is configured under `workers`
+THUMBNAIL_QUEUE = "thumbnails"
+THUMBNAIL_JOB_ID = "dms-thumbnails"
+THUMBNAIL_BATCH_SIZE = 20
+
+# Pending entity names. Images are cheap and what users look at first, so they go ahead
+# of videos and documents, which need decoding or a LibreOffice render.
+IMAGE_QUEUE_KEY = "dms-thumbnails-images"
+DOCUMENT_QUEUE_KEY = "dms-thumbnails-documents"
+
+# Names taken by the running job, until their batch is done. If the job dies midway they are
+# left here, and the next job puts them back in front of the queue.
+PROCESSING_KEY = "dms-thumbnails-processing"
+
+# Folder sprite sheets: one small tile per file, for the first paint of a grid view
+SPRITE_TILE_SIZE = 128
+SPRITE_MAX_TILES = 256
+
+
+def get_thumbnail_queue():
+    """
+    Return the dedicated `thumbnails` queue if the bench has a worker for it, so renders never
+    hold up other jobs, and fall back to the `long` queue otherwise.
+    """
+    return THUMBNAIL_QUEUE if THUMBNAIL_QUEUE in (frappe.conf.workers or {}) else "long"
+
+
+def queue_thumbnail(file):
+    """
+    Queue a thumbnail for the file, to be rendered by a background worker once the current
+    transaction has been committed.
+
+    :param file: DMSEntity doc, or dict with `name` and `mime_type`
+    """
+    key = IMAGE_QUEUE_KEY if file.mime_type.startswith("image") else DOCUMENT_QUEUE_KEY
+    frappe.db.after_commit.add(partial(_push_thumbnail, key, file.name))
+
+
+def _push_thumbnail(key, entity_name):
+    frappe.cache().rpush(key, entity_name)
+    enqueue_thumbnail_job()
+
+
+def enqueue_thumbnail_job():
+    # A single job drains the queues - while it is queued or running, this is a no-op
+    frappe.enqueue(
+        process_thumbnail_queue,
+        queue=get_thumbnail_queue(),
+        job_id=THUMBNAIL_JOB_ID,
+        deduplicate=True,
+        timeout=None,
+    )
+
+
+def resume_thumbnail_queue():
+    """
+    Scheduled: start a job for thumbnails queued while the previous one was finishing.
+    """
+    if any(frappe.cache().llen(k) for k in (IMAGE_QUEUE_KEY, DOCUMENT_QUEUE_KEY, PROCESSING_KEY)):
+        enqueue_thumbnail_job()
+
+
+def pop_thumbnail_batch(size=THUMBNAIL_BATCH_SIZE):
+    """
+    Take up to `size` pending entity names, images first. They are moved to the processing
+    list rather than dropped, until `finish_thumbnail_batch`.
+    """
+    cache = frappe.cache()
+    batch = []
+    for key in (IMAGE_QUEUE_KEY, DOCUMENT_QUEUE_KEY):
+        while len(batch) < size:
+            name = cache.lmove(
+                cache.make_key(key), cache.make_key(PROCESSING_KEY), "LEFT", "RIGHT"
+            )
+            if name is None:
+                break
+            batch.append(name.decode() if isinstance(name, bytes) else name)
+    return list(dict.fromkeys(batch))
+
+
+def finish_thumbnail_batch():
+    frappe.cache().delete_value(PROCESSING_KEY)
+
+
+def requeue_unfinished_thumbnails():
+    """
+    Put names left by a job that died back in front of the image queue, in their order. The
+    job renders both kinds alike, the queues only set which go first.
+    """
+    cache = frappe.cache()
+    source, destination = cache.make_key(PROCESSING_KEY), cache.make_key(IMAGE_QUEUE_KEY)
+    while cache.lmove(source, destination, "RIGHT", "LEFT") is not None:
+        pass
+
+
+def process_thumbnail_queue():
+    """
+    Render queued thumbnails batch by batch until the queues are empty. Viewers of the parent
+    folder and the file's owner are notified as each one becomes available.
+    """
+    manager = FileManager()
+    # Only one job runs at a time, so anything still being processed was left by a dead one
+    requeue_unfinished_thumbnails()
+    while batch := pop_thumbnail_batch():
+        files = frappe.get_all(
+            "DMS File",
+            filters={"name": ["in", batch], "is_active": 1},
+            fields=["name", "team", "path", "mime_type", "parent_entity", "owner"],
+        )
+        for file in files:
+            if not manager.can_create_thumbnail(file) or not manager.upload_thumbnail(file):
+                continue
+            message = {"entity_name": file.name}
+            frappe.publish_realtime(
+                "dms_thumbnail_ready",
+                message,
+                doctype="DMS File",
+                docname=file.parent_entity,
+            )
+            frappe.publish_realtime("dms_thumbnail_ready", message, user=file.owner)
+            invalidate_sprite(file.parent_entity)
+        finish_thumbnail_batch()
+
+
+def invalidate_sprite(folder):
+    """
+    Queue a rebuild of the folder's sprite sheet once the current transaction is committed.
+    The previous sheet is served until then - tiles are looked up by name, so it is never
+    wrong, only incomplete.
+    """
+    if folder:
+        frappe.db.after_commit.add(partial(enqueue_sprite_job, folder))
+
+
+def enqueue_sprite_job(folder):
+    frappe.enqueue(
+        build_sprite,
+        queue=get_thumbnail_queue(),
+        job_id=f"dms-sprite-{folder}",
+        deduplicate=True,
+        folder=folder,
+    )
+
+
+def get_sprite_children(folder):
+    """
+    Files whose tiles go into a folder's sprite sheet. Everyone who can read the folder gets
+    the same sheet, so files that are private to someone else are left out.
+    """
+    filters = {
+        "parent_entity": folder.name,
+        "is_active": 1,
+        "is_group": 0,
+        "is_link": 0,
+        "is_private": folder.is_private,
+    }
+    if folder.is_private:
+        filters["owner"] = folder.owner
+    return frappe.get_all(
+        "DMS File",
+        filters=filters,
+        fields=["name", "team", "mime_type", "modified"],
+        order_by="title asc",
+        limit=SPRITE_MAX_TILES,
+    )
+
+
+def load_sprite(manager, folder):
+    """
+    :return: The folder's sprite sheet as a PIL image and its offset map, or (None, None)
+    """
+    _, map_path = manager.get_sprite_path(folder.team, folder.name, None)
+    try:
+        offsets = json.loads(manager.get_file(str(map_path)).read())
+        sprite_path, _ = manager.get_sprite_path(folder.team, folder.name, offsets["version"])
+        sprite = Image.open(BytesIO(manager.get_file(str(sprite_path)).read()))
+        sprite.load()
+    except FileNotFoundError:
+        return None, None
+    return sprite, offsets
+
+
+def build_sprite(folder):
+    """
+    Build a folder's sprite sheet: the small rendition of every child's thumbnail in one image,
+    and a map of entity name to the tile's offset in it.
+
+    Tiles of children that haven't changed since the last build are copied over from the
+    previous sheet, so only new and modified files are read from storage.
+    """
+    folder = frappe.db.get_value(
+        "DMS File", folder, ["name", "team", "is_private", "owner"], as_dict=True
+    )
+    if not folder:
+        return
+    manager = FileManager()
+    previous, previous_offsets = load_sprite(manager, folder)
+    previous_tiles = (previous_offsets or {}).get("tiles", {})
+
+    tiles = {}
+    for child in get_sprite_children(folder):
+        if not child.mime_type or not manager.can_create_thumbnail(child):
+            continue
+        modified = str(child.modified)
+        old = previous_tiles.get(child.name)
+        if old and old["v"] == modified:
+            box = (old["x"], old["y"], old["x"] + old["w"], old["y"] + old["h"])
+            tiles[child.name] = (previous.crop(box), modified)
+            continue
+        try:
+            thumbnail = manager.get_thumbnail(child.team, child.name, SPRITE_TILE_SIZE)
+        except FileNotFoundError:
+            continue
+        with Image.open(BytesIO(thumbnail.read())) as image:
+            image = image.convert("RGB")
+            image.thumbnail((SPRITE_TILE_SIZE, SPRITE_TILE_SIZE))
+            tiles[child.name] = (image, modified)
+
+    version = frappe.generate_hash(length=10)
+    sprite_path, map_path = manager.get_sprite_path(folder.team, folder.name, version)
+    columns = max(math.ceil(math.sqrt(len(tiles))), 1)
+    rows = max(math.ceil(len(tiles) / columns), 1)
+    sprite = Image.new("RGB", (columns * SPRITE_TILE_SIZE, rows * SPRITE_TILE_SIZE), "white")
+    offsets = {"tile": SPRITE_TILE_SIZE, "width": sprite.width, "height": sprite.height}
+    offsets["tiles"] = {}
+    for i, (name, (image, modified)) in enumerate(tiles.items()):
+        x, y = (i % columns) * SPRITE_TILE_SIZE, (i // columns) * SPRITE_TILE_SIZE
+        sprite.paste(image, (x, y))
+        offsets["tiles"][name] = {
+            "x": x,
+            "y": y,
+            "w": image.width,
+            "h": image.height,
+            "v": modified,
+        }
+    offsets["version"] = version
+
+    # Each version of the sheet has its own path, so a map always matches the sheet it names
+    buf = BytesIO()
+    sprite.save(buf, format="webp", quality=80)
+    manager.save_thumbnail(sprite_path, buf.getvalue())
+    manager.save_thumbnail(map_path, json.dumps(offsets).encode(), "application/json")
+    frappe.cache().delete_value(f"dms-sprite-map:{folder.name}")
+    if previous_offsets:
+        previous_path, _ = manager.get_sprite_path(
+            folder.team, folder.name, previous_offsets["version"]
+        )
+        manager.delete_thumbnail(previous_path)
+    frappe.publish_realtime(
+        "dms_sprite_ready", {"entity_name": folder.name}, doctype="DMS File", docname=folder.name
+    )
+
+
+def delete_sprite(folder):
+    manager = FileManager()
+    _, offsets = load_sprite(manager, folder)
+    _, map_path = manager.get_sprite_path(folder.team, folder.name, None)
+    if offsets:
+        sprite_path, _ = manager.get_sprite_path(folder.team, folder.name, offsets["version"])
+        manager.delete_thumbnail(sprite_path)
+    manager.delete_thumbnail(map_path)
+    frappe.cache().delete_value(f"dms-sprite-map:{folder.name}")
+
+
+def get_sprite_map(folder):
+    """
+    Offset map of a folder's sprite sheet, cached in Redis. A missing sheet is queued to be
+    built and None is returned meanwhile.
+    """
+    key = f"dms-sprite-map:{folder.name}"
+    offsets = frappe.cache().get_value(key)
+    if offsets is None:
+        manager = FileManager()
+        _, map_path = manager.get_sprite_path(folder.team, folder.name, None)
+        try:
+            offsets = json.loads(manager.get_file(str(map_path)).read())
+        except FileNotFoundError:
+            enqueue_sprite_job(folder.name)
+            return None
+        frappe.cache().set_value(key, offsets, expires_in_sec=24 * 60 * 60)
+    return offsets
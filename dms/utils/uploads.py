@@ -0,0 +1,173 @@
+import json
+import os
+import time
+import frappe
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+# Chunked uploads that see no new chunk for this long are abandoned
+UPLOAD_SESSION_EXPIRY = 24 * 60 * 60
+
+
+class UploadSession:
+    """
+    Server-side record of a chunked upload, kept in Redis.
+
+    `meta` holds everything that is fixed for the whole upload (entity name, title, storage key),
+    and the chunk ledger records each chunk that has been stored along with its byte range.
+    Chunks can therefore arrive in any order, in parallel, and an interrupted upload can ask
+    which ranges are still missing. Everything expires if no chunk arrives for
+    `UPLOAD_SESSION_EXPIRY` seconds.
+    """
+
+    def __init__(self, uuid):
+        self.uuid = uuid
+        self.meta_key = frappe.cache().make_key(f"dms-upload-{uuid}")
+        self.chunks_key = frappe.cache().make_key(f"dms-upload-{uuid}-chunks")
+        self.done_key = frappe.cache().make_key(f"dms-upload-{uuid}-done")
+
+    def lock(self):
+        """
+        Lock held while the session is set up, so that chunks sent in parallel before it
+        exists don't each create their own.
+        """
+        return frappe.cache().lock(
+            frappe.cache().make_key(f"dms-upload-{self.uuid}-lock"),
+            timeout=60,
+            blocking_timeout=60,
+        )
+
+    @property
+    def meta(self):
+        value = frappe.cache().get(self.meta_key)
+        return frappe._dict(json.loads(value)) if value else None
+
+    def create(self, meta):
+        """Store the session unless another request already has. Returns True if this one did"""
+        return bool(
+            frappe.cache().set(self.meta_key, json.dumps(meta), nx=True, ex=UPLOAD_SESSION_EXPIRY)
+        )
+
+    def record(self, index, offset, length, etag=None):
+        """
+        Add a stored chunk to the ledger and keep the session alive.
+
+        :return: Number of distinct chunks received so far
+        """
+        with frappe.cache().pipeline() as pipe:
+            pipe.hset(self.chunks_key, index, json.dumps([offset, length, etag]))
+            pipe.hlen(self.chunks_key)
+            pipe.expire(self.chunks_key, UPLOAD_SESSION_EXPIRY)
+            pipe.expire(self.meta_key, UPLOAD_SESSION_EXPIRY)
+            return pipe.execute()[1]
+
+    @property
+    def chunks(self):
+        """Dict of chunk index to (offset, length, etag)"""
+        with frappe.cache().pipeline() as pipe:
+            chunks = pipe.hgetall(self.chunks_key).execute()[0]
+        return {int(k): json.loads(v) for k, v in chunks.items()}
+
+    def received_ranges(self):
+        """Merged [start, stop) byte ranges that have been stored"""
+        ranges = []
+        for start, stop in sorted((o, o + length) for o, length, _ in self.chunks.values()):
+            if ranges and start <= ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], stop)
+            else:
+                ranges.append([start, stop])
+        return ranges
+
+    def missing_ranges(self, total_size):
+        """[start, stop) byte ranges that still have to be uploaded"""
+        missing, position = [], 0
+        for start, stop in self.received_ranges():
+            if start > position:
+                missing.append([position, start])
+            position = max(position, stop)
+        if position < total_size:
+            missing.append([position, total_size])
+        return missing
+
+    def claim(self, owner):
+        """
+        Returns True for exactly one caller - the request that gets to finish the upload. The
+        claim is held until `finish`, or dropped with `release` if finishing fails.
+        """
+        return bool(
+            frappe.cache().set(
+                self.done_key, json.dumps({"owner": owner}), nx=True, ex=UPLOAD_SESSION_EXPIRY
+            )
+        )
+
+    def release(self):
+        """Drop the claim, so that a retried chunk can finish the upload"""
+        frappe.cache().delete(self.done_key)
+
+    @property
+    def result(self):
+        """
+        Owner of a claimed upload, and the name of the entity it created once it has finished
+        """
+        value = frappe.cache().get(self.done_key)
+        return frappe._dict(json.loads(value)) if value else None
+
+    def finish(self, owner, entity_name):
+        frappe.cache().set(
+            self.done_key,
+            json.dumps({"owner": owner, "entity_name": entity_name}),
+            ex=UPLOAD_SESSION_EXPIRY,
+        )
+        frappe.cache().delete(self.meta_key, self.chunks_key)
+
+    def delete(self):
+        frappe.cache().delete(self.meta_key, self.chunks_key, self.done_key)
+
+
+def preallocate(path, size):
+    """
+    Create the file an upload is assembled in at its final size. The file is sparse until
+    chunks are written into it, and chunks can then be written at any offset in any order.
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        os.ftruncate(fd, size)
+    finally:
+        os.close(fd)
+
+
+def write_chunk(path, offset, data):
+    """
+    Write a chunk at its offset with a positional write, so concurrent chunks of the same
+    file never share a file position.
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view, offset = view[written:], offset + written
+    finally:
+        os.close(fd)
+
+
+def clear_stale_uploads():
+    """
+    Remove what abandoned chunked uploads leave behind: partial files in the teams' upload
+    folders, and unfinished S3 multipart uploads. Their Redis sessions expire on their own.
+    """
+    from dms.utils.files import FileManager
+
+    cutoff = time.time() - UPLOAD_SESSION_EXPIRY
+    for path in Path(frappe.get_site_path("private/files")).glob("*/uploads/*"):
+        if path.is_file() and path.stat().st_mtime < cutoff:
+            path.unlink(missing_ok=True)
+
+    manager = FileManager()
+    if manager.s3_enabled:
+        home_folders = frappe.get_all(
+            "DMS File", filters={"parent_entity": ["is", "not set"]}, pluck="name"
+        )
+        manager.abort_stale_multipart_uploads(
+            datetime.now(timezone.utc) - timedelta(seconds=UPLOAD_SESSION_EXPIRY), home_folders
+        )
@@ -0,0 +1,247 @@
+import frappe
+import json
+import math
+import shutil
+import subprocess
+from functools import partial
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from PIL import Image
+from dms.utils.files import FileManager
+
+VIDEO_JOB_TIMEOUT = 4 * 60 * 60
+
+# Per ffmpeg run, so a stuck one fails within the job's timeout and still records a manifest
+VIDEO_TOOL_TIMEOUT = 15 * 60
+HLS_ENCODE_TIMEOUT = 3 * 60 * 60
+
+# HLS renditions as (height, video kbps, audio kbps). Those taller than the source are skipped.
+VIDEO_RENDITIONS = ((360, 800, 96), (720, 2800, 128), (1080, 5000, 192))
+HLS_SEGMENT_SECONDS = 6
+
+# Seek previews: up to this many frames in one sheet, this wide
+STORYBOARD_MAX_FRAMES = 100
+STORYBOARD_COLUMNS = 10
+STORYBOARD_FRAME_WIDTH = 160
+
+# Written last, so its presence means every other asset is in place
+VIDEO_MANIFEST = "video.json"
+
+VIDEO_CONTENT_TYPES = {
+    ".jpg": "image/jpeg",
+    ".json": "application/json",
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".ts": "video/mp2t",
+}
+
+
+def is_video(mime_type):
+    return (mime_type or "").startswith("video")
+
+
+def queue_video(file):
+    """
+    Queue the file to be transcoded once the current transaction has been committed.
+
+    :param file: DMSEntity doc, or dict with `name`
+    """
+    frappe.db.after_commit.add(partial(enqueue_video_job, file.name))
+
+
+def enqueue_video_job(entity_name):
+    frappe.enqueue(
+        process_video,
+        queue="long",
+        job_id=f"dms-video-{entity_name}",
+        deduplicate=True,
+        timeout=VIDEO_JOB_TIMEOUT,
+        entity_name=entity_name,
+    )
+
+
+def run_ffmpeg(*args, timeout=VIDEO_TOOL_TIMEOUT):
+    return subprocess.run(args, capture_output=True, check=True, text=True, timeout=timeout).stdout
+
+
+def probe_video(path):
+    """
+    :return: Duration in seconds, height of the video stream and whether there is audio
+    """
+    args = ["ffprobe", "-v", "error", "-print_format", "json", "-show_format", "-show_streams"]
+    info = json.loads(run_ffmpeg(*args, path))
+    video = next(s for s in info["streams"] if s["codec_type"] == "video")
+    return frappe._dict(
+        duration=float(info["format"].get("duration") or video.get("duration") or 0),
+        height=int(video["height"]),
+        has_audio=any(s["codec_type"] == "audio" for s in info["streams"]),
+    )
+
+
+def render_poster(source, output, probe):
+    """
+    Frame a tenth of the way in - the first frame is often black or a title card.
+    """
+    # fmt: off
+    run_ffmpeg(
+        "ffmpeg", "-v", "error", "-y",
+        "-ss", str(probe.duration / 10), "-i", source,
+        "-frames:v", "1", "-vf", "scale=-2:'min(720,ih)'", "-q:v", "3",
+        str(output),
+    )
+    # fmt: on
+
+
+def render_storyboard(source, output, probe):
+    """
+    Frames taken at a regular interval, tiled into one image for seek previews.
+
+    :return: Where each frame is in the sheet
+    """
+    interval = max(probe.duration / STORYBOARD_MAX_FRAMES, 1)
+    count = max(min(math.ceil(probe.duration / interval), STORYBOARD_MAX_FRAMES), 1)
+    columns = min(count, STORYBOARD_COLUMNS)
+    rows = math.ceil(count / columns)
+    # fmt: off
+    run_ffmpeg(
+        "ffmpeg", "-v", "error", "-y", "-i", source,
+        "-vf", f"fps=1/{interval},scale={STORYBOARD_FRAME_WIDTH}:-2,tile={columns}x{rows}",
+        "-frames:v", "1", "-q:v", "5",
+        str(output),
+    )
+    # fmt: on
+    with Image.open(output) as image:
+        height = image.height // rows
+    return {
+        "interval": interval,
+        "count": count,
+        "columns": columns,
+        "width": STORYBOARD_FRAME_WIDTH,
+        "height": height,
+    }
+
+
+def render_hls(source, output, probe):
+    """
+    Encode every rendition in a single ffmpeg pass: the source is decoded once and split.
+    Keyframes are forced on segment boundaries so players can switch renditions between
+    any two segments.
+
+    :return: Heights of the renditions
+    """
+    renditions = [r for r in VIDEO_RENDITIONS if r[0] <= probe.height] or [
+        (probe.height - probe.height % 2,) + VIDEO_RENDITIONS[0][1:]
+    ]
+    n = len(renditions)
+    graph = f"[0:v]split={n}" + "".join(f"[v{i}]" for i in range(n))
+    graph += "".join(f";[v{i}]scale=-2:{h}[v{i}out]" for i, (h, _, _) in enumerate(renditions))
+
+    args = ["ffmpeg", "-v", "error", "-y", "-i", source, "-filter_complex", graph]
+    stream_map = []
+    for i, (height, video_rate, audio_rate) in enumerate(renditions):
+        args += ["-map", f"[v{i}out]", f"-c:v:{i}", "libx264", f"-b:v:{i}", f"{video_rate}k"]
+        args += [f"-maxrate:v:{i}", f"{video_rate * 11 // 10}k"]
+        args += [f"-bufsize:v:{i}", f"{video_rate * 2}k"]
+        stream = f"v:{i}"
+        if probe.has_audio:
+            args += ["-map", "0:a:0", f"-c:a:{i}", "aac", f"-b:a:{i}", f"{audio_rate}k"]
+            args += [f"-ac:a:{i}", "2"]
+            stream += f",a:{i}"
+        stream_map.append(f"{stream},name:{height}p")
+    # fmt: off
+    args += [
+        "-preset", "veryfast", "-pix_fmt", "yuv420p",
+        "-force_key_frames", f"expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})",
+        "-f", "hls", "-hls_time", str(HLS_SEGMENT_SECONDS), "-hls_playlist_type", "vod",
+        "-hls_flags", "independent_segments",
+        "-hls_segment_filename", str(output / "%v" / "segment_%04d.ts"),
+        "-master_pl_name", "master.m3u8",
+        "-var_stream_map", " ".join(stream_map),
+        str(output / "%v" / "index.m3u8"),
+    ]
+    # fmt: on
+    run_ffmpeg(*args, timeout=HLS_ENCODE_TIMEOUT)
+    return [height for height, _, _ in renditions]
+
+
+def process_video(entity_name):
+    """
+    Transcode a video for streaming: a poster frame, a storyboard sheet for seek previews, and
+    HLS renditions at a few bitrates, all stored in the video's folder under the team's
+    thumbnails. Players can then start on a small rendition and adapt, instead of pulling the
+    original.
+
+    A manifest describing the assets is stored last. If transcoding fails it records that
+    instead, so the video isn't queued again on every view.
+    """
+    file = frappe.db.get_value(
+        "DMS File",
+        {"name": entity_name, "is_active": 1},
+        ["name", "team", "path", "owner"],
+        as_dict=True,
+    )
+    if not file:
+        return
+
+    manager = FileManager()
+    prefix = manager.get_video_path(file.team, file.name)
+    with TemporaryDirectory() as work:
+        work = Path(work)
+        missing = [tool for tool in ("ffmpeg", "ffprobe") if not shutil.which(tool)]
+        if missing:
+            frappe.log_error(f"{', '.join(missing)} not installed, videos cannot be transcoded")
+            manifest = {"failed": True}
+        else:
+            try:
+                manifest = transcode_video(manager, file, work)
+            except (
+                subprocess.CalledProcessError,
+                subprocess.TimeoutExpired,
+                OSError,
+                StopIteration,
+                KeyError,
+                ValueError,
+            ):
+                frappe.log_error(f"Video transcoding failed for {file.name}")
+                shutil.rmtree(work, ignore_errors=True)
+                work.mkdir()
+                manifest = {"failed": True}
+        (work / VIDEO_MANIFEST).write_text(json.dumps(manifest))
+        manager.upload_directory(work, prefix, VIDEO_CONTENT_TYPES, last=VIDEO_MANIFEST)
+    frappe.cache().delete_value(f"dms-video:{file.name}")
+    frappe.publish_realtime("dms_video_ready", {"entity_name": file.name}, user=file.owner)
+
+
+def transcode_video(manager, file, work):
+    """
+    Render the video's assets into `work`.
+
+    :return: The manifest
+    """
+    with manager.local_copy(file.path) as source:
+        probe = probe_video(source)
+        render_poster(source, work / "poster.jpg", probe)
+        storyboard = render_storyboard(source, work / "storyboard.jpg", probe)
+        (work / "hls").mkdir()
+        renditions = render_hls(source, work / "hls", probe)
+    return {"duration": probe.duration, "renditions": renditions, "storyboard": storyboard}
+
+
+def get_video_manifest(file):
+    """
+    Manifest of a video's transcoded assets, cached in Redis. Videos that haven't been
+    transcoded are queued, and None is returned meanwhile.
+
+    :param file: Dict with `name` and `team`
+    """
+    key = f"dms-video:{file.name}"
+    manifest = frappe.cache().get_value(key)
+    if manifest is None:
+        manager = FileManager()
+        try:
+            path = manager.get_video_path(file.team, file.name, VIDEO_MANIFEST)
+            manifest = json.loads(manager.get_file(str(path)).read())
+        except FileNotFoundError:
+            enqueue_video_job(file.name)
+            return None
+        frappe.cache().set_value(key, manifest, expires_in_sec=24 * 60 * 60)
+    return manifest
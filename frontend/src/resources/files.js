@@ -1,4 +1,4 @@
-import { createResource } from "frappe-ui"
+import { call, createResource } from "frappe-ui"
 import { toast } from "@/utils/toasts"
 import { openEntity } from "@/utils/files"
 
@@ -24,7 +24,50 @@ export const COMMON_OPTIONS = {
   },
 }
 
-export const getHome = createResource({
+// Rows asked for per request to a listing
+export const PAGE_SIZE = 200
+
+/**
+ * A resource over a paged listing (`dms.api.list.files` or `shared`). Each fetch asks for the
+ * first page, and once it loads the next ones are fetched by passing back the `cursor` of the
+ * last row, until a short page. They are appended to `data`, and `onSuccess` is called again
+ * with all the rows so far.
+ */
+export function createPagedResource(options) {
+  let fetches = 0
+  let sent
+  const resource = createResource({
+    ...options,
+    makeParams(params) {
+      fetches++
+      sent = {
+        ...(options.makeParams ? options.makeParams(params) : params),
+        limit: PAGE_SIZE,
+      }
+      return sent
+    },
+    async onSuccess(data) {
+      options.onSuccess?.(data)
+      const current = fetches
+      const params = sent
+      let page = data
+      while (page?.length >= PAGE_SIZE) {
+        page = await call(options.url, {
+          ...params,
+          cursor: page[page.length - 1].cursor,
+        })
+        // A newer fetch replaces the listing
+        if (current !== fetches) return
+        if (options.transform) page = options.transform(page)
+        await resource.setData((d) => [...(d || []), ...page])
+        options.onSuccess?.(resource.data)
+      }
+    },
+  })
+  return resource
+}
+
+export const getHome = createPagedResource({
   ...COMMON_OPTIONS,
   url: "dms.api.list.files",
   makeParams: (params) => {
@@ -45,7 +88,7 @@ export const getTeams = createResource({
   cache: "teams",
 })
 
-export const getRecents = createResource({
+export const getRecents = createPagedResource({
   ...COMMON_OPTIONS,
   url: "dms.api.list.files",
   cache: "recents-folder-contents",
@@ -54,7 +97,7 @@ export const getRecents = createResource({
   },
 })
 
-export const getPersonal = createResource({
+export const getPersonal = createPagedResource({
   ...COMMON_OPTIONS,
   url: "dms.api.list.files",
   cache: "personal-folder-contents",
@@ -63,7 +106,7 @@ export const getPersonal = createResource({
   },
 })
 
-export const getFavourites = createResource({
+export const getFavourites = createPagedResource({
   ...COMMON_OPTIONS,
   url: "dms.api.list.files",
   cache: "favourite-folder-contents",
@@ -72,7 +115,7 @@ export const getFavourites = createResource({
   },
 })
 
-export const getShared = createResource({
+export const getShared = createPagedResource({
   ...COMMON_OPTIONS,
   url: "dms.api.list.shared",
   cache: "shared-folder-contents",
@@ -81,7 +124,7 @@ export const getShared = createResource({
   },
 })
 
-export const getTrash = createResource({
+export const getTrash = createPagedResource({
   ...COMMON_OPTIONS,
   url: "dms.api.list.files",
   cache: "trash-folder-contents",
@@ -117,7 +160,7 @@ export const updateMoved = (new_parent, team) => {
   if (new_parent && team) {
     // All details are repetetively provided (check Folder.vue) because if this is run first
     // No further mutation of the resource object can take place
-    createResource({
+    createPagedResource({
       ...COMMON_OPTIONS,
       url: "dms.api.list.files",
       makeParams: (params) => ({
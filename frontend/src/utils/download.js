@@ -50,12 +50,9 @@ export function entitiesDownload(team, entities) {
   const processEntity = async (entity, parentFolder) => {
     if (entity.is_group) {
       const folder = parentFolder.folder(entity.title)
-      return get_children(team, entity.name).then((children) => {
-        const promises = children.map((childEntity) =>
-          processEntity(childEntity, folder)
-        )
-        return Promise.all(promises)
-      })
+      return get_children(entity.name).then((children) =>
+        temp(children, entity.name, folder)
+      )
     } else if (entity.document) {
       const content = await getPdfFromDoc(entities[0].name)
       parentFolder.file(entity.title + ".pdf", content)
@@ -89,7 +86,8 @@ export function folderDownload(team, root_entity) {
   const folderName = root_entity.title
   const zip = new JSZip()
   const rootFolder = zip.folder(root_entity.title)
-  temp(team, root_entity.name, rootFolder)
+  get_children(root_entity.name)
+    .then((children) => temp(children, root_entity.name, rootFolder))
     .then(() => {
       return zip.generateAsync({ type: "blob", streamFiles: true })
     })
@@ -107,38 +105,23 @@ export function folderDownload(team, root_entity) {
     })
 }
 
-function temp(team, entity_name, parentZip) {
-  return new Promise((resolve, reject) => {
-    get_children(team, entity_name)
-      .then((result) => {
-        const promises = result.map((entity) => {
-          if (entity.is_group) {
-            const folder = parentZip.folder(entity.title)
-            return temp(team, entity.name, folder)
-          }
-          if (entity.document) {
-            getPdfFromDoc(entity.name).then((content) =>
-              parentZip.file(entity.title + ".pdf", content)
-            )
-          } else {
-            return get_file_content(entity.name).then((fileContent) => {
-              parentZip.file(entity.title, fileContent)
-            })
-          }
-        })
-
-        Promise.all(promises)
-          .then(() => {
-            resolve()
-          })
-          .catch((error) => {
-            reject(error)
-          })
-      })
-      .catch((error) => {
-        reject(error)
+function temp(children, entity_name, parentZip) {
+  const promises = (children[entity_name] || []).map((entity) => {
+    if (entity.is_group) {
+      const folder = parentZip.folder(entity.title)
+      return temp(children, entity.name, folder)
+    }
+    if (entity.document) {
+      getPdfFromDoc(entity.name).then((content) =>
+        parentZip.file(entity.title + ".pdf", content)
+      )
+    } else {
+      return get_file_content(entity.name).then((fileContent) => {
+        parentZip.file(entity.title, fileContent)
       })
+    }
   })
+  return Promise.all(promises)
 }
 
 function get_file_content(entity_name) {
@@ -157,10 +140,10 @@ function get_file_content(entity_name) {
   })
 }
 
-function get_children(team, entity_name) {
+// The contents of every folder inside this one, from a single request
+function get_children(entity_name) {
   const url =
-    "/api/method/" +
-    `dms.api.list.files?team=${team}&entity_name=${entity_name}`
+    "/api/method/" + `dms.api.list.folder_tree?entity_name=${entity_name}`
   return fetch(url, {
     method: "GET",
     headers: {
@@ -175,5 +158,11 @@ function get_children(team, entity_name) {
       }
       return response.json()
     })
-    .then((json) => json.message)
+    .then((json) => {
+      const children = {}
+      for (const entity of json.message) {
+        ;(children[entity.parent_entity] ||= []).push(entity)
+      }
+      return children
+    })
 }
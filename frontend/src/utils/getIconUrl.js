@@ -5,15 +5,22 @@ export function getIconUrl(file_type) {
   )
 }
 
-export function getThumbnailUrl(name, file_type) {
+// `size` is the thumbnail's longest side on screen, in CSS pixels. Passing the
+// file's `modified` lets the browser cache the thumbnail until it changes.
+export function getThumbnailUrl(name, file_type, size, modified) {
   const HTML_THUMBNAILS = ["Markdown", "Code", "Text", "Document"]
   const IMAGE_THUMBNAILS = ["Image", "Video", "PDF", "Presentation"]
   const is_image = IMAGE_THUMBNAILS.includes(file_type)
   const iconURL = getIconUrl(file_type.toLowerCase())
   if (!is_image && !HTML_THUMBNAILS.includes(file_type))
     return [null, iconURL, true]
+  const sizeParam =
+    size && is_image
+      ? `&size=${Math.round(size * (window.devicePixelRatio || 1))}`
+      : ""
+  const versionParam = modified ? `&v=${encodeURIComponent(modified)}` : ""
   return [
-    `/api/method/dms.api.files.get_thumbnail?entity_name=${name}`,
+    `/api/method/dms.api.files.get_thumbnail?entity_name=${name}${sizeParam}${versionParam}`,
     iconURL,
     is_image,
   ]